@@ -0,0 +1,241 @@
+"""
+Runtime Benchmark
+
+Runs the same simulated device pipeline on the gevent dataflow runtime
+and on the asyncio runtime (nile_test.aio), and reports the CPU time and
+memory each takes per 1k devices. Each device is a GammaPusher reading
+one reading per cycle, on average every --interval seconds, and writing
+it to a Sink:
+
+ * null - a Sink counting the records, measuring the runtime alone
+ * http - an HTTPClient posting to a local aiohttp server, which runs
+   in its own process so its CPU time is not counted
+
+Each runtime runs in its own process, as the gevent runtime imports
+locust, which monkey patches the standard library.
+
+    python benchmarks/runtime_benchmark.py --devices 1000 10000 50000
+    python benchmarks/runtime_benchmark.py --devices 1000 --sink http
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+RUNTIMES = ('gevent', 'asyncio')
+
+
+class Readings:
+    """ A Source of one device's readings """
+
+    def __init__(self, device):
+        self.device = device
+        self.count = 0
+
+    def read(self, num=1):
+        records = []
+        for _ in range(num):
+            self.count += 1
+            records.append({'data': f'{self.device},{self.count}'})
+        return records
+
+
+class Counter:
+    """ A Sink counting the records written to it """
+
+    def __init__(self):
+        self.records = 0
+
+    def write(self, records):
+        self.records += len(records)
+        return True
+
+
+def pusher_arguments(interval):
+    """ A cycle delay averaging interval seconds, with no retries """
+    return {'quantity': 1, 'retry_shape': 1, 'retry_scale': 1e-6,
+            'cycle_shape': 4, 'cycle_scale': interval / 4}
+
+
+def make_sink(args, runtime):
+    if args.sink == 'null':
+        return Counter()
+    if runtime == 'gevent':
+        from nile_test.dataflow.http_client import HTTPClient
+    else:
+        from nile_test.aio.http_client import HTTPClient
+    return HTTPClient(method='POST', url=args.url)
+
+
+def count_requests(runtime):
+    """ Returns a list whose first item counts reported requests """
+    counted = [0]
+
+    def on_request(**kwargs):
+        counted[0] += 1
+
+    if runtime == 'gevent':
+        from locust import events
+    else:
+        from nile_test import aio as events
+    events.request_success += on_request
+    events.request_failure += on_request
+    return counted
+
+
+def run_gevent(args):
+    from locust import events  # noqa: F401, monkey patches first
+    import gevent
+    from nile_test.dataflow import _reset
+    from nile_test.dataflow.pushers import GammaPusher
+
+    sink = make_sink(args, 'gevent')
+    counted = count_requests('gevent')
+    began = time.process_time()
+    for device in range(args.devices):
+        GammaPusher(Readings(device), sink,
+                    **pusher_arguments(args.interval)).start()
+    started = time.process_time() - began
+
+    gevent.sleep(args.warmup)
+    measured = measure(lambda: gevent.sleep(args.duration), sink, counted)
+    _reset()
+    return started, measured
+
+
+def run_asyncio(args):
+    from nile_test.aio import shutdown
+    from nile_test.aio.pushers import GammaPusher
+
+    async def run():
+        sink = make_sink(args, 'asyncio')
+        counted = count_requests('asyncio')
+        began = time.process_time()
+        for device in range(args.devices):
+            GammaPusher(Readings(device), sink,
+                        **pusher_arguments(args.interval)).start()
+        started = time.process_time() - began
+
+        await asyncio.sleep(args.warmup)
+        measured = await measure_async(args.duration, sink, counted)
+        await shutdown()
+        if args.sink == 'http':
+            from nile_test.aio.http_client import close_default_session
+            await close_default_session()
+        return started, measured
+
+    return asyncio.run(run())
+
+
+def sent(sink, counted):
+    return sink.records if isinstance(sink, Counter) else counted[0]
+
+
+def measure(wait, sink, counted):
+    """ Returns the CPU seconds and records sent while waiting """
+    records = sent(sink, counted)
+    began = time.process_time()
+    wait()
+    return time.process_time() - began, sent(sink, counted) - records
+
+
+async def measure_async(duration, sink, counted):
+    """ Returns the CPU seconds and records sent while sleeping """
+    records = sent(sink, counted)
+    began = time.process_time()
+    await asyncio.sleep(duration)
+    return time.process_time() - began, sent(sink, counted) - records
+
+
+def child(args):
+    """ Runs one runtime and prints its results as JSON """
+    run = run_gevent if args.child == 'gevent' else run_asyncio
+    started, (cpu, records) = run(args)
+    print(json.dumps({
+        'start_cpu': started,
+        'cpu': cpu,
+        'records': records,
+        # Linux reports the peak resident set size in KiB
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        / 1024
+    }))
+
+
+def serve(port):
+    from aiohttp import web
+
+    async def handle(request):
+        await request.read()
+        return web.Response(text='ok')
+
+    app = web.Application()
+    app.router.add_post('/', handle)
+    web.run_app(app, host='localhost', port=port, print=None,
+                handle_signals=False)
+
+
+def start_server(port):
+    process = multiprocessing.Process(target=serve, args=(port,),
+                                      daemon=True)
+    process.start()
+    time.sleep(1)
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--devices', type=int, nargs='+', default=[1000])
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='average seconds between readings of a device')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--sink', choices=('null', 'http'), default='null')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--child', choices=RUNTIMES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.url = f'http://localhost:{args.port}/'
+
+    if args.child:
+        args.devices = args.devices[0]
+        return child(args)
+
+    server = start_server(args.port) if args.sink == 'http' else None
+    print(f'{args.sink} sink, a reading per device every {args.interval}s, '
+          f'measured over {args.duration}s')
+    print(f'{"runtime":>8} {"devices":>8} {"records/s":>10} '
+          f'{"start ms/1k":>12} {"CPU %/1k":>9} {"CPU us/rec":>11} '
+          f'{"RSS MB":>8}')
+    try:
+        for devices in args.devices:
+            for runtime in RUNTIMES:
+                output = subprocess.run(
+                    [sys.executable, __file__, '--child', runtime,
+                     '--devices', str(devices),
+                     '--interval', str(args.interval),
+                     '--duration', str(args.duration),
+                     '--warmup', str(args.warmup),
+                     '--sink', args.sink, '--port', str(args.port)],
+                    check=True, capture_output=True, text=True
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                per_1k = 1000 / devices
+                print(f'{runtime:>8} {devices:>8} '
+                      f'{result["records"] / args.duration:>10,.0f} '
+                      f'{result["start_cpu"] * 1000 * per_1k:>12.1f} '
+                      f'{result["cpu"] / args.duration * 100 * per_1k:>9.2f} '
+                      f'{result["cpu"] / max(result["records"], 1) * 1e6:>11.1f} '
+                      f'{result["max_rss_mb"]:>8.0f}')
+    finally:
+        if server is not None:
+            server.terminate()
+
+
+if __name__ == '__main__':
+    main()
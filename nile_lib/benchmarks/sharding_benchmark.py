@@ -0,0 +1,100 @@
+"""
+Sharding Benchmark
+
+Runs simulated devices with a ShardLauncher on an increasing number of
+processes, and reports the requests per second the launching process
+receives from them. Each device is a GammaPusher sending a reading about
+every --interval seconds to a Sink that reports it as a request, so the
+devices are limited by CPU rather than by a server. With enough devices
+to saturate a core, requests per second should grow with the processes
+until every core is busy or the launching process cannot keep up.
+
+    python benchmarks/sharding_benchmark.py --devices 50000 --processes 1 2 4
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from locust import events  # noqa: E402
+from gevent import sleep  # noqa: E402
+from interface import implements  # noqa: E402
+
+from nile_test.dataflow import Sink  # noqa: E402
+from nile_test.dataflow.buffers import CircularReadBuffer  # noqa: E402
+from nile_test.dataflow.pushers import GammaPusher  # noqa: E402
+from nile_test.dataflow.sharding import ShardLauncher  # noqa: E402
+
+INTERVAL = float(os.environ.get('NILE_BENCHMARK_INTERVAL', '1.0'))
+
+
+class ReportingSink(implements(Sink)):
+    """ A Sink reporting each record as a successful request """
+
+    def write(self, records):
+        for record in records:
+            events.request_success.fire(
+                request_type='POST',
+                name='/readings',
+                response_time=1.0,
+                response_length=len(record['data'])
+            )
+        return True
+
+
+def build_device(device):
+    """ The pipeline factory of the benchmark's devices """
+    readings = CircularReadBuffer([{'data': f'{device},{n}'}
+                                   for n in range(4)])
+    GammaPusher(readings, ReportingSink(), quantity=1,
+                retry_shape=1, retry_scale=1e-6,
+                cycle_shape=4, cycle_scale=INTERVAL / 4).start()
+
+
+def run(devices, processes, warmup, duration):
+    """ Returns the requests per second received from the shards """
+    received = [0]
+
+    def on_request(**kwargs):
+        received[0] += 1
+
+    events.request_success += on_request
+    launcher = ShardLauncher(build_device, devices, processes=processes)
+    try:
+        launcher.start()
+        sleep(warmup)
+        before = received[0]
+        sleep(duration)
+        return (received[0] - before) / duration
+    finally:
+        launcher.stop()
+        events.request_success -= on_request
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--devices', type=int, default=50000)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--interval', type=float, default=INTERVAL,
+                        help='average seconds between readings of a device')
+    parser.add_argument('--warmup', type=float, default=5.0,
+                        help='seconds for the shards to start their devices')
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    # The shards read the interval from the environment they inherit
+    os.environ['NILE_BENCHMARK_INTERVAL'] = str(args.interval)
+
+    print(f'{args.devices} devices, a reading each every {args.interval}s, '
+          f'{os.cpu_count()} CPUs')
+    print(f'{"processes":>9} {"requests/s":>11} {"of target":>10}')
+    target = args.devices / args.interval
+    for processes in args.processes:
+        rate = run(args.devices, processes, args.warmup, args.duration)
+        print(f'{processes:>9} {rate:>11,.0f} {rate / target:>10.0%}')
+
+
+if __name__ == '__main__':
+    main()
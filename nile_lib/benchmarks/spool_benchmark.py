@@ -0,0 +1,88 @@
+"""
+Spool Benchmark
+
+Writes request records shaped like DataBuffer's to a Spool in batches,
+reads them back and commits them, and reports the records per second of
+each phase. The spool must keep up with at least 100k records/sec.
+
+    python benchmarks/spool_benchmark.py --records 1000000
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nile_test.integration.spool import Spool  # noqa: E402
+
+
+def make_records(count):
+    """ Creates records shaped like those buffered by DataBuffer """
+    now = datetime.datetime.now()
+    return [{
+        'request_method': 'GET',
+        'name': f'/endpoint/{i % 10}',
+        'response_time': 12.5 + i % 100,
+        'response_length': 512,
+        'success': i % 50 != 0,
+        'exception': None if i % 50 else 'ConnectionError()',
+        'request_timestamp': (
+            now + datetime.timedelta(microseconds=i)
+        ).isoformat(),
+        'request_length': 128,
+        'status_code': 200 if i % 50 else 500
+    } for i in range(count)]
+
+
+def rate(count, seconds):
+    return f'{count / seconds:>12,.0f} records/s'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--records', type=int, default=500000)
+    parser.add_argument('--batch', type=int, default=21,
+                        help='records per write, a full DataBuffer buffer')
+    parser.add_argument('--read-batch', type=int, default=500)
+    parser.add_argument('--fsync', action='store_true',
+                        help='fsync after every write')
+    parser.add_argument('--dir', help='spool directory (default: temporary)')
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    batches = [records[i:i + args.batch]
+               for i in range(0, len(records), args.batch)]
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        spool = Spool(directory, fsync=args.fsync)
+
+        start = time.perf_counter()
+        for batch in batches:
+            spool.write(batch)
+            if args.fsync:
+                spool.flush()
+        spool.flush()
+        write_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        read = 0
+        while True:
+            chunk = spool.read(args.read_batch)
+            if not chunk:
+                break
+            read += len(chunk)
+            spool.commit()
+        read_time = time.perf_counter() - start
+        spool.close()
+
+    assert read == len(records)
+    print(f'Spooled {len(records):,} records in batches of {args.batch}')
+    print(f'  write:          {rate(len(records), write_time)}')
+    print(f'  read + commit:  {rate(len(records), read_time)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+The devices of iot_example.py run on every core with a ShardLauncher,
+outside of locust. Requires examples/dummy_server.py to be running.
+
+    python examples/sharded_iot_example.py --devices 1000
+    python examples/sharded_iot_example.py --devices 1000 --nile localhost:5000
+
+With --nile, a test is started on the Nile server and every shard's
+requests are uploaded to it. Stopping the example with Ctrl+C uploads
+the last requests and finalizes the test.
+"""
+import argparse
+import os
+import sys
+sys.path.append(os.path.abspath(".."))
+
+from gevent import sleep  # noqa: E402
+from locust import events  # noqa: E402
+
+from nile_test.dataflow.buffers import CircularReadBuffer, Buffer  # noqa: E402
+from nile_test.dataflow.pushers import DeterministicPusher,\
+    GammaPusher  # noqa: E402
+from nile_test.dataflow.disconnect_adapter \
+    import GammaDisconnectAdapter  # noqa: E402
+from nile_test.dataflow.http_client import HTTPClient  # noqa: E402
+from nile_test.dataflow.sharding import ShardLauncher  # noqa: E402
+
+
+def build_device(device):
+    """
+    The pipeline of DataFlowBehavior.on_start in iot_example.py,
+    built once for each device in the shard processes
+    """
+    # Base Sources/Sinks
+    data = [{"data": f"{device},{num}"} for num in range(1024)]
+    test_data = CircularReadBuffer(data)
+    device1 = Buffer()
+    device2 = Buffer()
+    server = HTTPClient(method="POST", url="http://localhost:8000")
+
+    # Data Generation
+    gen_worker = DeterministicPusher(test_data, device1,
+                                     retry_delay=0.00001, cycle_delay=0.1)
+
+    # Device Link
+    link_connect = GammaDisconnectAdapter(device2,
+                                          time_until_shape=2,
+                                          duration_shape=1)
+    link_worker = GammaPusher(device1, link_connect,
+                              quantity=16,
+                              retry_shape=0.00001, cycle_shape=0.5)
+
+    # Server Upload
+    upload_connect = GammaDisconnectAdapter(server,
+                                            time_until_shape=2,
+                                            duration_shape=1)
+    upload_worker = GammaPusher(device2, upload_connect,
+                                quantity=32,
+                                retry_shape=0.00001, cycle_shape=0.5)
+
+    # Run Workers
+    gen_worker.start()
+    link_worker.start()
+    upload_worker.start()
+    link_connect.start()
+    upload_connect.start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--nile", help="the Nile server to upload requests to")
+    args = parser.parse_args()
+
+    launcher = ShardLauncher(build_device, args.devices,
+                             processes=args.processes)
+    launcher.start()
+
+    if args.nile:
+        # Starts the test, and uploads every shard's requests to it
+        # from this process alone
+        from nile_test.integration import TestManager
+        TestManager(args.nile, sample_host=True, sample_pids=launcher.pids)
+
+    try:
+        while True:
+            sleep(1)
+            print(f"Nile: Stats Update {launcher.stats()}")
+    except KeyboardInterrupt:
+        # Stops the shards, then uploads their last requests
+        # and finalizes the test, as locust does when it quits
+        events.quitting.fire()
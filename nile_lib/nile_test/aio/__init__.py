@@ -0,0 +1,155 @@
+"""
+# Asyncio Dataflow Module
+
+An alternate runtime for dataflow pipelines built on asyncio instead of
+gevent, for driving simulated devices outside of locust.
+It mirrors the dataflow module, so a pipeline moves between runtimes by
+importing its components from nile_test.aio instead of nile_test.dataflow:
+
+ * Source/Sink - read() and write() are coroutines
+ * Worker - runs as an asyncio Task on the running event loop
+ * pushers - DataPusher, DeterministicPusher and GammaPusher
+ * disconnect_adapter - DisconnectAdapter and its Deterministic/Gamma kinds
+ * http_client - an HTTPClient backed by aiohttp
+
+Components of this module also accept the Sources and Sinks of the
+dataflow module, such as its Buffers, as they never block. Importing the
+dataflow module imports locust however, which monkey patches the standard
+library for gevent, so pipelines meant to run outside of locust should
+not use them.
+
+Nothing here imports locust or gevent. Requests are reported through the
+request_success and request_failure EventHooks of this module, which take
+the same arguments as locust's events of the same name.
+"""
+import asyncio
+import inspect
+
+from interface import Interface
+
+
+class Source(Interface):
+    """
+    A Source is something that data can be read from
+    """
+
+    async def read(self, num=1):
+        """
+        Read data from a Source
+
+        Arguments
+         * num - the maximum number of elements to read
+
+        Returns a list of values read
+        """
+        pass
+
+
+class Sink(Interface):
+    """
+    A Sink is something that data can be written to
+    """
+
+    async def write(self, records):
+        """
+        Send data to a Sink
+
+        Arguments:
+         * records - an iterable of record values
+
+        Returns True if all values could be written
+        Returns False if any value could not be written
+
+        See nile_test.dataflow.Sink for the full contract
+        """
+        pass
+
+
+async def settle(value):
+    """
+    Returns the result of a call to a Source or Sink of either runtime,
+    awaiting it if the call was to a coroutine
+    """
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class EventHook:
+    """
+    A list of handlers called with the keyword arguments an event is
+    fired with, used like locust's EventHook:
+
+        request_success += handler
+        request_success.fire(request_type="GET", ...)
+    """
+
+    def __init__(self):
+        self._handlers = []
+
+    def __iadd__(self, handler):
+        self._handlers.append(handler)
+        return self
+
+    def __isub__(self, handler):
+        self._handlers.remove(handler)
+        return self
+
+    def fire(self, **kwargs):
+        for handler in self._handlers:
+            handler(**kwargs)
+
+
+# Fired with request_type, name, response_time and response_length
+request_success = EventHook()
+
+# Fired with the arguments of request_success and exception
+request_failure = EventHook()
+
+
+# The Tasks of all running workers
+_worker_tasks = set()
+
+
+class Worker:
+    """
+    A Worker is a simple wrapper around an asyncio Task
+
+    Subclasses must define a run() coroutine to describe
+    their behavior.
+    This is only called once so repeated behavior must
+    use their own loops.
+
+    Using asyncio.sleep will not block other workers
+    and can be used to achieve delay behaviors
+    """
+
+    def start(self):
+        """
+        Call from within an event loop to start the Worker in its own Task
+        """
+        self.task = asyncio.get_running_loop().create_task(self.run())
+        _worker_tasks.add(self.task)
+        self.task.add_done_callback(_worker_tasks.discard)
+
+    def stop(self):
+        """
+        Cancels the Worker's Task
+        """
+        self.task.cancel()
+
+    async def run(self):
+        """
+        The worker logic
+        """
+        raise RuntimeError("Unimplemented")
+
+
+async def shutdown():
+    """
+    Cancels every running worker and waits for them to finish
+    """
+    tasks = list(_worker_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
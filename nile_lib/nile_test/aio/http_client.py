@@ -0,0 +1,231 @@
+"""
+The asyncio version of nile_test.dataflow.http_client, sending requests
+with aiohttp, which must be installed to use it.
+"""
+import asyncio
+import datetime
+import weakref
+from time import perf_counter_ns
+from collections import ChainMap
+
+import aiohttp
+from interface import implements
+
+from . import Sink, request_success, request_failure
+
+
+async def _on_connect_start(session, context, params):
+    context.connect_began = perf_counter_ns()
+
+
+async def _on_connect_end(session, context, params):
+    context.trace_request_ctx['connect_ns'] += \
+        perf_counter_ns() - context.connect_began
+
+
+def _trace_config():
+    """ Counts the time each request spends opening connections """
+    config = aiohttp.TraceConfig()
+    config.on_connection_create_start.append(_on_connect_start)
+    config.on_connection_create_end.append(_on_connect_end)
+    return config
+
+
+def create_session(max_connections=10, max_hosts=0, keep_alive=True,
+                   timeout=(10, 30)):
+    """
+    Creates an aiohttp ClientSession holding keep-alive connections,
+    configured like nile_test.dataflow.http_client.ConnectionPool
+
+    Arguments:
+     * max_connections - the maximum number of connections kept open
+        to each host
+     * max_hosts - the maximum number of connections in total,
+        0 for no limit
+     * keep_alive - if False, connections are closed after every request
+     * timeout - the seconds to wait for a connection and then for the
+        response, as a (connect, read) tuple or a single number
+    """
+    if not isinstance(timeout, tuple):
+        timeout = (timeout, timeout)
+
+    connector = aiohttp.TCPConnector(limit=max_hosts,
+                                     limit_per_host=max_connections,
+                                     force_close=not keep_alive)
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(connect=timeout[0],
+                                      sock_read=timeout[1]),
+        trace_configs=[_trace_config()]
+    )
+
+
+# The default session of each event loop
+_default_sessions = weakref.WeakKeyDictionary()
+
+
+def default_session():
+    """
+    Returns the session shared by HTTPClients of the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _default_sessions:
+        _default_sessions[loop] = create_session()
+    return _default_sessions[loop]
+
+
+async def close_default_session():
+    """ Closes the default session of the running event loop """
+    session = _default_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+def _ms(nanoseconds):
+    return nanoseconds / 1e6
+
+
+class HTTPClient(implements(Sink)):
+    """
+    An HTTPClient is a Sink that sends data
+    written to it to the specified server
+
+    It takes the same arguments and records as
+    nile_test.dataflow.http_client.HTTPClient, and reports requests through
+    the request_success and request_failure events of nile_test.aio
+    """
+
+    def __init__(self, session=None, concurrency=1, batch=False, **defaults):
+        """
+        Creates an HTTPClient
+
+        Arguments:
+         * session - the aiohttp ClientSession to send requests with,
+            see create_session(), by default the session shared by every
+            HTTPClient of the running event loop
+         * concurrency - the maximum number of requests this client
+            sends at the same time
+         * batch - if True, each batch of records is sent as a JSON
+            array in a single request
+         The other keyword arguments provided act as duplicates for the
+         fields read from records written to this client.
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        self.session = session
+        self.concurrency = concurrency
+        self.batch = batch
+        self.in_flight = asyncio.Semaphore(concurrency)
+        self.defaults = defaults
+
+    async def write(self, records):
+        """
+        Sends records to an HTTP server,
+        see nile_test.dataflow.http_client.HTTPClient.write()
+
+        Always returns True, requests which fail are reported
+        through the request_failure event.
+        """
+        if self.batch:
+            await self._write_batch(records)
+        elif self.concurrency > 1:
+            await asyncio.gather(*(self._write_one(record)
+                                   for record in records))
+        else:
+            for record in records:
+                await self._write_one(record)
+        return True
+
+    async def _write_one(self, record):
+        optionals = {
+            "params": {},
+            "data": None,
+            "headers": {}
+        }
+        record = ChainMap(record, self.defaults, optionals)
+
+        if "method" not in record:
+            raise ValueError("Must provide 'method'")
+
+        if "url" not in record:
+            raise ValueError("Must provide 'url'")
+
+        await self._send(record["method"], record["url"],
+                         params=record["params"],
+                         data=record["data"],
+                         headers=record["headers"])
+
+    async def _write_batch(self, records):
+        body = [record["data"] for record in records
+                if isinstance(record, dict) and "data" in record]
+        if not body:
+            return
+
+        if "url" not in self.defaults:
+            raise ValueError("Must provide 'url'")
+
+        await self._send(self.defaults.get("method", "POST"),
+                         self.defaults["url"],
+                         params=self.defaults.get("params", {}),
+                         json=body,
+                         headers=self.defaults.get("headers", {}))
+
+    async def _send(self, method, url, **kwargs):
+        """
+        Sends a request and reports it, timed as by the gevent HTTPClient
+        """
+        session = self.session or default_session()
+
+        async with self.in_flight:
+            trace = {"connect_ns": 0}
+            time_sent = datetime.datetime.now()
+            began = perf_counter_ns()
+
+            try:
+                async with session.request(method, url,
+                                           trace_request_ctx=trace,
+                                           **kwargs) as response:
+                    first_byte = perf_counter_ns()
+                    content = await response.read()
+            except (OSError, ValueError, aiohttp.ClientError,
+                    asyncio.TimeoutError) as error:
+                # Connection errors and timeouts are failed requests too
+                request_failure.fire(
+                    request_type=method,
+                    name=url,
+                    response_time=_ms(perf_counter_ns() - began),
+                    response_length=0,
+                    exception=error,
+                    request_timestamp=time_sent.isoformat(),
+                    connect_time=_ms(trace["connect_ns"])
+                )
+                return
+
+            finished = perf_counter_ns()
+
+        timing = {
+            "response_time": _ms(finished - began),
+            "response_length": len(content),
+            "request_timestamp": time_sent.isoformat(),
+            "request_length": int(response.request_info.headers.get(
+                "Content-Length", 0)),
+            "status_code": response.status,
+            "connect_time": _ms(trace["connect_ns"]),
+            "first_byte_time": _ms(first_byte - began)
+        }
+
+        if response.ok:
+            request_success.fire(
+                request_type=method,
+                name=url,
+                **timing
+            )
+        else:
+            request_failure.fire(
+                request_type=method,
+                name=url,
+                exception=RuntimeError(
+                    f"Request failed with {response.status} {content}"),
+                **timing
+            )
@@ -115,7 +115,7 @@ class Worker:
         """
         Call to start the Worker in its own gevent
         """
-        _worker_group.spawn(self.run)
+        self.greenlet = _worker_group.spawn(self.run)
 
     def run(self):
         """
@@ -1,7 +1,13 @@
-import time
-from requests import request, HTTPError
+import datetime
+import threading
+from time import perf_counter_ns
+from requests import Session, HTTPError
+from requests.adapters import HTTPAdapter
 from collections import ChainMap
 from interface import implements
+from gevent.pool import Pool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
 
 from locust import events
@@ -9,21 +15,174 @@ from locust import events
 from . import Sink
 
 
+# Nanoseconds spent opening connections by the current request, the
+# thread local is greenlet local once locust has monkey patched threading
+_timing = threading.local()
+
+
+class _ConnectTimer:
+    """ Counts the time spent connecting, including any TLS handshake """
+
+    def connect(self):
+        began = perf_counter_ns()
+        try:
+            super().connect()
+        finally:
+            _timing.connect_ns = getattr(_timing, 'connect_ns', 0) \
+                + perf_counter_ns() - began
+
+
+class _TimedHTTPConnection(_ConnectTimer, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_ConnectTimer, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+    """ An HTTPAdapter whose connections count their connect time """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool
+        }
+
+
+def _ms(nanoseconds):
+    return nanoseconds / 1e6
+
+
+class ConnectionPool:
+    """
+    A ConnectionPool holds keep-alive connections to HTTP servers that
+    HTTPClients send their requests over, so a connection (and its TLS
+    handshake) is reused by many requests instead of opened for each one.
+
+    HTTPClients share the default pool of their process unless given
+    their own. Waiting on a connection or a response yields to other
+    greenlets, as locust monkey patches sockets for gevent.
+    """
+
+    def __init__(self, max_connections=10, max_hosts=10, block=True,
+                 keep_alive=True, timeout=(10, 30), retries=0):
+        """
+        Creates a ConnectionPool
+
+        Arguments:
+         * max_connections - the maximum number of connections kept open
+            to each host
+         * max_hosts - the number of hosts connections are kept open to,
+            connections to the least recently used host are closed
+            beyond this
+         * block - if True, a request waits for a connection to the host
+            to be free when max_connections are in use, otherwise an
+            extra connection is opened and closed after the request
+         * keep_alive - if False, connections are closed after every
+            request, as they were before pooling
+         * timeout - the seconds to wait for a connection and then for the
+            response, as a (connect, read) tuple or a single number
+         * retries - the number of times a failed connection is retried
+        """
+        self.timeout = timeout
+        self.session = Session()
+        self.adapter = _TimedAdapter(pool_connections=max_hosts,
+                                     pool_maxsize=max_connections,
+                                     pool_block=block,
+                                     max_retries=retries)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request over a pooled connection, taking the
+        arguments of requests.request()
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def stats(self):
+        """
+        Returns the connections opened, requests sent and idle
+        connections for each host, as a dictionary keyed by
+        'scheme://host:port'
+        """
+        pools = self.adapter.poolmanager.pools
+        stats = {}
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            # Free slots of the queue hold None until a connection is put back
+            idle = list(pool.pool.queue) if pool.pool is not None else []
+            stats[f'{key.key_scheme}://{key.key_host}:{key.key_port}'] = {
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle': sum(conn is not None for conn in idle)
+            }
+        return stats
+
+    def close(self):
+        """ Closes every pooled connection """
+        self.session.close()
+
+
+_default_pool = None
+
+
+def default_pool():
+    """ Returns the ConnectionPool shared by HTTPClients of this process """
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = ConnectionPool()
+    return _default_pool
+
+
 class HTTPClient(implements(Sink)):
     """
     An HTTPClient is a Sink that sends data
     written to it to the specified server
+
+    By default the records of a batch are sent one after another.
+    With a concurrency above 1 they are sent at the same time, up to
+    that many requests in flight for the client. With batch=True each
+    batch is sent as one request instead, see HTTPClient.write().
     """
 
-    def __init__(self, **defaults):
+    def __init__(self, pool=None, concurrency=1, batch=False, **defaults):
         """
         Creates an HTTPClient
 
         Arguments:
-         The keyword arguments provided act as duplicates for the fields
-         read from records written to this client.
+         * pool - the ConnectionPool to send requests over, by default
+            the pool shared by every HTTPClient of this process
+         * concurrency - the maximum number of requests this client
+            sends at the same time
+         * batch - if True, each batch of records is sent as a JSON
+            array in a single request
+         The other keyword arguments provided act as duplicates for the
+         fields read from records written to this client.
          For more info see HTTPClient.write()
         """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        self.pool = pool if pool is not None else default_pool()
+        self.concurrency = concurrency
+        self.batch = batch
+        self.in_flight = Pool(concurrency) if concurrency > 1 else None
         self.defaults = defaults
 
     def write(self, records):
@@ -43,9 +202,29 @@ class HTTPClient(implements(Sink)):
          * params - a dictionary of query string parameters
          * data - data to be sent in the body of the request
          * headers - a dictionary of HTTP headers
+
+        In batch mode the records are not overlayed, instead a single
+        request is sent with the method (POST unless given), url, params
+        and headers of the defaults, and a JSON array of the data field
+        of each record as its body.
+
+        Returns once every request is answered. Always returns True,
+        requests which fail are reported through locust's
+        request_failure event.
         """
-        for record in records:
-            self._write_one(record)
+        if self.batch:
+            self._write_batch(records)
+        elif self.in_flight is not None:
+            # Each greenlet reports its own request, map() waits for all
+            self.in_flight.map(self._write_one, records)
+        else:
+            for record in records:
+                self._write_one(record)
+        return True
+
+    def stats(self):
+        """ Returns the stats of the connection pool, see ConnectionPool """
+        return self.pool.stats()
 
     def _write_one(self, record):
         optionals = {
@@ -61,38 +240,89 @@ class HTTPClient(implements(Sink)):
         if "url" not in record:
             raise ValueError("Must provide 'url'")
 
-        time_sent = time.time()
+        self._send(record["method"], record["url"],
+                   params=record["params"],
+                   data=record["data"],
+                   headers=record["headers"])
+
+    def _write_batch(self, records):
+        body = [record["data"] for record in records
+                if isinstance(record, dict) and "data" in record]
+        if not body:
+            return
+
+        if "url" not in self.defaults:
+            raise ValueError("Must provide 'url'")
+
+        self._send(self.defaults.get("method", "POST"),
+                   self.defaults["url"],
+                   params=self.defaults.get("params", {}),
+                   json=body,
+                   headers=self.defaults.get("headers", {}))
+
+    def _send(self, method, url, **kwargs):
+        """
+        Sends a request and reports it through locust's events
 
-        response = request(record["method"], record["url"],
-                           params=record["params"], data=record["data"],
-                           headers=record["headers"])
+        Times are measured with perf_counter_ns() and reported in
+        milliseconds: response_time from sending the request until its
+        body is read, connect_time spent opening a connection (0 when one
+        is reused) and first_byte_time until the response headers arrive.
+        """
+        time_sent = datetime.datetime.now()
+        _timing.connect_ns = 0
+        began = perf_counter_ns()
 
-        response_time = time.time() - time_sent
+        try:
+            response = self.pool.request(method, url, stream=True, **kwargs)
+            first_byte = perf_counter_ns()
+            content = response.content
+        except (OSError, ValueError) as error:
+            # Connection errors and timeouts are failed requests too
+            events.request_failure.fire(
+                request_type=method,
+                name=url,
+                response_time=_ms(perf_counter_ns() - began),
+                response_length=0,
+                exception=error,
+                request_timestamp=time_sent.isoformat(),
+                connect_time=_ms(_timing.connect_ns)
+            )
+            return
+
+        finished = perf_counter_ns()
+        body = response.request.body
+        timing = {
+            "response_time": _ms(finished - began),
+            "response_length": len(content),
+            "request_timestamp": time_sent.isoformat(),
+            "request_length": len(body) if body is not None else 0,
+            "status_code": response.status_code,
+            "connect_time": _ms(_timing.connect_ns),
+            "first_byte_time": _ms(first_byte - began)
+        }
 
         if response.ok:
             events.request_success.fire(
-                request_type=record["method"],
-                name=record["url"],
-                response_time=response_time,
-                response_length=len(response.content),
+                request_type=method,
+                name=url,
+                **timing
             )
         else:
             try:
                 response.raise_for_status()
 
                 events.request_failure.fire(
-                    request_type=record["method"],
-                    name=record["url"],
-                    response_time=response_time,
-                    response_length=len(response.content),
+                    request_type=method,
+                    name=url,
                     exception=RuntimeError(
-                        f"Request failed with {response.content}")
+                        f"Request failed with {content}"),
+                    **timing
                 )
             except HTTPError as error:
                 events.request_failure.fire(
-                    request_type=record["method"],
-                    name=record["url"],
-                    response_time=response_time,
-                    response_length=len(response.content),
-                    exception=error
+                    request_type=method,
+                    name=url,
+                    exception=error,
+                    **timing
                 )
@@ -0,0 +1,231 @@
+"""
+Sharding
+
+Every dataflow Worker of a process shares one gevent hub, so the devices
+of a simulation are limited to one CPU core. A ShardLauncher runs them on
+every core instead: it splits the devices between shard processes, each
+of which builds its devices with a pipeline factory and runs them on its
+own hub.
+
+The requests of every shard are sent back to the launching process and
+fired through locust's request_success and request_failure events there,
+so locust's stats, a DataBuffer and any other listeners of the launching
+process see the requests of all devices as a single stream.
+"""
+import multiprocessing
+import os
+import pickle
+import signal
+
+from gevent import sleep
+from gevent.socket import wait_read
+from locust import events
+
+from . import Worker, _reset
+
+# Sent by a shard once it has stopped
+_STOPPED = None
+
+
+def _portable(exception):
+    """ Returns the exception, or a RuntimeError if it cannot be pickled """
+    try:
+        pickle.dumps(exception)
+        return exception
+    except Exception:
+        return RuntimeError(str(exception))
+
+
+def _run_shard(factory, devices, connection, report_interval):
+    """
+    Runs in a shard process: builds and starts each device with the factory,
+    then sends the requests they make to the launcher every report_interval
+    until the launcher asks it to stop
+    """
+    # Pipes are socket pairs, which are non-blocking once gevent patches them
+    os.set_blocking(connection.fileno(), True)
+    # Ctrl+C reaches every process of the terminal's process group,
+    # the launcher stops its shards once they have sent their requests
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    reports = []
+
+    def on_success(**kwargs):
+        reports.append((True, kwargs))
+
+    def on_failure(exception, **kwargs):
+        reports.append((False, dict(kwargs, exception=_portable(exception))))
+
+    events.request_success += on_success
+    events.request_failure += on_failure
+
+    for device in devices:
+        factory(device)
+
+    try:
+        while not connection.poll():
+            sleep(report_interval)
+            if reports:
+                connection.send(reports)
+                reports = []
+    finally:
+        _reset()
+        try:
+            if reports:
+                connection.send(reports)
+            connection.send(_STOPPED)
+        except OSError:
+            # The launcher has exited
+            pass
+        connection.close()
+
+
+class _ShardReader(Worker):
+    """ Fires the requests sent by one shard through locust's events """
+
+    def __init__(self, shard):
+        self.shard = shard
+
+    def run(self):
+        connection = self.shard['connection']
+        while True:
+            wait_read(connection.fileno())
+            try:
+                reports = connection.recv()
+            except EOFError:
+                reports = _STOPPED
+
+            if reports is _STOPPED:
+                self.shard['stopped'] = True
+                return
+
+            for success, kwargs in reports:
+                if success:
+                    self.shard['requests'] += 1
+                    events.request_success.fire(**kwargs)
+                else:
+                    self.shard['failures'] += 1
+                    events.request_failure.fire(**kwargs)
+
+
+class ShardLauncher:
+    """
+    A ShardLauncher runs the devices of a simulation in several processes
+
+    The pipeline factory is called once for every device, with the device's
+    index, in the shard process running it. It must build the device's
+    pipeline and start its Workers, as DataFlowBehavior.on_start does in
+    examples/iot_example.py. Shard processes are spawned rather than forked,
+    so the factory must be a function defined at the top level of a module,
+    and that module must not start a test or a DataBuffer when imported.
+    """
+
+    def __init__(self, factory, devices, processes=None, report_interval=0.5):
+        """
+        Creates a ShardLauncher
+
+        Arguments:
+         * factory - the pipeline factory, called with each device index
+            from 0 to devices - 1
+         * devices - the number of devices to simulate
+         * processes - the number of shard processes, by default the
+            number of CPUs, and never more than the number of devices
+         * report_interval - the time in seconds between each shard
+            sending its requests to the launcher
+        """
+        if devices < 1:
+            raise ValueError("devices must be at least 1")
+
+        processes = processes or os.cpu_count() or 1
+        self.factory = factory
+        self.devices = devices
+        self.processes = min(processes, devices)
+        self.report_interval = report_interval
+        self.shards = []
+
+    def start(self):
+        """
+        Starts the shard processes, and the Workers firing their requests
+        """
+        context = multiprocessing.get_context('spawn')
+        per_shard, extra = divmod(self.devices, self.processes)
+        first = 0
+
+        for index in range(self.processes):
+            count = per_shard + (1 if index < extra else 0)
+            devices = range(first, first + count)
+            first += count
+
+            connection, child = context.Pipe()
+            process = context.Process(
+                target=_run_shard,
+                args=(self.factory, devices, child, self.report_interval),
+                daemon=True
+            )
+            process.start()
+            child.close()
+            # Messages are read whole once wait_read() finds one arriving
+            os.set_blocking(connection.fileno(), True)
+
+            shard = {
+                'process': process,
+                'connection': connection,
+                'devices': devices,
+                'requests': 0,
+                'failures': 0,
+                'stopped': False
+            }
+            self.shards.append(shard)
+            shard['reader'] = _ShardReader(shard)
+            shard['reader'].start()
+
+        events.quitting += self.stop
+
+    @property
+    def pids(self):
+        """
+        The process IDs of the shards, for example to sample them
+        with a HostSampler
+        """
+        return [shard['process'].pid for shard in self.shards]
+
+    def stop(self, timeout=5):
+        """
+        Stops every shard, waiting up to timeout seconds for each to send
+        its last requests before it is terminated
+        """
+        for shard in self.shards:
+            if not shard['stopped']:
+                try:
+                    shard['connection'].send(_STOPPED)
+                except OSError:
+                    pass
+
+        for shard in self.shards:
+            waited = 0
+            while not shard['stopped'] and waited < timeout:
+                sleep(0.05)
+                waited += 0.05
+            shard['process'].join(1 if shard['stopped'] else 0.1)
+            if shard['process'].is_alive():
+                shard['process'].terminate()
+            shard['reader'].greenlet.kill()
+            shard['connection'].close()
+
+    def stats(self):
+        """
+        Returns the number of successful and failed requests received from
+        each shard, and in total
+        """
+        shards = [{
+            'pid': shard['process'].pid,
+            'devices': len(shard['devices']),
+            'requests': shard['requests'],
+            'failures': shard['failures'],
+            'running': shard['process'].is_alive() and not shard['stopped']
+        } for shard in self.shards]
+
+        return {
+            'requests': sum(shard['requests'] for shard in shards),
+            'failures': sum(shard['failures'] for shard in shards),
+            'shards': shards
+        }
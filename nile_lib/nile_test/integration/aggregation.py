@@ -0,0 +1,173 @@
+"""
+Request Aggregation
+
+Pre-aggregates request data on the slave so that only a summary of each
+fixed time window is uploaded, rather than every individual request.
+
+Requests are grouped by (request_method, name, status_code, success).
+Each group keeps a count, the sum, min and max of its response times and
+a LatencySketch of them. The sketch uses the same format as the Nile
+server's sketches, so the server can merge them into its own.
+"""
+import datetime
+import math
+
+# Default relative accuracy of quantile estimates
+RELATIVE_ACCURACY = 0.01
+
+# Values at or below this are counted in the zero bucket
+MIN_VALUE = 1e-9
+
+
+class LatencySketch:
+    """
+    A DDSketch: values are counted in logarithmically sized buckets,
+    so every quantile estimate is within a fixed relative error, and
+    sketches with the same accuracy merge by adding bucket counts
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        """
+        Creates an empty LatencySketch
+
+        Arguments:
+         * relative_accuracy - the maximum relative error of estimates
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """ Adds a value to the sketch """
+        if value <= MIN_VALUE:
+            self.zero_count += 1
+        else:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + 1
+
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, fraction):
+        """
+        Estimates the value at a quantile, or None if the sketch is empty
+
+        Arguments:
+         * fraction - the quantile as a fraction between 0 and 1
+        """
+        if self.count == 0:
+            return None
+
+        rank = fraction * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return self.min
+
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+
+        return self.max
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'bins': {str(key): count for key, count in self.bins.items()},
+            'zero_count': self.zero_count,
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max
+        }
+
+
+class WindowAggregator:
+    """
+    A WindowAggregator groups request data into fixed length time windows
+    """
+
+    def __init__(self, window=1.0):
+        """
+        Creates a WindowAggregator
+
+        Arguments:
+         * window - the length of each window in seconds
+        """
+        self.window = window
+        self.windows = {}
+
+    def add(self, timestamp, request_method, name, status_code,
+            success, response_time):
+        """
+        Adds a request to the window containing its timestamp
+
+        Arguments:
+         * timestamp - the time the request was made in seconds since epoch
+         * request_method, name, status_code, success - the group
+            the request belongs to
+         * response_time - the response time of the request
+        """
+        index = int(timestamp // self.window)
+        groups = self.windows.setdefault(index, {})
+        key = (request_method, name, status_code, success)
+
+        if key not in groups:
+            groups[key] = LatencySketch()
+        groups[key].add(response_time)
+
+    def has_closed(self, now):
+        """
+        Whether any window has ended by the time now
+
+        Arguments:
+         * now - the current time in seconds since epoch
+        """
+        current = int(now // self.window)
+        return any(index < current for index in self.windows)
+
+    def flush(self, now=None):
+        """
+        Removes the windows which have ended and returns their summaries.
+        If now is None, every window is flushed.
+
+        Arguments:
+         * now - the current time in seconds since epoch
+        """
+        current = None if now is None else int(now // self.window)
+        closed = sorted(index for index in self.windows
+                        if current is None or index < current)
+
+        summaries = []
+        for index in closed:
+            window_start = datetime.datetime.fromtimestamp(
+                index * self.window).isoformat()
+
+            for key, sketch in self.windows.pop(index).items():
+                request_method, name, status_code, success = key
+                summaries.append({
+                    'window_start': window_start,
+                    'window_seconds': self.window,
+                    'request_method': request_method,
+                    'name': name,
+                    'status_code': status_code,
+                    'success': success,
+                    'count': sketch.count,
+                    'total': sketch.total,
+                    'min': sketch.min,
+                    'max': sketch.max,
+                    'sketch': sketch.to_dict()
+                })
+
+        return summaries
@@ -2,42 +2,151 @@
 """
 import requests
 import datetime
+import os
+import random
+import time
 from locust import events
 
+from .aggregation import WindowAggregator
+from .hostsampler import HostSampler
+from .metricbuffer import MetricBuffer
+from .spool import Spool, SpoolUploader
+from .uploader import Uploader, MSGPACK
+
 
 class DataBuffer:
     """
     """
 
-    def __init__(self, hostname, *args, buffer_limit=20, **kwargs):
+    def __init__(self, hostname, *args, buffer_limit=20, flush_interval=1.0,
+                 max_pending=100, spool_dir=None, wire_format=MSGPACK,
+                 compress=False, aggregate=False, window=1.0,
+                 sample_rate=0.0, sample_host=False, sample_interval=1.0,
+                 sample_pids=(), **kwargs):
         """
         Creates and starts a DataBuffer that stores request data
         so that it can be sent in batches to the server.
-        Data is uploaded when the buffer_limit is reached,
-        or the test completes
+        Data is uploaded when the buffer_limit is reached, every
+        flush_interval, or when the test completes.
+
+        Uploads are made by background Uploaders, so recording a request
+        never waits on the Nile server. If the server falls behind and
+        max_pending batches are waiting, further batches are dropped
+        and counted in stats().
+
+        Arguments:
+         * hostname - the hostname of the Nile server
+         * buffer_limit - the number of requests buffered before uploading
+         * flush_interval - the maximum time in seconds a request
+            is buffered before uploading
+         * max_pending - the number of batches that can wait to be
+            uploaded before new batches are dropped
+         * spool_dir - if given, requests are written to a Spool in this
+            directory and replayed from it, so none are dropped and
+            any not uploaded when the test ends are uploaded by the
+            next DataBuffer using the same directory
+         * wire_format - the format requests are uploaded in, MSGPACK
+            (the default) for the compact format of wire.py, which falls
+            back to JSON if the server does not support it
+         * compress - if True, MSGPACK uploads are gzip compressed
+         * aggregate - if True, only summaries of each window of requests
+            are uploaded instead of every request
+         * window - the length of an aggregation window in seconds
+         * sample_rate - the fraction of requests that are also uploaded
+            individually when aggregating
+         * sample_host - if True, the CPU, memory and network usage of
+            this machine and process are sampled from /proc and uploaded
+            as system metrics of the test. The server only accepts
+            metrics while a test is running, so the test must be started
+            before this DataBuffer and finalized after it quits
+         * sample_interval - the time in seconds between host samples
+         * sample_pids - the IDs of other processes sampled along with
+            this one, such as the shards of a ShardLauncher
         """
         print("Nile: Initializing Data Buffer")
         self.hostname = hostname
         self.buffer_limit = buffer_limit
 
         self.data_endpoint = f'http://{hostname}/api/v1/requests'
+        self.windows_endpoint = f'http://{hostname}/api/v1/requests/windows'
         self.buffer = list()
 
+        self.aggregator = WindowAggregator(window) if aggregate else None
+        self.sample_rate = sample_rate
+
+        # One keep-alive session is shared by every upload
+        self.session = requests.Session()
+        if spool_dir is not None:
+            self.uploader = SpoolUploader(self.data_endpoint,
+                                          Spool(spool_dir),
+                                          collect=self._take_buffer,
+                                          flush_interval=flush_interval,
+                                          session=self.session,
+                                          wire_format=wire_format,
+                                          compress=compress)
+        else:
+            self.uploader = Uploader(self.data_endpoint,
+                                     collect=self._take_buffer,
+                                     flush_interval=flush_interval,
+                                     max_pending=max_pending,
+                                     session=self.session,
+                                     wire_format=wire_format,
+                                     compress=compress)
+        self.uploader.start()
+
+        self.quitting = False
+        self.window_uploader = None
+        if self.aggregator is not None:
+            # Windows are collected as soon as they have ended
+            self.window_uploader = Uploader(
+                self.windows_endpoint,
+                collect=self._take_windows,
+                flush_interval=window,
+                max_pending=max_pending,
+                session=self.session)
+            self.window_uploader.start()
+
+        self.metric_buffer = None
+        self.sampler = None
+        if sample_host:
+            self._start_sampler(sample_interval, flush_interval,
+                                max_pending, wire_format, compress,
+                                sample_pids)
+
         events.request_success += self.request_success
         events.request_failure += self.request_failure
         events.quitting += self.on_quitting
 
+    def _start_sampler(self, interval, flush_interval, max_pending,
+                       wire_format, compress, pids=()):
+        """ Starts sampling the host into a MetricBuffer, if possible """
+        self.metric_buffer = MetricBuffer(self.hostname,
+                                          flush_interval=flush_interval,
+                                          max_pending=max_pending,
+                                          session=self.session,
+                                          wire_format=wire_format,
+                                          compress=compress)
+        try:
+            self.sampler = HostSampler(self.metric_buffer, interval,
+                                       pids=[os.getpid(), *pids],
+                                       system_name=self.metric_buffer
+                                       .system_name)
+        except OSError as e:
+            print(f'Nile: Host sampling unavailable: {e}')
+            return
+        self.sampler.start()
+
     def request_success(self, request_type, name,
                         response_time, response_length, **kwargs):
 
         self._on_request_data(request_type, name, response_time,
-                              response_length, True, None)
+                              response_length, True, None, **kwargs)
 
     def request_failure(self, request_type, name, response_time,
                         response_length, exception, **kwargs):
 
         self._on_request_data(request_type, name, response_time,
-                              response_length, False, exception)
+                              response_length, False, exception, **kwargs)
 
     def _on_request_data(self, request_type, name, response_time,
                          response_length, success, exception, **kwargs):
@@ -48,10 +157,12 @@ class DataBuffer:
           'response_time': response_time,
           'response_length': response_length,
           'success': success,
-          'exception': exception}
+          'exception': None if exception is None else str(exception)}
 
         if 'request_timestamp' in kwargs:
             data['request_timestamp'] = kwargs['request_timestamp']
+            request_time = datetime.datetime.fromisoformat(
+                kwargs['request_timestamp'])
         else:
             request_time = datetime.datetime.now() \
                            - datetime.timedelta(milliseconds=response_time)
@@ -67,21 +178,55 @@ class DataBuffer:
         else:
             data['status_code'] = None
 
+        if self.aggregator is not None:
+            self.aggregator.add(request_time.timestamp(), request_type, name,
+                                data['status_code'], success, response_time)
+
+            # Only a sample of requests is kept individually
+            if random.random() >= self.sample_rate:
+                return
+            data['sampled'] = True
+
         self.buffer.append(data)
-        if len(self.buffer) > 20:
-            self._upload_buffer()
+        if len(self.buffer) > self.buffer_limit:
+            self.uploader.submit(self._take_buffer())
 
-    def on_quitting(self):
-        print('Nile: Handling Test Shutdown')
-        self._upload_buffer()
+    def _take_buffer(self):
+        """ Removes and returns the buffered requests """
+        buffer = self.buffer
+        self.buffer = list()
+        return buffer
 
-    def _upload_buffer(self):
-        print('Nile: Uploading Buffer with size ' + str(len(self.buffer)))
-        requests_endpoint = f'http://{self.hostname}/api/v1/requests'
+    def _take_windows(self):
+        """
+        Removes and returns the summaries of the windows that have ended,
+        or of every window once the test is finishing
+        """
+        return self.aggregator.flush(None if self.quitting else time.time())
 
-        response = requests.post(requests_endpoint, json=self.buffer)
-        if response.status_code != 200:
-            raise RuntimeError(f'Could not upload buffer after test \
-                shutdown {response}')
+    def on_quitting(self):
+        """
+        Uploads the remaining data, the upload workers have
+        already been stopped so this is done synchronously
+        """
+        print('Nile: Handling Test Shutdown')
+        self.quitting = True
+        for uploader in self._uploaders():
+            uploader.flush()
+        print(f'Nile: Upload stats {self.stats()}')
 
-        self.buffer = list()
+    def stats(self):
+        """
+        Returns the number of requests (or windows when aggregating)
+        uploaded, dropped because uploads fell behind, failed to upload,
+        and waiting to be uploaded
+        """
+        totals = {}
+        for uploader in self._uploaders():
+            for key, value in uploader.stats().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _uploaders(self):
+        return [uploader for uploader in (self.uploader, self.window_uploader)
+                if uploader is not None]
@@ -0,0 +1,183 @@
+"""
+HostSampler
+
+A HostSampler measures the resources used on the machine generating load,
+so saturation of a slave can be told apart from a slow system under test.
+It reads the host's CPU, memory, load and network counters and the CPU
+and memory of chosen processes from /proc, and writes them as system
+metric records to a Sink such as a MetricBuffer.
+
+The /proc files are opened once and re-read from the start on every
+sample, so sampling costs a few reads and no process spawning. Counters
+such as CPU time and network bytes are reported as rates over the last
+interval, so they are reported from the second sample onwards.
+"""
+import datetime
+import os
+import socket
+import time
+
+from gevent import sleep
+
+from ..dataflow import Worker
+
+_clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class HostSampler(Worker):
+    """
+    A Worker writing samples of host and process resource usage
+    to a Sink every interval
+    """
+
+    def __init__(self, sink, interval=1.0, pids=None, system_name=None,
+                 proc='/proc'):
+        """
+        Creates a HostSampler, it must be started to sample in the
+        background. Raises OSError if /proc cannot be read.
+
+        Arguments:
+         * sink - the Sink metric records are written to
+         * interval - the time in seconds between samples
+         * pids - the IDs of the processes to sample, by default
+            this process
+         * system_name - the system the metrics are recorded for, by
+            default the hostname. Process metrics are recorded for
+            '<system_name>/<pid>'
+         * proc - the mount point of procfs
+        """
+        self.sink = sink
+        self.interval = interval
+        self.system_name = system_name or socket.gethostname()
+        self.proc = proc
+        self.pids = list(pids) if pids is not None else [os.getpid()]
+
+        self.files = {}
+        self.previous = None
+        for name in ('stat', 'meminfo', 'loadavg', 'net/dev'):
+            self._read(name)
+
+    def _read(self, name):
+        """ Reads a file under /proc, keeping it open for the next read """
+        f = self.files.get(name)
+        if f is None:
+            f = self.files[name] = open(os.path.join(self.proc, name))
+        f.seek(0)
+        return f.read()
+
+    def _counters(self):
+        """ Reads the counters which are reported as rates """
+        fields = self._read('stat').split('\n', 1)[0].split()[1:]
+        jiffies = [int(value) for value in fields]
+        # idle and iowait
+        idle = jiffies[3] + (jiffies[4] if len(jiffies) > 4 else 0)
+
+        received = sent = 0
+        for line in self._read('net/dev').splitlines()[2:]:
+            interface, values = line.split(':', 1)
+            if interface.strip() == 'lo':
+                continue
+            values = values.split()
+            received += int(values[0])
+            sent += int(values[8])
+
+        processes = {}
+        for pid in self.pids:
+            try:
+                stat = self._read(f'{pid}/stat')
+                # The command name may hold spaces, fields follow it
+                fields = stat[stat.rindex(')') + 2:].split()
+                statm = self._read(f'{pid}/statm').split()
+            except (OSError, ValueError):
+                # The process has exited
+                self._forget(pid)
+                continue
+            processes[pid] = (int(fields[11]) + int(fields[12]),
+                              int(statm[1]) * _page_size)
+
+        return {
+            'time': time.monotonic(),
+            'cpu_total': sum(jiffies),
+            'cpu_idle': idle,
+            'cpu_iowait': jiffies[4] if len(jiffies) > 4 else 0,
+            'net_rx': received,
+            'net_tx': sent,
+            'processes': processes
+        }
+
+    def _forget(self, pid):
+        for name in (f'{pid}/stat', f'{pid}/statm'):
+            f = self.files.pop(name, None)
+            if f is not None:
+                f.close()
+
+    def sample(self):
+        """
+        Takes one sample and returns its metric records, holding
+        metric_name, metric_value, metric_timestamp and system_name
+        """
+        timestamp = datetime.datetime.now().isoformat()
+        records = []
+
+        def add(name, value, system_name=self.system_name):
+            records.append({
+                'metric_name': name,
+                'metric_value': value,
+                'metric_timestamp': timestamp,
+                'system_name': system_name
+            })
+
+        meminfo = {}
+        for line in self._read('meminfo').splitlines():
+            key, value = line.split(':', 1)
+            meminfo[key] = int(value.split()[0])
+        total = meminfo['MemTotal']
+        available = meminfo.get('MemAvailable', meminfo.get('MemFree', 0))
+        add('memory_used_percent', 100.0 * (total - available) / total)
+        add('memory_available_mb', available / 1024)
+        add('load_1', float(self._read('loadavg').split()[0]))
+
+        current = self._counters()
+        previous, self.previous = self.previous, current
+        if previous is None:
+            return records
+
+        elapsed = current['time'] - previous['time']
+        ticks = current['cpu_total'] - previous['cpu_total']
+        if ticks > 0:
+            idle = current['cpu_idle'] - previous['cpu_idle']
+            iowait = current['cpu_iowait'] - previous['cpu_iowait']
+            add('cpu_percent', 100.0 * (ticks - idle) / ticks)
+            add('cpu_iowait_percent', 100.0 * iowait / ticks)
+        if elapsed > 0:
+            add('net_rx_bytes_per_s',
+                (current['net_rx'] - previous['net_rx']) / elapsed)
+            add('net_tx_bytes_per_s',
+                (current['net_tx'] - previous['net_tx']) / elapsed)
+
+        for pid, (cpu_ticks, rss) in current['processes'].items():
+            system_name = f'{self.system_name}/{pid}'
+            if pid in previous['processes'] and elapsed > 0:
+                used = cpu_ticks - previous['processes'][pid][0]
+                add('process_cpu_percent',
+                    100.0 * used / _clock_ticks / elapsed, system_name)
+            add('process_rss_mb', rss / (1024 * 1024), system_name)
+
+        return records
+
+    def run(self):
+        deadline = time.monotonic()
+        while True:
+            try:
+                self.sink.write(self.sample())
+            except (OSError, ValueError, KeyError) as e:
+                print(f'Nile: Host sampling failed with exception: {e}')
+            deadline += self.interval
+            sleep(max(0, deadline - time.monotonic()))
+
+    def close(self):
+        """ Closes the /proc files kept open """
+        for f in self.files.values():
+            f.close()
+        self.files = {}
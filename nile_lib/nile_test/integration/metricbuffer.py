@@ -0,0 +1,122 @@
+"""
+MetricBuffer
+
+A MetricBuffer is the DataBuffer of system metrics: it buffers metrics
+such as CPU or memory usage recorded on a host, and uploads them to the
+Nile server in batches from a background Uploader, instead of posting
+every metric on its own.
+"""
+import datetime
+import socket
+
+import requests
+from interface import implements
+from locust import events
+
+from ..dataflow import Sink
+from .uploader import Uploader, MSGPACK
+from .wire import encode_metric_batch
+
+
+class MetricBuffer(implements(Sink)):
+    """
+    A Sink of system metrics which are uploaded to the Nile server
+    """
+
+    def __init__(self, hostname, *, system_name=None, buffer_limit=500,
+                 flush_interval=1.0, max_pending=100, wire_format=MSGPACK,
+                 compress=False, session=None):
+        """
+        Creates and starts a MetricBuffer. Metrics are uploaded when the
+        buffer_limit is reached, every flush_interval, or when the test
+        completes.
+
+        Arguments:
+         * hostname - the hostname of the Nile server
+         * system_name - the name of the system metrics are recorded
+            for, by default the hostname of this machine
+         * buffer_limit - the number of metrics buffered before uploading
+         * flush_interval - the maximum time in seconds a metric
+            is buffered before uploading
+         * max_pending - the number of batches that can wait to be
+            uploaded before new batches are dropped
+         * wire_format - the format metrics are uploaded in, MSGPACK
+            (the default) for the compact format of wire.py, which falls
+            back to JSON if the server does not support it
+         * compress - if True, MSGPACK uploads are gzip compressed
+         * session - the requests.Session to upload with
+        """
+        self.hostname = hostname
+        self.system_name = system_name or socket.gethostname()
+        self.buffer_limit = buffer_limit
+        self.metrics_endpoint = f'http://{hostname}/api/v1/metrics'
+        self.buffer = list()
+
+        self.uploader = Uploader(self.metrics_endpoint,
+                                 collect=self._take_buffer,
+                                 flush_interval=flush_interval,
+                                 max_pending=max_pending,
+                                 session=session or requests.Session(),
+                                 wire_format=wire_format,
+                                 compress=compress,
+                                 encode=encode_metric_batch)
+        self.uploader.start()
+
+        events.quitting += self.on_quitting
+
+    def record(self, metric_name, metric_value, metric_timestamp=None,
+               system_name=None):
+        """
+        Buffers one metric
+
+        Arguments:
+         * metric_name - the name of the metric, e.g. 'cpu_percent'
+         * metric_value - the value of the metric
+         * metric_timestamp - when the value was measured, a datetime or
+            ISO formatted string, by default now
+         * system_name - the system measured, by default that of the
+            MetricBuffer
+        """
+        if metric_timestamp is None:
+            metric_timestamp = datetime.datetime.now()
+        if isinstance(metric_timestamp, datetime.datetime):
+            metric_timestamp = metric_timestamp.isoformat()
+
+        self.buffer.append({
+            'system_name': system_name or self.system_name,
+            'metric_name': metric_name,
+            'metric_timestamp': metric_timestamp,
+            'metric_value': float(metric_value)
+        })
+        if len(self.buffer) >= self.buffer_limit:
+            self.uploader.submit(self._take_buffer())
+
+    def write(self, records):
+        """
+        Buffers metric records, dictionaries holding the arguments
+        of record(). Always returns True.
+        """
+        for record in records:
+            self.record(**record)
+        return True
+
+    def _take_buffer(self):
+        """ Removes and returns the buffered metrics """
+        buffer = self.buffer
+        self.buffer = list()
+        return buffer
+
+    def on_quitting(self):
+        """
+        Uploads the remaining metrics, the upload worker has
+        already been stopped so this is done synchronously
+        """
+        self.uploader.flush()
+        print(f'Nile: Metric upload stats {self.stats()}')
+
+    def stats(self):
+        """
+        Returns the number of metrics uploaded, dropped because uploads
+        fell behind, failed to upload, and waiting to be uploaded
+        """
+        return self.uploader.stats()
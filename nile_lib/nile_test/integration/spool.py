@@ -0,0 +1,379 @@
+"""
+Spool
+
+A Spool is an append-only log of records on local disk, so request data
+survives the Nile server being down, or the slave itself restarting.
+
+Each batch of records written is JSON encoded as one array, and appended
+to the current segment file with a little-endian header holding its
+length in bytes and its number of records. Segments are rotated once they
+reach segment_size. Encoding whole batches rather than single records is
+what lets the spool keep up with well over 100k records per second.
+Readers move a read position through the log and commit it once the
+records read have been uploaded; the committed position is saved in a
+cursor file, and segments before it are deleted. Reopening a spool
+resumes from its last committed position.
+
+A SpoolUploader is an Uploader that writes batches to a Spool and
+replays the spool to the server from its worker.
+"""
+import json
+import os
+import struct
+import time
+
+import requests
+from gevent import sleep
+from interface import implements
+
+from ..dataflow import Source, Sink
+from .uploader import Uploader
+
+# Header of each batch: its length in bytes and number of records
+_header = struct.Struct('<II')
+
+# Bytes read from a segment at a time
+_read_ahead = 1024 * 1024
+
+# Reusing one encoder avoids building a new one for every record
+_encoder = json.JSONEncoder(separators=(',', ':'))
+_decoder = json.JSONDecoder()
+
+_suffix = '.seg'
+_cursor = 'cursor'
+
+# Statuses of batches the server rejects as invalid, which fail again
+# whenever they are sent. The server answers 409 while no test can take
+# a batch and 503 when it cannot save one, and these are retried.
+REJECTED = (400, 413, 415, 422)
+
+
+class Spool(implements(Source, Sink)):
+    """
+    A durable Source/Sink of JSON serializable records
+    """
+
+    def __init__(self, directory, segment_size=16 * 1024 * 1024,
+                 fsync=False):
+        """
+        Opens the spool in directory, creating it if needed
+
+        Arguments:
+         * directory - the directory holding the segment files
+         * segment_size - the size in bytes after which a new
+            segment file is started
+         * fsync - if True, flush() also waits for the OS to write
+            the data to disk
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        segments = self._segments()
+        self.committed = self._load_cursor(segments)
+
+        # Drop a batch left partially written by a crash
+        if segments:
+            self.write_seq = segments[-1]
+            self.write_offset = self._truncate(self.write_seq)
+        else:
+            self.committed = (self.committed[0], 0)
+            self.write_seq, self.write_offset = self.committed
+        self.writer = open(self._path(self.write_seq), 'ab')
+
+        self.read_seq, self.read_offset = self.committed
+        self.reader = None
+        self.uncommitted = 0
+        self.pending = self._count(*self.committed)
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f'{seq:012d}{_suffix}')
+
+    def _segments(self):
+        return sorted(int(name[:-len(_suffix)])
+                      for name in os.listdir(self.directory)
+                      if name.endswith(_suffix))
+
+    def _load_cursor(self, segments):
+        """ The committed (segment, offset), or the start of the log """
+        try:
+            with open(os.path.join(self.directory, _cursor)) as f:
+                seq, offset = (int(value) for value in f.read().split())
+        except (OSError, ValueError):
+            seq, offset = (segments[0] if segments else 0), 0
+
+        # The cursor may predate segments which were deleted
+        if segments and seq < segments[0]:
+            seq, offset = segments[0], 0
+        return seq, offset
+
+    def _batches(self, seq, offset=0):
+        """
+        Generator yielding the (end offset, record count) of each
+        complete batch in a segment from offset
+        """
+        with open(self._path(seq), 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(_header.size)
+                if len(header) < _header.size:
+                    return
+                length, count = _header.unpack(header)
+                if len(f.read(length)) < length:
+                    return
+                offset += _header.size + length
+                yield offset, count
+
+    def _truncate(self, seq):
+        """ Truncates a segment after its last complete batch """
+        end = 0
+        for end, count in self._batches(seq):
+            pass
+        with open(self._path(seq), 'ab') as f:
+            f.truncate(end)
+        return end
+
+    def _count(self, seq, offset):
+        """ Counts the records from a position to the end of the log """
+        count = 0
+        for segment in self._segments():
+            if segment >= seq:
+                start = offset if segment == seq else 0
+                count += sum(batch for end, batch in
+                             self._batches(segment, start))
+        return count
+
+    def write(self, records):
+        """
+        Appends records to the spool, they are durable once flushed.
+        Always returns True.
+        """
+        if not records:
+            return True
+
+        payload = _encoder.encode(list(records)).encode()
+        data = _header.pack(len(payload), len(records)) + payload
+
+        self.writer.write(data)
+        self.write_offset += len(data)
+        self.pending += len(records)
+
+        if self.write_offset >= self.segment_size:
+            self.writer.close()
+            self.write_seq += 1
+            self.write_offset = 0
+            self.writer = open(self._path(self.write_seq), 'ab')
+
+        return True
+
+    def flush(self):
+        """ Writes buffered records to the segment file """
+        self.writer.flush()
+        if self.fsync:
+            os.fsync(self.writer.fileno())
+
+    def read(self, num=1):
+        """
+        Reads up to num records after the read position and moves
+        the read position past them. They are read again after
+        rewind() or a restart unless they are committed.
+
+        Batches are not split, so if the next batch holds more than
+        num records the whole batch is returned.
+        """
+        self.flush()
+        records = []
+
+        while len(records) < num:
+            if self.reader is None:
+                self.reader = open(self._path(self.read_seq), 'rb')
+            self.reader.seek(self.read_offset)
+            block = self.reader.read(_read_ahead)
+
+            # A batch larger than the read ahead is read whole
+            if len(block) >= _header.size:
+                length, count = _header.unpack_from(block)
+                if _header.size + length > len(block):
+                    self.reader.seek(self.read_offset)
+                    block = self.reader.read(_header.size + length)
+
+            # Decode the complete batches at the start of the block
+            position = 0
+            while position + _header.size <= len(block):
+                length, count = _header.unpack_from(block, position)
+                end = position + _header.size + length
+                if end > len(block) or (
+                        records and len(records) + count > num):
+                    break
+                records.extend(_decoder.decode(
+                    block[position + _header.size:end].decode()))
+                position = end
+            self.read_offset += position
+
+            if records and position < len(block):
+                break
+
+            if position == 0:
+                if self.read_seq < self.write_seq:
+                    # The rest of this segment has been read
+                    self.reader.close()
+                    self.reader = None
+                    self.read_seq += 1
+                    self.read_offset = 0
+                    continue
+                # Caught up with the writer
+                break
+
+        self.uncommitted += len(records)
+        return records
+
+    def commit(self):
+        """
+        Marks every record read so far as done with,
+        deleting the segments which have been fully read
+        """
+        path = os.path.join(self.directory, _cursor)
+        with open(path + '.tmp', 'w') as f:
+            f.write(f'{self.read_seq} {self.read_offset}')
+        os.replace(path + '.tmp', path)
+
+        for seq in self._segments():
+            if seq >= self.read_seq:
+                break
+            os.remove(self._path(seq))
+
+        self.committed = (self.read_seq, self.read_offset)
+        self.pending -= self.uncommitted
+        self.uncommitted = 0
+
+    def rewind(self):
+        """ Moves the read position back to the last commit """
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        self.read_seq, self.read_offset = self.committed
+        self.uncommitted = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+class SpoolUploader(Uploader):
+    """
+    A SpoolUploader is an Uploader which writes submitted batches to a
+    Spool, and replays the spool to its endpoint. Batches are never
+    dropped: while the server is unavailable they wait on disk, and the
+    upload is retried with an increasing delay, as it is while no test
+    is running. Batches the server rejects as invalid (see REJECTED) are
+    skipped and counted as failed.
+    """
+
+    def __init__(self, endpoint, spool, *, batch_size=500,
+                 max_retry_delay=30, **kwargs):
+        """
+        Creates a SpoolUploader, it must be started to upload in the
+        background. Records left in the spool by a previous run are
+        uploaded first.
+
+        Arguments:
+         * endpoint - the URL batches are posted to
+         * spool - the Spool to write to and replay
+         * batch_size - the maximum number of records per upload
+         * max_retry_delay - the longest delay in seconds between retries
+        Other keyword arguments are those of Uploader
+        """
+        Uploader.__init__(self, endpoint, **kwargs)
+        self.spool = spool
+        self.batch_size = batch_size
+        self.max_retry_delay = max_retry_delay
+
+    def submit(self, batch):
+        return self.spool.write(batch)
+
+    def run(self):
+        deadline = time.monotonic() + self.flush_interval
+        delay = self.retry_delay
+
+        while True:
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+                if self.collect is not None:
+                    self.spool.write(self.collect())
+                self.spool.flush()
+
+            records = self.spool.read(self.batch_size)
+            if not records:
+                sleep(max(0, deadline - time.monotonic()))
+                continue
+
+            if self._replay(records):
+                delay = self.retry_delay
+            else:
+                sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    def _replay(self, records):
+        """
+        Posts records read from the spool, committing them unless
+        they should be retried. Returns False if they should be.
+        """
+        try:
+            response = self._post(records)
+        except requests.RequestException as e:
+            print(f'Nile: Upload to {self.endpoint} failed '
+                  f'with exception: {e}')
+            self.spool.rewind()
+            return False
+
+        if response.status_code == 200:
+            self.sent += len(records)
+        elif response.status_code in REJECTED:
+            print(f'Nile: Upload to {self.endpoint} was rejected '
+                  f'with status {response.status_code}, skipping')
+            self.failed += len(records)
+        else:
+            print(f'Nile: Upload to {self.endpoint} failed '
+                  f'with status {response.status_code}')
+            self.spool.rewind()
+            return False
+
+        self.spool.commit()
+        return True
+
+    def flush(self):
+        """
+        Spools the partial batch from collect and tries to upload
+        the whole spool from the calling greenlet. Records which
+        cannot be uploaded stay in the spool for the next run.
+        """
+        greenlet = getattr(self, 'greenlet', None)
+        if greenlet is not None:
+            greenlet.kill()
+
+        self.spool.rewind()
+        if self.collect is not None:
+            self.spool.write(self.collect())
+        self.spool.flush()
+
+        while True:
+            records = self.spool.read(self.batch_size)
+            if not records or not self._replay(records):
+                break
+
+        if self.spool.pending:
+            print(f'Nile: {self.spool.pending} records left in spool '
+                  f'{self.spool.directory}, they will be uploaded '
+                  f'by the next DataBuffer using it')
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'pending': self.spool.pending
+        }
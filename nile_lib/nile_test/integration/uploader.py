@@ -0,0 +1,211 @@
+"""
+Uploader
+
+An Uploader posts batches of records to a Nile server endpoint from its
+own greenlet, so the greenlets producing the records never wait on the
+network. Batches wait in a bounded queue; when the server falls behind
+and the queue is full, new batches are dropped and counted rather than
+blocking the producer.
+"""
+import time
+
+import requests
+from gevent import sleep
+from gevent.queue import Queue, Empty, Full
+
+from ..dataflow import Worker
+from .wire import encode_batch
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+
+
+class Uploader(Worker):
+    """
+    An Uploader is a Worker that sends submitted batches of records
+    to an endpoint, reusing one keep-alive HTTP session.
+
+    A batch is sent as soon as it is submitted. Every flush_interval
+    the collect function is also called, so records that have not filled
+    a batch yet are still uploaded regularly.
+    """
+
+    def __init__(self, endpoint, *, collect=None, flush_interval=1.0,
+                 max_pending=100, retries=2, retry_delay=0.5,
+                 timeout=10, session=None, wire_format=JSON,
+                 compress=False, encode=encode_batch):
+        """
+        Creates an Uploader, it must be started to upload in the background
+
+        Arguments:
+         * endpoint - the URL batches are posted to
+         * collect - called every flush_interval, returns a partial batch
+            to upload or an empty list
+         * flush_interval - the maximum time in seconds records passed
+            to collect wait before being uploaded
+         * max_pending - the number of batches that can wait to be sent
+            before new batches are dropped
+         * retries - the number of times a failed batch is resent
+            before it is dropped
+         * retry_delay - the delay in seconds before resending a batch
+         * timeout - the timeout in seconds of each upload
+         * session - the requests.Session to upload with, by default
+            the Uploader creates its own
+         * wire_format - JSON to send batches as a JSON list, or MSGPACK
+            to send them in the compact format of wire.py. If the server
+            does not support MSGPACK the Uploader falls back to JSON.
+         * compress - if True, MSGPACK batches are gzip compressed
+         * encode - the function encoding a batch in the MSGPACK
+            format, by default that of request records
+        """
+        self.endpoint = endpoint
+        self.collect = collect
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.session = session if session is not None else requests.Session()
+        self.wire_format = wire_format
+        self.compress = compress
+        self.encode = encode
+
+        self.queue = Queue(maxsize=max_pending)
+        self.in_flight = None
+
+        # Record counts for reporting
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, batch):
+        """
+        Queues a batch to be uploaded without blocking
+
+        Arguments:
+         * batch - the list of records to upload
+
+        Returns False if the batch was dropped because the queue is full
+        """
+        try:
+            self.queue.put_nowait(batch)
+            return True
+        except Full:
+            self.dropped += len(batch)
+            return False
+
+    def run(self):
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+            try:
+                batch = self.queue.get(
+                    timeout=max(0, deadline - time.monotonic()))
+            except Empty:
+                batch = None
+
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+                if self.collect is not None:
+                    partial = self.collect()
+                    if partial:
+                        self.submit(partial)
+
+            if batch:
+                self._send(batch)
+
+    def _send(self, batch):
+        """
+        Posts a batch, retrying failures, and dropping it
+        once every attempt has failed
+        """
+        # Kept until the batch is done with, so flush() can resend it
+        # if the worker is stopped in the middle of sending
+        self.in_flight = batch
+        sent = False
+        for attempt in range(self.retries + 1):
+            if attempt:
+                sleep(self.retry_delay)
+            try:
+                response = self._post(batch)
+                if response.status_code == 200:
+                    sent = True
+                    break
+                print(f'Nile: Upload to {self.endpoint} failed '
+                      f'with status {response.status_code}')
+            except requests.RequestException as e:
+                print(f'Nile: Upload to {self.endpoint} failed '
+                      f'with exception: {e}')
+
+        self.in_flight = None
+        if sent:
+            self.sent += len(batch)
+        else:
+            self.failed += len(batch)
+        return sent
+
+    def _post(self, batch):
+        if self.wire_format == MSGPACK:
+            data, headers = self.encode(batch, self.compress)
+            response = self.session.post(self.endpoint, data=data,
+                                         headers=headers,
+                                         timeout=self.timeout)
+            # Unsupported Media Type, the server only takes JSON
+            if response.status_code != 415:
+                return response
+            print(f'Nile: {self.endpoint} does not accept {MSGPACK} '
+                  f'batches, falling back to {JSON}')
+            self.wire_format = JSON
+
+        return self.session.post(self.endpoint, json=batch,
+                                 timeout=self.timeout)
+
+    def flush(self):
+        """
+        Uploads everything not yet sent from the calling greenlet:
+        a batch interrupted while being sent, the queued batches
+        and the partial batch from collect.
+        Used when the test finishes, the worker is stopped first.
+
+        Raises a RuntimeError if any batch could not be uploaded
+        """
+        greenlet = getattr(self, 'greenlet', None)
+        if greenlet is not None:
+            greenlet.kill()
+
+        batches = []
+        if self.in_flight:
+            batches.append(self.in_flight)
+            self.in_flight = None
+        while not self.queue.empty():
+            batches.append(self.queue.get_nowait())
+        if self.collect is not None:
+            batches.append(self.collect())
+
+        errors = []
+        for batch in batches:
+            if not batch:
+                continue
+            try:
+                response = self._post(batch)
+            except requests.RequestException as e:
+                self.failed += len(batch)
+                errors.append(e)
+                continue
+            if response.status_code == 200:
+                self.sent += len(batch)
+            else:
+                self.failed += len(batch)
+                errors.append(response)
+
+        if errors:
+            raise RuntimeError(f'Could not upload to {self.endpoint} '
+                               f'after test shutdown {errors[0]}')
+
+    def stats(self):
+        """ Returns the number of records sent, dropped and failed """
+        return {
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'pending': sum(len(batch) for batch in self.queue.queue)
+        }
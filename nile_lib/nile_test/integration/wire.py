@@ -0,0 +1,119 @@
+"""
+Wire Format
+
+A compact encoding of request batches uploaded to the Nile server,
+used instead of a JSON list of records when the server supports it.
+
+A batch is a msgpack map of columns rather than a list of records, so
+field names are not repeated for every request. Timestamps are integer
+microseconds since 1970-01-01 (in the same naive local time as the ISO
+strings of the JSON format), and the name, request_method, status_code
+and exception columns are dictionary-encoded: each holds indexes into
+a list of the distinct values in the batch, with -1 standing for None.
+The batch may also be gzip compressed.
+
+Batches of system metrics are encoded the same way, with the system_name
+and metric_name columns dictionary-encoded.
+"""
+import datetime
+import gzip
+
+import msgpack
+
+CONTENT_TYPE = 'application/x-msgpack'
+VERSION = 1
+
+_epoch = datetime.datetime(1970, 1, 1)
+_microsecond = datetime.timedelta(microseconds=1)
+
+# Columns holding indexes into a list of distinct values
+DICTIONARY_COLUMNS = ('name', 'request_method', 'status_code', 'exception')
+
+# Columns holding values
+VALUE_COLUMNS = ('request_length', 'response_length', 'response_time',
+                 'success', 'sampled')
+
+# Columns of a batch of system metrics holding indexes into distinct values
+METRIC_DICTIONARY_COLUMNS = ('system_name', 'metric_name')
+
+
+def _dictionary_encode(values):
+    """ Returns the distinct values and the index of each value """
+    distinct = {}
+    indexes = []
+    for value in values:
+        if value is None:
+            indexes.append(-1)
+        else:
+            indexes.append(distinct.setdefault(value, len(distinct)))
+    return list(distinct), indexes
+
+
+def _micros(timestamp):
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    return (timestamp - _epoch) // _microsecond
+
+
+def encode_batch(records, compress=False):
+    """
+    Encodes request records, as buffered by DataBuffer, into a batch.
+    Returns the encoded bytes and the headers to send them with.
+
+    Arguments:
+     * records - the list of request records
+     * compress - if True, the batch is gzip compressed
+    """
+    batch = {
+        'version': VERSION,
+        'count': len(records),
+        'request_timestamp': [_micros(record['request_timestamp'])
+                              for record in records]
+    }
+
+    for column in DICTIONARY_COLUMNS:
+        values, indexes = _dictionary_encode(
+            None if record.get(column) is None else str(record[column])
+            for record in records)
+        batch[column] = {'values': values, 'indexes': indexes}
+
+    for column in VALUE_COLUMNS:
+        batch[column] = [record.get(column) for record in records]
+
+    return _pack(batch, compress)
+
+
+def encode_metric_batch(records, compress=False):
+    """
+    Encodes system metric records, as buffered by MetricBuffer, into
+    a batch. Returns the encoded bytes and the headers to send them with.
+
+    Arguments:
+     * records - the list of metric records
+     * compress - if True, the batch is gzip compressed
+    """
+    batch = {
+        'version': VERSION,
+        'count': len(records),
+        'metric_timestamp': [_micros(record['metric_timestamp'])
+                             for record in records],
+        'metric_value': [float(record['metric_value'])
+                         for record in records]
+    }
+
+    for column in METRIC_DICTIONARY_COLUMNS:
+        values, indexes = _dictionary_encode(
+            str(record[column]) for record in records)
+        batch[column] = {'values': values, 'indexes': indexes}
+
+    return _pack(batch, compress)
+
+
+def _pack(batch, compress):
+    data = msgpack.packb(batch, use_bin_type=True)
+    headers = {'Content-Type': CONTENT_TYPE}
+    if compress:
+        data = gzip.compress(data, compresslevel=1)
+        headers['Content-Encoding'] = 'gzip'
+
+    return data, headers
@@ -0,0 +1,70 @@
+import random
+
+from nile_test.integration.aggregation import LatencySketch, WindowAggregator
+
+
+def test_sketch_quantiles_within_accuracy():
+    values = [random.lognormvariate(4, 1) for i in range(10000)]
+    sketch = LatencySketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    values.sort()
+    for fraction in (0.5, 0.9, 0.99):
+        exact = values[int(fraction * (len(values) - 1))]
+        assert abs(sketch.quantile(fraction) - exact) <= exact * 0.01
+
+    assert sketch.count == len(values)
+    assert sketch.min == values[0]
+    assert sketch.max == values[-1]
+
+
+def test_sketch_empty_and_zero():
+    sketch = LatencySketch()
+    assert sketch.quantile(0.5) is None
+
+    sketch.add(0)
+    sketch.add(0)
+    sketch.add(10)
+    assert sketch.quantile(0.5) == 0
+    assert sketch.quantile(1) == 10
+
+
+def test_sketch_to_dict():
+    sketch = LatencySketch()
+    sketch.add(100)
+    data = sketch.to_dict()
+
+    assert data['count'] == 1
+    assert data['total'] == 100
+    assert sum(data['bins'].values()) == 1
+    assert all(isinstance(key, str) for key in data['bins'])
+
+
+def test_aggregator_groups_windows():
+    aggregator = WindowAggregator(window=1.0)
+    aggregator.add(10.1, "GET", "/", 200, True, 5)
+    aggregator.add(10.5, "GET", "/", 200, True, 15)
+    aggregator.add(10.7, "GET", "/", 500, False, 50)
+    aggregator.add(11.2, "GET", "/", 200, True, 25)
+
+    assert not aggregator.has_closed(10.9)
+    assert aggregator.has_closed(11.5)
+
+    windows = aggregator.flush(11.5)
+    assert len(windows) == 2
+    assert {w['success'] for w in windows} == {True, False}
+
+    ok = next(w for w in windows if w['success'])
+    assert ok['count'] == 2
+    assert ok['total'] == 20
+    assert ok['min'] == 5
+    assert ok['max'] == 15
+    assert ok['window_seconds'] == 1.0
+
+    # The window still in progress is kept until everything is flushed
+    assert not aggregator.has_closed(11.5)
+    windows = aggregator.flush()
+    assert len(windows) == 1
+    assert windows[0]['count'] == 1
+    assert aggregator.flush() == []
@@ -0,0 +1,40 @@
+import asyncio
+
+from nile_test.aio import shutdown
+from nile_test.aio.disconnect_adapter import DeterministicDisconnectAdapter
+from nile_test.dataflow.buffers import Buffer
+
+time_until = 0.01
+duration = 0.1
+
+
+def test_DisAdapter_write():
+    async def run():
+        buf = Buffer()
+        dis_adapter = DeterministicDisconnectAdapter(buf,
+                                                     time_until=time_until,
+                                                     duration=duration)
+        assert await dis_adapter.write(["test1"])
+
+        dis_adapter.connected = False
+        assert not await dis_adapter.write(["test2"])
+        assert list(buf.data) == ["test1"]
+
+    asyncio.run(run())
+
+
+def test_DisAdapter_becomes_disconnected():
+    async def run():
+        dis_adapter = DeterministicDisconnectAdapter(Buffer(),
+                                                     time_until=0.05,
+                                                     duration=0.1)
+        dis_adapter.start()
+        # Disconnected from 0.05 to 0.15, connected again until 0.2
+        await asyncio.sleep(0.1)
+        assert not dis_adapter.connected
+
+        await asyncio.sleep(0.075)
+        assert dis_adapter.connected
+        await shutdown()
+
+    asyncio.run(run())
@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+import pytest
+
+from nile_test import aio
+
+web = pytest.importorskip("aiohttp.web")
+
+from nile_test.aio.http_client import HTTPClient, create_session  # noqa: E402
+
+
+async def start_server(bodies):
+    """ Starts a server on a free port answering each request after 0.1s """
+    async def handle(request):
+        bodies.append(await request.read())
+        await asyncio.sleep(0.1)
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_route("*", "/", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "localhost", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://localhost:{port}/"
+
+
+def test_write():
+    """
+    Tests that records are sent concurrently, reusing connections,
+    and reported with their timings
+    """
+    async def run():
+        bodies = []
+        runner, url = await start_server(bodies)
+        session = create_session()
+        try:
+            sink = HTTPClient(session=session, concurrency=4,
+                              method="POST", url=url)
+            began = asyncio.get_running_loop().time()
+            assert await sink.write([{"data": str(i)} for i in range(4)])
+            assert asyncio.get_running_loop().time() - began < 0.3
+
+            assert await sink.write([{"data": "4"}])
+
+            batch = HTTPClient(session=session, batch=True, url=url)
+            assert await batch.write([{"data": 5}, {"data": "6"}])
+        finally:
+            await session.close()
+            await runner.cleanup()
+        return bodies
+
+    reports = []
+
+    def catch_success(**kwargs):
+        reports.append(kwargs)
+
+    aio.request_success += catch_success
+    try:
+        bodies = asyncio.run(run())
+    finally:
+        aio.request_success -= catch_success
+
+    assert sorted(bodies[:4]) == [b"0", b"1", b"2", b"3"]
+    assert json.loads(bodies[5]) == [5, "6"]
+    assert len(reports) == 6
+    assert all(report["connect_time"] > 0 for report in reports[:4])
+    assert reports[4]["connect_time"] == 0
+    for report in reports:
+        assert 100 <= report["first_byte_time"] <= report["response_time"]
+        assert report["status_code"] == 200
+        assert report["response_length"] == 2
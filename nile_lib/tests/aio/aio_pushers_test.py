@@ -0,0 +1,68 @@
+import asyncio
+
+from interface import implements
+
+from nile_test.aio import Source, Sink, shutdown
+from nile_test.aio.pushers import DeterministicPusher
+from nile_test.dataflow.buffers import Buffer
+
+
+class AsyncBuffer(implements(Source, Sink)):
+    """ A list that can be read from and written to asynchronously """
+
+    def __init__(self, data=()):
+        self.data = list(data)
+
+    async def read(self, num=1):
+        records, self.data = self.data[:num], self.data[num:]
+        return records
+
+    async def write(self, records):
+        self.data.extend(records)
+        return True
+
+
+def test_DPusher_run():
+    async def run():
+        in_buf = AsyncBuffer(["test1", "test2"])
+        out_buf = AsyncBuffer()
+        cycle_delay = 0.1
+
+        dpusher = DeterministicPusher(in_buf, out_buf, quantity=1,
+                                      retry_delay=0.001,
+                                      cycle_delay=cycle_delay)
+        dpusher.start()
+        # The first cycle runs as soon as the test yields,
+        # wait until halfway to the second cycle
+        await asyncio.sleep(cycle_delay / 2)
+        assert in_buf.data == ["test2"]
+        assert out_buf.data == ["test1"]
+
+        # Wait until halfway past the second cycle
+        await asyncio.sleep(cycle_delay)
+        assert in_buf.data == []
+        assert out_buf.data == ["test1", "test2"]
+
+        await shutdown()
+        assert dpusher.task.cancelled()
+
+    asyncio.run(run())
+
+
+def test_DPusher_sync_components():
+    """
+    Tests that the Sources and Sinks of the gevent runtime can be used
+    """
+    async def run():
+        in_buf = Buffer()
+        in_buf.write(["test1", "test2"])
+        out_buf = Buffer()
+
+        dpusher = DeterministicPusher(in_buf, out_buf, quantity=2,
+                                      retry_delay=0.001, cycle_delay=1)
+        dpusher.start()
+        await asyncio.sleep(0.05)
+        assert list(out_buf.data) == ["test1", "test2"]
+        await shutdown()
+
+    asyncio.run(run())
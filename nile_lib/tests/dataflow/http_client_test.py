@@ -1,5 +1,12 @@
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
 from locust import events
-from nile_test.dataflow.http_client import HTTPClient
+from nile_test.dataflow.http_client import ConnectionPool, HTTPClient
 
 
 def test_init():
@@ -56,3 +63,140 @@ def test_write(echo_server):
 
     sink.write([{"method": "GET"}])
     assert delete_found and post_found and get_found
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """ Responds 200 to GETs, keeping the connection open """
+    protocol_version = "HTTP/1.1"
+    bodies = []
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        KeepAliveHandler.bodies.append(json.loads(self.rfile.read(length)))
+        self.do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SlowHandler(KeepAliveHandler):
+    """ Responds to GETs after 0.2 seconds """
+
+    def do_GET(self):
+        time.sleep(0.2)
+        KeepAliveHandler.do_GET(self)
+
+
+@pytest.fixture()
+def keep_alive_server():
+    """ A fixture running a KeepAliveHandler server on a free port """
+    server = ThreadingHTTPServer(("localhost", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_connection_reuse(keep_alive_server):
+    """
+    Tests that requests written to HTTPClients sharing a ConnectionPool
+    reuse one keep-alive connection
+    """
+    server = keep_alive_server
+    pool = ConnectionPool(max_connections=2)
+    try:
+        url = f"http://localhost:{server.server_port}/"
+        first = HTTPClient(pool=pool, method="GET", url=url)
+        second = HTTPClient(pool=pool, method="GET", url=url)
+        assert first.write([{}, {}, {}])
+        assert second.write([{}, {}])
+
+        stats = pool.stats()[f"http://localhost:{server.server_port}"]
+        assert stats == {"connections_opened": 1, "requests": 5, "idle": 1}
+        assert HTTPClient().pool is HTTPClient().pool
+    finally:
+        pool.close()
+
+
+def test_concurrent_write(keep_alive_server):
+    """
+    Tests that a batch is sent at the same time with a concurrency above 1,
+    reporting each request
+    """
+    server = keep_alive_server
+    server.RequestHandlerClass = SlowHandler
+    url = f"http://localhost:{server.server_port}/"
+    sink = HTTPClient(pool=ConnectionPool(max_connections=4),
+                      concurrency=4, method="GET", url=url)
+
+    times = []
+
+    def catch_success(response_time, **kwargs):
+        times.append(response_time)
+
+    events.request_success += catch_success
+    try:
+        began = time.time()
+        assert sink.write([{}] * 4)
+        elapsed = time.time() - began
+    finally:
+        events.request_success -= catch_success
+
+    assert len(times) == 4
+    assert elapsed < 0.6
+    assert sink.stats()[url[:-1]]["connections_opened"] == 4
+
+
+def test_batch_write(keep_alive_server):
+    """
+    Tests that a batch is sent as one JSON array in batch mode
+    """
+    KeepAliveHandler.bodies = []
+    url = f"http://localhost:{keep_alive_server.server_port}/"
+    sink = HTTPClient(pool=ConnectionPool(), batch=True, url=url)
+
+    assert sink.write([{"data": "1"}, {"data": {"value": 2}}, 3])
+    assert sink.write([])
+    assert KeepAliveHandler.bodies == [["1", {"value": 2}]]
+    assert sink.stats()[url[:-1]]["requests"] == 1
+
+
+def test_timing(keep_alive_server):
+    """
+    Tests that requests are reported with their times in milliseconds,
+    and connect time only when a connection is opened
+    """
+    server = keep_alive_server
+    server.RequestHandlerClass = SlowHandler
+    sink = HTTPClient(pool=ConnectionPool(), method="GET",
+                      url=f"http://localhost:{server.server_port}/")
+
+    reports = []
+
+    def catch_success(**kwargs):
+        reports.append(kwargs)
+
+    events.request_success += catch_success
+    try:
+        sink.write([{}, {}])
+    finally:
+        events.request_success -= catch_success
+
+    first, second = reports
+    assert first["connect_time"] > 0
+    assert second["connect_time"] == 0
+    for report in reports:
+        assert 200 <= report["first_byte_time"] <= report["response_time"]
+        assert report["response_time"] < 1000
+        assert report["status_code"] == 200
+        assert report["response_length"] == 2
+        assert report["request_length"] == 0
+        assert datetime.datetime.fromisoformat(report["request_timestamp"])
@@ -0,0 +1,86 @@
+import os
+import time
+
+from interface import implements
+from locust import events
+
+from nile_test.dataflow import Sink
+from nile_test.dataflow.buffers import CircularReadBuffer
+from nile_test.dataflow.pushers import DeterministicPusher
+from nile_test.dataflow.sharding import ShardLauncher
+
+
+class ReportingSink(implements(Sink)):
+    """ A Sink reporting each record as a request of its device """
+
+    def __init__(self, device):
+        self.device = device
+
+    def write(self, records):
+        for record in records:
+            events.request_success.fire(
+                request_type="POST",
+                name=f"/device/{self.device}",
+                response_time=1.0,
+                response_length=len(record),
+                pid=os.getpid()
+            )
+        if self.device == 0:
+            events.request_failure.fire(
+                request_type="POST",
+                name="/device/0",
+                response_time=1.0,
+                response_length=0,
+                exception=ValueError("failed")
+            )
+        return True
+
+
+def build_device(device):
+    """ The pipeline factory, run in the shard processes """
+    DeterministicPusher(CircularReadBuffer(["reading"]),
+                        ReportingSink(device),
+                        retry_delay=0.001, cycle_delay=0.05).start()
+
+
+def test_sharding():
+    """
+    Tests that devices are split between processes and their requests
+    are fired through the events of this process
+    """
+    successes = []
+    failures = []
+
+    def catch_success(name, pid, **kwargs):
+        successes.append((name, pid))
+
+    def catch_failure(name, exception, **kwargs):
+        failures.append((name, str(exception)))
+
+    events.request_success += catch_success
+    events.request_failure += catch_failure
+
+    launcher = ShardLauncher(build_device, devices=5, processes=2,
+                             report_interval=0.1)
+    try:
+        launcher.start()
+        deadline = time.time() + 30
+        while len({name for name, pid in successes}) < 5 \
+                and time.time() < deadline:
+            time.sleep(0.1)
+    finally:
+        launcher.stop()
+        events.request_success -= catch_success
+        events.request_failure -= catch_failure
+
+    assert {name for name, pid in successes} == \
+        {f"/device/{device}" for device in range(5)}
+    assert {pid for name, pid in successes} == set(launcher.pids)
+    assert os.getpid() not in launcher.pids
+    assert failures and failures[0] == ("/device/0", "failed")
+
+    stats = launcher.stats()
+    assert [shard["devices"] for shard in stats["shards"]] == [3, 2]
+    assert stats["requests"] == len(successes)
+    assert stats["failures"] == len(failures)
+    assert not any(shard["running"] for shard in stats["shards"])
@@ -0,0 +1,87 @@
+import pytest
+
+from nile_test.integration import hostsampler
+from nile_test.integration.hostsampler import HostSampler
+
+NET_HEADER = ("Inter-|   Receive                            |  Transmit\n"
+              " face |bytes    packets errs drop fifo frame compressed "
+              "multicast|bytes    packets errs drop fifo colls carrier "
+              "compressed\n")
+
+
+class ListSink:
+    def __init__(self):
+        self.records = []
+
+    def write(self, records):
+        self.records.extend(records)
+        return True
+
+
+def write_proc(proc, cpu, received, sent, process_ticks):
+    (proc / "stat").write_text(f"cpu  {cpu}\ncpu0 {cpu}\n")
+    (proc / "meminfo").write_text("MemTotal:       1000000 kB\n"
+                                  "MemFree:         100000 kB\n"
+                                  "MemAvailable:    250000 kB\n")
+    (proc / "loadavg").write_text("1.50 1.00 0.50 2/300 4000\n")
+    (proc / "net" / "dev").write_text(
+        NET_HEADER
+        + f"    lo: 999 1 0 0 0 0 0 0 999 1 0 0 0 0 0 0\n"
+        + f"  eth0: {received} 1 0 0 0 0 0 0 {sent} 1 0 0 0 0 0 0\n")
+    fields = ["S"] + ["0"] * 10 + [str(process_ticks), "0"] + ["0"] * 8
+    (proc / "42" / "stat").write_text(f"42 (locust worker) {' '.join(fields)}")
+    (proc / "42" / "statm").write_text("1000 256 0 0 0 0 0\n")
+
+
+@pytest.fixture
+def proc(tmp_path):
+    (tmp_path / "net").mkdir()
+    (tmp_path / "42").mkdir()
+    write_proc(tmp_path, "100 0 100 700 100 0 0 0 0 0", 1000, 500, 10)
+    return tmp_path
+
+
+def values(records):
+    return {(record['system_name'], record['metric_name']):
+            record['metric_value'] for record in records}
+
+
+def test_sample_rates(proc, mocker):
+    mocker.patch.object(hostsampler, '_page_size', 4096)
+    mocker.patch.object(hostsampler, '_clock_ticks', 100)
+    monotonic = mocker.patch.object(hostsampler.time, 'monotonic')
+    monotonic.return_value = 10.0
+
+    sampler = HostSampler(ListSink(), pids=[42], system_name="slave-1",
+                          proc=str(proc))
+    first = values(sampler.sample())
+    assert first[("slave-1", "memory_used_percent")] == 75.0
+    assert first[("slave-1", "load_1")] == 1.5
+    # Rates need a previous sample
+    assert ("slave-1", "cpu_percent") not in first
+
+    write_proc(proc, "300 0 200 800 200 0 0 0 0 0", 3000, 1500, 60)
+    monotonic.return_value = 12.0
+    second = values(sampler.sample())
+    assert second[("slave-1", "cpu_percent")] == 60.0
+    assert second[("slave-1", "cpu_iowait_percent")] == 20.0
+    assert second[("slave-1", "net_rx_bytes_per_s")] == 1000.0
+    assert second[("slave-1", "net_tx_bytes_per_s")] == 500.0
+    assert second[("slave-1/42", "process_cpu_percent")] == 25.0
+    assert second[("slave-1/42", "process_rss_mb")] == 1.0
+
+    sampler.close()
+
+
+def test_exited_process_is_skipped(proc):
+    sampler = HostSampler(ListSink(), pids=[42, 43], system_name="slave-1",
+                          proc=str(proc))
+    sampler.sample()
+    names = {name for name, _ in values(sampler.sample())}
+    assert names == {"slave-1", "slave-1/42"}
+    sampler.close()
+
+
+def test_missing_proc(tmp_path):
+    with pytest.raises(OSError):
+        HostSampler(ListSink(), proc=str(tmp_path))
@@ -0,0 +1,71 @@
+import datetime
+import msgpack
+import requests
+
+from nile_test.dataflow import _reset
+from nile_test.integration.metricbuffer import MetricBuffer
+from nile_test.integration.uploader import Uploader, JSON
+from nile_test.integration.wire import encode_metric_batch
+
+
+def metrics():
+    timestamp = datetime.datetime(2020, 3, 1, 12, 30, 15, 250)
+    return [{
+        'system_name': system,
+        'metric_name': name,
+        'metric_timestamp': timestamp.isoformat(),
+        'metric_value': value
+    } for system, name, value in [('slave-1', 'cpu', 12.5),
+                                  ('slave-1', 'memory', 1024.0),
+                                  ('slave-2', 'cpu', 50.0)]]
+
+
+def test_encode_metric_batch():
+    data, headers = encode_metric_batch(metrics())
+
+    batch = msgpack.unpackb(data, raw=False)
+    assert batch['count'] == 3
+    assert batch['system_name'] == {'values': ['slave-1', 'slave-2'],
+                                    'indexes': [0, 0, 1]}
+    assert batch['metric_name'] == {'values': ['cpu', 'memory'],
+                                    'indexes': [0, 1, 0]}
+    assert batch['metric_value'] == [12.5, 1024.0, 50.0]
+
+    timestamp = datetime.datetime(1970, 1, 1) + datetime.timedelta(
+        microseconds=batch['metric_timestamp'][0])
+    assert timestamp.isoformat() == metrics()[0]['metric_timestamp']
+
+
+def test_record_buffers_until_limit(mocker):
+    mock_submit = mocker.patch.object(Uploader, 'submit')
+    buffer = MetricBuffer("localhost", system_name="slave-1",
+                          buffer_limit=3)
+    assert buffer.metrics_endpoint == "http://localhost/api/v1/metrics"
+
+    buffer.record('cpu', 12.5)
+    buffer.write([{'metric_name': 'memory', 'metric_value': 1024}])
+    mock_submit.assert_not_called()
+    assert buffer.buffer[1]['system_name'] == "slave-1"
+    assert buffer.buffer[1]['metric_value'] == 1024.0
+
+    buffer.record('cpu', 50, system_name="slave-2")
+    batch = mock_submit.call_args[0][0]
+    assert [metric['system_name'] for metric in batch] == \
+        ["slave-1", "slave-1", "slave-2"]
+    assert buffer.buffer == []
+
+    _reset()
+
+
+def test_on_quitting_uploads_remaining(mocker):
+    mock_post = mocker.patch.object(requests.Session, 'post')
+    mock_post.return_value.status_code = 200
+
+    buffer = MetricBuffer("localhost", wire_format=JSON)
+    buffer.write(metrics())
+    buffer.on_quitting()
+
+    assert len(mock_post.call_args[1]['json']) == 3
+    assert buffer.stats()['sent'] == 3
+
+    _reset()
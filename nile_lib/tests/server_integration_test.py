@@ -2,11 +2,14 @@ import sys
 import pytest
 import requests
 import datetime
+import time
 
 from nile_test import integration
+from nile_test.dataflow import _reset
 from nile_test.integration import _is_slave, _is_master
 from nile_test.integration.databuffer import DataBuffer
 from nile_test.integration.testmanager import TestManager
+from nile_test.integration.uploader import Uploader
 
 
 def test_launch_slave(mocker, monkeypatch):
@@ -85,6 +88,8 @@ def test_DataBuffer_init():
     data_buffer2 = DataBuffer("localhost", buffer_limit=30)
     assert data_buffer2.buffer_limit == 30
 
+    _reset()
+
 
 def test_request_success(mocker):
     data_buffer = DataBuffer("localhost")
@@ -101,9 +106,18 @@ def test_request_failure(mocker):
                                             RuntimeError)
 
 
+def test_request_kwargs(mocker):
+    data_buffer = DataBuffer("localhost")
+    mock_on_request_data = mocker.patch.object(DataBuffer, "_on_request_data")
+    data_buffer.request_success("get", "/", 49, 120, status_code=200,
+                                request_length=10)
+    mock_on_request_data.assert_called_with("get", "/", 49, 120, True, None,
+                                            status_code=200,
+                                            request_length=10)
+
+
 def test__on_request_data(mocker):
-    mock_post = mocker.patch.object(requests, 'post')
-    mock_post.return_value.status_code = 200
+    mock_submit = mocker.patch.object(Uploader, 'submit')
     data_buffer = DataBuffer("localhost")
 
     request_timestamp = datetime.datetime.now().isoformat()
@@ -120,12 +134,22 @@ def test__on_request_data(mocker):
         data_buffer._on_request_data("GET", "/", 0.1, 10, True, None)
 
     assert len(data_buffer.buffer) == 20
+    mock_submit.assert_not_called()
+
+    # Full buffers are handed to the uploader without blocking
     data_buffer._on_request_data("GET", "/", 0.1, 10, True, None)
     assert len(data_buffer.buffer) == 0
+    assert len(mock_submit.call_args[0][0]) == 21
+
+    data_buffer._on_request_data("GET", "/", 0.1, 10, False,
+                                 RuntimeError("timed out"))
+    assert data_buffer.buffer[0]['exception'] == "timed out"
+
+    _reset()
 
 
 def test_on_quitting(mocker):
-    mock_post = mocker.patch.object(requests, 'post')
+    mock_post = mocker.patch.object(requests.Session, 'post')
     mock_post.return_value.status_code = 200
     data_buffer = DataBuffer("localhost")
     data_buffer._on_request_data("GET", "/", 0.1, 10, True, None)
@@ -137,4 +161,92 @@ def test_on_quitting(mocker):
     data_buffer._on_request_data("GET", "/", 0.1, 10, True, None)
     with pytest.raises(RuntimeError):
         data_buffer.on_quitting()
-        assert len(data_buffer.buffer) == 1
+    assert data_buffer.stats()['failed'] == 1
+
+    _reset()
+
+
+def test_aggregate_uploads_windows(mocker):
+    mock_post = mocker.patch.object(requests.Session, 'post')
+    mock_post.return_value.status_code = 200
+    data_buffer = DataBuffer("localhost", aggregate=True, sample_rate=0)
+
+    for i in range(5):
+        data_buffer._on_request_data("GET", "/", 10, 10, True, None,
+                                     status_code=200)
+
+    # Requests are aggregated rather than buffered
+    assert len(data_buffer.buffer) == 0
+    data_buffer.on_quitting()
+
+    # Windows may also be uploaded as soon as they end
+    windows = []
+    for call in mock_post.call_args_list:
+        if call[0][0] == "http://localhost/api/v1/requests/windows":
+            windows.extend(call[1]['json'])
+    assert sum(window['count'] for window in windows) == 5
+
+    _reset()
+
+
+def test_aggregate_samples_requests(mocker):
+    mock_post = mocker.patch.object(requests.Session, 'post')
+    mock_post.return_value.status_code = 200
+    data_buffer = DataBuffer("localhost", aggregate=True, sample_rate=1)
+
+    data_buffer._on_request_data("GET", "/", 10, 10, True, None)
+    assert len(data_buffer.buffer) == 1
+    assert data_buffer.buffer[0]['sampled']
+
+    _reset()
+
+
+def test_uploader_drops_when_full(mocker):
+    uploader = Uploader("http://localhost/api/v1/requests", max_pending=2)
+
+    assert uploader.submit([1, 2])
+    assert uploader.submit([3])
+    assert not uploader.submit([4, 5, 6])
+    assert uploader.stats() == {'sent': 0, 'dropped': 3,
+                                'failed': 0, 'pending': 3}
+
+
+def test_uploader_flushes_in_background(mocker):
+    mock_post = mocker.patch.object(requests.Session, 'post')
+    mock_post.return_value.status_code = 200
+    pending = [[{'id': 1}]]
+
+    uploader = Uploader("http://localhost/api/v1/requests",
+                        collect=lambda: pending.pop() if pending else [],
+                        flush_interval=0.05)
+    uploader.start()
+    uploader.submit([{'id': 2}, {'id': 3}])
+
+    # Submitted batches are sent at once, collected ones each interval
+    time.sleep(0.2)
+    assert uploader.stats()['sent'] == 3
+    assert mock_post.call_count == 2
+
+    _reset()
+
+
+def test_uploader_retries_then_fails(mocker):
+    mock_post = mocker.patch.object(requests.Session, 'post')
+    mock_post.return_value.status_code = 500
+
+    uploader = Uploader("http://localhost/api/v1/requests",
+                        retries=1, retry_delay=0)
+    assert not uploader._send([{'id': 1}])
+    assert mock_post.call_count == 2
+    assert uploader.stats()['failed'] == 1
+
+
+def test_uploader_flush_counts_connection_errors(mocker):
+    mock_post = mocker.patch.object(requests.Session, 'post')
+    mock_post.side_effect = requests.ConnectionError("refused")
+
+    uploader = Uploader("http://localhost/api/v1/requests")
+    uploader.submit([{'id': 1}, {'id': 2}])
+    with pytest.raises(RuntimeError):
+        uploader.flush()
+    assert uploader.stats()['failed'] == 2
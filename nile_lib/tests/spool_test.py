@@ -0,0 +1,134 @@
+import os
+import requests
+
+from nile_test.integration.spool import Spool, SpoolUploader
+
+
+def records(start, stop):
+    return [{'id': i, 'name': f'/{i}'} for i in range(start, stop)]
+
+
+def test_write_read_commit(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.write(records(0, 2))
+    spool.write(records(2, 3))
+    spool.write(records(3, 5))
+
+    assert spool.read(3) == records(0, 3)
+    assert spool.read(10) == records(3, 5)
+    assert spool.read(10) == []
+
+    # Uncommitted records are read again after a rewind
+    spool.rewind()
+    assert spool.read(2) == records(0, 2)
+    spool.commit()
+    assert spool.pending == 3
+
+    spool.write(records(5, 6))
+    assert spool.read(10) == records(2, 6)
+
+    # Batches are never split
+    spool.write(records(6, 10))
+    assert spool.read(1) == records(6, 10)
+
+
+def test_resumes_after_restart(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.write(records(0, 4))
+    spool.write(records(4, 10))
+    spool.read(4)
+    spool.commit()
+    spool.read(2)
+    spool.close()
+
+    spool = Spool(str(tmp_path))
+    assert spool.pending == 6
+    assert spool.read(10) == records(4, 10)
+
+
+def test_rotates_and_deletes_segments(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=100)
+    for i in range(10):
+        spool.write(records(i * 5, i * 5 + 5))
+
+    segments = [name for name in os.listdir(tmp_path)
+                if name.endswith('.seg')]
+    assert len(segments) > 1
+
+    assert spool.read(100) == records(0, 50)
+    spool.commit()
+    segments = [name for name in os.listdir(tmp_path)
+                if name.endswith('.seg')]
+    assert len(segments) == 1
+    assert spool.pending == 0
+
+
+def test_drops_partial_record(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.write(records(0, 2))
+    spool.close()
+
+    # Simulate a crash in the middle of writing a record
+    path = os.path.join(tmp_path, os.listdir(tmp_path)[0])
+    with open(path, 'ab') as f:
+        f.write(b'\x40\x00\x00\x00\x01\x00\x00\x00[{"id":')
+
+    spool = Spool(str(tmp_path))
+    spool.write(records(2, 3))
+    assert spool.read(10) == records(0, 3)
+
+
+def test_uploader_keeps_records_until_uploaded(tmp_path, mocker):
+    mock_post = mocker.patch.object(requests.Session, 'post')
+    mock_post.side_effect = requests.ConnectionError("refused")
+
+    spool = Spool(str(tmp_path))
+    uploader = SpoolUploader("http://localhost/api/v1/requests", spool)
+    uploader.submit(records(0, 3))
+    uploader.flush()
+    assert uploader.stats()['pending'] == 3
+    spool.close()
+
+    # A new uploader replays what the last one left behind
+    mock_post.side_effect = None
+    mock_post.return_value.status_code = 200
+    spool = Spool(str(tmp_path))
+    uploader = SpoolUploader("http://localhost/api/v1/requests", spool,
+                             collect=lambda: records(3, 4))
+    uploader.flush()
+
+    assert mock_post.call_args[1]['json'] == records(0, 4)
+    assert uploader.stats() == {'sent': 4, 'dropped': 0,
+                                'failed': 0, 'pending': 0}
+
+
+def test_uploader_skips_rejected_records(tmp_path, mocker):
+    mock_post = mocker.patch.object(requests.Session, 'post')
+    mock_post.return_value.status_code = 400
+
+    uploader = SpoolUploader("http://localhost/api/v1/requests",
+                             Spool(str(tmp_path)))
+    uploader.submit(records(0, 3))
+    uploader.flush()
+
+    assert uploader.stats()['failed'] == 3
+    assert uploader.stats()['pending'] == 0
+
+
+def test_uploader_keeps_records_while_server_cannot_save(tmp_path, mocker):
+    mock_post = mocker.patch.object(requests.Session, 'post')
+
+    uploader = SpoolUploader("http://localhost/api/v1/requests",
+                             Spool(str(tmp_path)))
+    uploader.submit(records(0, 3))
+
+    # No test running, then the database is unavailable
+    for status_code in (409, 503):
+        mock_post.return_value.status_code = status_code
+        uploader.flush()
+        assert uploader.stats()['pending'] == 3
+        assert uploader.stats()['failed'] == 0
+
+    mock_post.return_value.status_code = 200
+    uploader.flush()
+    assert uploader.stats()['sent'] == 3
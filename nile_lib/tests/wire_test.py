@@ -0,0 +1,60 @@
+import datetime
+import gzip
+import msgpack
+import requests
+
+from nile_test.integration.uploader import Uploader, JSON, MSGPACK
+from nile_test.integration.wire import encode_batch, CONTENT_TYPE
+
+
+def records():
+    timestamp = datetime.datetime(2020, 3, 1, 12, 30, 15, 250)
+    return [{
+        'request_method': 'GET',
+        'name': name,
+        'response_time': 10.5,
+        'response_length': 100,
+        'success': exception is None,
+        'exception': exception,
+        'request_timestamp': timestamp.isoformat(),
+        'request_length': None,
+        'status_code': 200
+    } for name, exception in [('/a', None), ('/b', 'Timeout'),
+                              ('/a', 'Timeout')]]
+
+
+def test_encode_batch():
+    data, headers = encode_batch(records())
+    assert headers == {'Content-Type': CONTENT_TYPE}
+
+    batch = msgpack.unpackb(data, raw=False)
+    assert batch['count'] == 3
+    assert batch['name'] == {'values': ['/a', '/b'], 'indexes': [0, 1, 0]}
+    assert batch['exception'] == {'values': ['Timeout'],
+                                  'indexes': [-1, 0, 0]}
+    assert batch['status_code']['values'] == ['200']
+    assert batch['success'] == [True, False, False]
+
+    timestamp = datetime.datetime(1970, 1, 1) + datetime.timedelta(
+        microseconds=batch['request_timestamp'][0])
+    assert timestamp.isoformat() == records()[0]['request_timestamp']
+
+
+def test_encode_batch_compressed():
+    data, headers = encode_batch(records(), compress=True)
+    assert headers['Content-Encoding'] == 'gzip'
+    assert msgpack.unpackb(gzip.decompress(data), raw=False)['count'] == 3
+
+
+def test_uploader_falls_back_to_json(mocker):
+    mock_post = mocker.patch.object(requests.Session, 'post')
+    mock_post.return_value.status_code = 415
+
+    uploader = Uploader("http://localhost/api/v1/requests",
+                        wire_format=MSGPACK, retries=0)
+    uploader._send(records())
+
+    assert mock_post.call_args_list[0][1]['headers'] == {
+        'Content-Type': CONTENT_TYPE}
+    assert mock_post.call_args_list[1][1]['json'] == records()
+    assert uploader.wire_format == JSON
@@ -3,13 +3,27 @@ from config import Config
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_marshmallow import Marshmallow
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 import os
+import sqlite3
 
 
 app = Flask(__name__)
 app.config.from_object(os.environ['APP_CONFIG_ENV'])
 db = SQLAlchemy(app)
 ma = Marshmallow(app)
-migrate = Migrate(app, db)
+migrate = Migrate(app, db, render_as_batch=True)
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(connection, record):
+    """ SQLite only enforces foreign keys (and cascades) when asked to """
+    if isinstance(connection, sqlite3.Connection):
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
 from app import models
+from app import dbstats
+dbstats.init_app(app)
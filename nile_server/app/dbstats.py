@@ -0,0 +1,237 @@
+"""
+Database Statistics
+
+Configures the database connection pool from the DB_POOL_* settings of
+the Config class, and counts how the pool and database are used by this
+server process: connections checked out and the time spent waiting for
+them, and the number and duration of queries, in total and for each
+endpoint. Served by /api/v1/internal/stats to size the pool against the
+number of slaves uploading to the server.
+
+Statistics are kept per server process, and queries made outside of a
+request, such as by background jobs or while streaming a response, are
+counted under BACKGROUND.
+"""
+
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import Pool, QueuePool
+
+# Endpoint name queries outside of a request are counted under
+BACKGROUND = '<background>'
+
+# Engine options set from each DB_POOL_* setting
+_pool_settings = {
+    'DB_POOL_SIZE': 'pool_size',
+    'DB_MAX_OVERFLOW': 'max_overflow',
+    'DB_POOL_RECYCLE': 'pool_recycle',
+    'DB_POOL_TIMEOUT': 'pool_timeout'
+}
+
+
+class DatabaseStats:
+    """ Counters of the connection pool and queries of this process """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Sets every counter back to zero """
+
+        with self.lock:
+            self.since = datetime.now()
+            self.connects = 0
+            self.checkouts = 0
+            self.invalidations = 0
+            self.wait_time = 0.0
+            self.max_wait_time = 0.0
+            self.queries = 0
+            self.query_time = 0.0
+            self.endpoints = {}
+
+    def _endpoint(self, name):
+        if name not in self.endpoints:
+            self.endpoints[name] = {'requests': 0, 'queries': 0,
+                                    'db_time': 0.0}
+        return self.endpoints[name]
+
+    def record_wait(self, seconds):
+        """ Counts the time spent waiting to check out a connection """
+
+        with self.lock:
+            self.wait_time += seconds
+            self.max_wait_time = max(self.max_wait_time, seconds)
+
+    def record_request(self, endpoint):
+        """ Counts a request to an endpoint """
+
+        with self.lock:
+            self._endpoint(endpoint)['requests'] += 1
+
+    def record_query(self, endpoint, seconds):
+        """ Counts a query made while handling an endpoint """
+
+        with self.lock:
+            self.queries += 1
+            self.query_time += seconds
+            counters = self._endpoint(endpoint)
+            counters['queries'] += 1
+            counters['db_time'] += seconds
+
+    def snapshot(self, pool=None):
+        """
+        Returns the counters, with times in milliseconds, and the
+        current state of the connection pool
+
+        Arguments
+            * pool - the connection pool of the app's engine
+        """
+
+        with self.lock:
+            output = {
+                'source': f'{socket.gethostname()}:{os.getpid()}',
+                'since': self.since.isoformat(),
+                'pool': {
+                    'connects': self.connects,
+                    'checkouts': self.checkouts,
+                    'invalidations': self.invalidations,
+                    'wait_time_ms': self.wait_time * 1000,
+                    'max_wait_time_ms': self.max_wait_time * 1000
+                },
+                'queries': {
+                    'count': self.queries,
+                    'time_ms': self.query_time * 1000
+                },
+                'endpoints': {
+                    name: {
+                        'requests': counters['requests'],
+                        'queries': counters['queries'],
+                        'db_time_ms': counters['db_time'] * 1000,
+                        'db_time_ms_per_request': (
+                            counters['db_time'] * 1000 / counters['requests']
+                            if counters['requests'] else None
+                        )
+                    } for name, counters in sorted(self.endpoints.items())
+                }
+            }
+
+        if pool is not None:
+            output['pool']['class'] = type(pool).__name__
+            if isinstance(pool, QueuePool):
+                output['pool'].update({
+                    'size': pool.size(),
+                    'checked_in': pool.checkedin(),
+                    'checked_out': pool.checkedout(),
+                    'overflow': pool.overflow()
+                })
+        return output
+
+
+# The database statistics of this server process
+stats = DatabaseStats()
+
+
+class TimedQueuePool(QueuePool):
+    """ A QueuePool counting the time spent waiting for a connection """
+
+    def connect(self):
+        began = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            stats.record_wait(time.perf_counter() - began)
+
+
+def engine_options(config):
+    """
+    Returns the engine options setting up the connection pool from the
+    DB_POOL_* settings of a config. SQLite connections cannot be shared
+    between threads, so SQLite keeps the pool Flask-SQLAlchemy gives it.
+
+    Arguments
+        * config - the Flask app's config
+    """
+
+    options = {}
+    if 'DB_POOL_PRE_PING' in config:
+        options['pool_pre_ping'] = config['DB_POOL_PRE_PING']
+
+    uri = config.get('SQLALCHEMY_DATABASE_URI')
+    if uri is None or make_url(uri).drivername.startswith('sqlite'):
+        return options
+
+    options['poolclass'] = TimedQueuePool
+    for setting, option in _pool_settings.items():
+        if setting in config:
+            options[option] = config[setting]
+    return options
+
+
+def _current_endpoint():
+    if has_request_context():
+        return request.endpoint or request.path
+    return BACKGROUND
+
+
+@event.listens_for(Pool, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    with stats.lock:
+        stats.connects += 1
+
+
+@event.listens_for(Pool, 'checkout')
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    with stats.lock:
+        stats.checkouts += 1
+
+
+@event.listens_for(Pool, 'invalidate')
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    with stats.lock:
+        stats.invalidations += 1
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context,
+                    executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context,
+                   executemany):
+    started = conn.info['query_started'].pop()
+    stats.record_query(_current_endpoint(), time.perf_counter() - started)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _on_error(context):
+    # A failed query is not followed by after_cursor_execute
+    started = context.connection.info.get('query_started')
+    if started and context.cursor is not None:
+        stats.record_query(_current_endpoint(),
+                           time.perf_counter() - started.pop())
+
+
+def init_app(app):
+    """
+    Sets up the connection pool of an app from its config, options in
+    SQLALCHEMY_ENGINE_OPTIONS taking priority, and counts its requests
+    """
+
+    options = engine_options(app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    @app.before_request
+    def count_request():
+        stats.record_request(_current_endpoint())
@@ -0,0 +1,307 @@
+"""
+Request Downsampling
+
+Reduces the requests of a test to a bounded number of points for
+charting. Requests are grouped into fixed-width time buckets, and
+each bucket is reduced either to summary statistics, or to the single
+request chosen by Largest-Triangle-Three-Buckets (LTTB) which keeps
+the visual shape of the raw series.
+
+Rows are read in chunks ordered by timestamp, so only the rows of the
+buckets in the current chunk are ever held in memory.
+
+Tests whose slaves aggregated their requests are downsampled from the
+uploaded window summaries instead, merging the windows in each bucket.
+"""
+
+import numpy as np
+from sqlalchemy import func, select
+
+from app import db
+from app.models import RequestWindow
+from app.partitions import request_table
+from app.sketches import LatencySketch
+from app.streaming import stream_rows
+
+AGGREGATE = 'aggregate'
+LTTB = 'lttb'
+MODES = (AGGREGATE, LTTB)
+
+# Percentiles reported for each bucket in aggregate mode
+PERCENTILES = {'p50': 0.50, 'p95': 0.95, 'p99': 0.99}
+
+
+def to_millis(timestamps):
+    """ Converts a sequence of naive datetimes to int64 epoch milliseconds """
+
+    return np.array(timestamps, dtype='datetime64[ms]').astype(np.int64)
+
+
+def time_range(test_id, column=None):
+    """
+    Returns the (first, last) request timestamps of a test in epoch
+    milliseconds, or None if the test has no requests
+
+    Arguments
+        * test_id - the ID of the test
+        * column - the timestamp column of the windows, by default
+            that of the requests
+    """
+
+    if column is None:
+        column = request_table(test_id).c.request_timestamp
+    first, last = db.session.execute(
+        select([func.min(column), func.max(column)]).where(
+            column.table.c.test_id == test_id
+        )
+    ).fetchone()
+
+    if first is None:
+        return None
+    return tuple(to_millis([first, last]))
+
+
+def bucket_width(start, end, points):
+    """ The bucket width in milliseconds that gives at most points buckets """
+
+    return max(1, -(-(end - start + 1) // points))
+
+
+def bucket_chunks(test_id, start, width):
+    """
+    Generator yielding (buckets, timestamps, response_times) arrays for
+    the requests of a test, ordered by timestamp. Every chunk only holds
+    complete buckets, rows of a bucket that continues into the next chunk
+    from the cursor are carried over.
+
+    Arguments
+        * test_id - the ID of the test
+        * start - the start of the first bucket in epoch milliseconds
+        * width - the bucket width in milliseconds
+    """
+
+    table = request_table(test_id)
+    statement = select([
+        table.c.request_timestamp, table.c.response_time
+    ]).where(
+        table.c.test_id == test_id
+    ).order_by(table.c.request_timestamp, table.c.id)
+
+    carry_t = np.empty(0, dtype=np.int64)
+    carry_r = np.empty(0, dtype=np.float64)
+
+    for rows in stream_rows(statement):
+        t = np.concatenate((carry_t, to_millis([row[0] for row in rows])))
+        r = np.concatenate((carry_r, np.array(
+            [row[1] for row in rows], dtype=np.float64
+        )))
+        b = (t - start) // width
+
+        # The last bucket may continue in the next chunk
+        split = np.searchsorted(b, b[-1])
+        if split > 0:
+            yield b[:split], t[:split], r[:split]
+        carry_t, carry_r = t[split:], r[split:]
+
+    if len(carry_t):
+        yield (carry_t - start) // width, carry_t, carry_r
+
+
+def aggregate(chunks, start, width):
+    """
+    Reduces each bucket to its count, min, max, mean and percentiles.
+    Percentiles use the same definition as percentile_disc.
+    """
+
+    output = {'timestamps': [], 'count': [], 'min': [], 'max': [],
+              'mean': []}
+    for name in PERCENTILES:
+        output[name] = []
+
+    for b, t, r in chunks:
+        buckets, starts, counts = np.unique(
+            b, return_index=True, return_counts=True
+        )
+        # Sort response times within each bucket
+        ordered = r[np.lexsort((r, b))]
+        ends = starts + counts - 1
+
+        output['timestamps'].extend((start + buckets * width).tolist())
+        output['count'].extend(counts.tolist())
+        output['min'].extend(ordered[starts].tolist())
+        output['max'].extend(ordered[ends].tolist())
+        output['mean'].extend(
+            (np.add.reduceat(r, starts) / counts).tolist()
+        )
+        for name, p in PERCENTILES.items():
+            ranks = np.maximum(np.ceil(p * counts).astype(np.int64) - 1, 0)
+            output[name].extend(ordered[starts + ranks].tolist())
+
+    return output
+
+
+def _split_buckets(chunks):
+    """ Generator yielding the (timestamps, response_times) of each bucket """
+
+    for b, t, r in chunks:
+        bounds = np.flatnonzero(np.diff(b)) + 1
+        yield from zip(np.split(t, bounds), np.split(r, bounds))
+
+
+def lttb(chunks):
+    """
+    Selects one request per bucket with Largest-Triangle-Three-Buckets.
+    The first and last requests of the test are always kept, every other
+    bucket keeps the request forming the largest triangle with the point
+    kept from the previous bucket and the mean of the next bucket.
+    """
+
+    output = {'timestamps': [], 'response_times': []}
+    buckets = _split_buckets(chunks)
+
+    current = next(buckets, None)
+    if current is None:
+        return output
+
+    # The very first request anchors the first triangle
+    prev_t, prev_r = int(current[0][0]), float(current[1][0])
+    output['timestamps'].append(prev_t)
+    output['response_times'].append(prev_r)
+    current = (current[0][1:], current[1][1:])
+
+    for following in buckets:
+        t, r = current
+        if len(t):
+            next_t = following[0].mean()
+            next_r = following[1].mean()
+            area = np.abs(
+                (prev_t - next_t) * (r - prev_r)
+                - (prev_t - t) * (next_r - prev_r)
+            )
+            chosen = int(np.argmax(area))
+            prev_t, prev_r = int(t[chosen]), float(r[chosen])
+            output['timestamps'].append(prev_t)
+            output['response_times'].append(prev_r)
+        current = following
+
+    # The very last request closes the series
+    t, r = current
+    if len(t):
+        output['timestamps'].append(int(t[-1]))
+        output['response_times'].append(float(r[-1]))
+
+    return output
+
+
+def downsample(test_id, mode=AGGREGATE, width=None, points=1000):
+    """
+    Downsamples the requests of a test into time buckets
+
+    Arguments
+        * test_id - the ID of the test
+        * mode - AGGREGATE for per-bucket statistics or LTTB for
+            a shape-preserving subset of the raw requests
+        * width - the bucket width in milliseconds, if not given
+            it is chosen so there are at most points buckets
+        * points - the target number of buckets
+    """
+
+    bounds = time_range(test_id)
+    if bounds is None:
+        return {'mode': mode, 'start': None, 'width': width,
+                **(aggregate([], 0, 1) if mode == AGGREGATE else lttb([]))}
+
+    start, end = int(bounds[0]), int(bounds[1])
+    if width is None:
+        width = bucket_width(start, end, points)
+
+    chunks = bucket_chunks(test_id, start, width)
+    if mode == AGGREGATE:
+        series = aggregate(chunks, start, width)
+    else:
+        series = lttb(chunks)
+
+    return {'mode': mode, 'start': start, 'width': width, **series}
+
+
+def has_windows(test_id):
+    """ Whether any requests of a test were uploaded as window summaries """
+
+    return db.session.query(
+        RequestWindow.query.filter(RequestWindow.test_id == test_id).exists()
+    ).scalar()
+
+
+def downsample_windows(test_id, width=None, points=1000):
+    """
+    Downsamples the request window summaries of a test into time buckets
+    of per-bucket statistics, in the same format as AGGREGATE mode.
+    Windows are placed in the bucket containing their start.
+
+    Arguments
+        * test_id - the ID of the test
+        * width - the bucket width in milliseconds, if not given
+            it is chosen so there are at most points buckets
+        * points - the target number of buckets
+    """
+
+    bounds = time_range(test_id, RequestWindow.window_start)
+    if bounds is None:
+        return {'mode': AGGREGATE, 'start': None, 'width': width,
+                **aggregate([], 0, 1)}
+
+    start, end = int(bounds[0]), int(bounds[1])
+    if width is None:
+        width = bucket_width(start, end, points)
+
+    return {'mode': AGGREGATE, 'start': start, 'width': width,
+            **aggregate_windows(test_id, start, width)}
+
+
+def aggregate_windows(test_id, start, width):
+    """
+    Merges the request window summaries of a test in each bucket into
+    per-bucket statistics, in the same format as aggregate()
+
+    Arguments
+        * test_id - the ID of the test
+        * start - the start of the first bucket in epoch milliseconds
+        * width - the bucket width in milliseconds
+    """
+
+    table = RequestWindow.__table__
+    statement = select([
+        table.c.window_start, table.c.count, table.c.total,
+        table.c.min, table.c.max, table.c.sketch
+    ]).where(
+        table.c.test_id == test_id
+    ).order_by(table.c.window_start)
+
+    output = {'timestamps': [], 'count': [], 'min': [], 'max': [],
+              'mean': []}
+    for name in PERCENTILES:
+        output[name] = []
+
+    def emit(bucket, sketch):
+        output['timestamps'].append(start + bucket * width)
+        output['count'].append(sketch.count)
+        output['min'].append(sketch.min)
+        output['max'].append(sketch.max)
+        output['mean'].append(sketch.mean())
+        for name, p in PERCENTILES.items():
+            output[name].append(sketch.quantile(p))
+
+    bucket, merged = None, None
+    for rows in stream_rows(statement):
+        buckets = (to_millis([row[0] for row in rows]) - start) // width
+        for index, row in zip(buckets.tolist(), rows):
+            if index != bucket:
+                if merged is not None:
+                    emit(bucket, merged)
+                bucket, merged = index, LatencySketch()
+            merged.merge(LatencySketch.loads(row[5]))
+
+    if merged is not None:
+        emit(bucket, merged)
+
+    return output
@@ -0,0 +1,217 @@
+"""
+Test Data Export
+
+Writes the raw requests and system metrics of a test to files for
+offline analysis, either as Parquet, which loads straight into pandas
+or NumPy, or as CSV when pyarrow is not installed.
+
+Rows are read through a server-side cursor in batches of EXPORT_BATCH
+rows, and each batch is encoded and handed on (as a Parquet row group,
+or a block of CSV lines) before the next one is read, so memory use is
+bounded however large the test is. The same generators back
+`manage.py export` and the streaming download endpoint.
+"""
+
+import csv
+import io
+import os
+
+from sqlalchemy import (BigInteger, Boolean, Float, Integer, TIMESTAMP,
+                        select)
+
+from app.models import SystemMetric
+from app.partitions import request_table
+from app.streaming import stream_rows
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+PARQUET = 'parquet'
+CSV = 'csv'
+FORMATS = (PARQUET, CSV)
+
+REQUESTS = 'requests'
+METRICS = 'metrics'
+DATASETS = (REQUESTS, METRICS)
+
+CONTENT_TYPES = {
+    PARQUET: 'application/vnd.apache.parquet',
+    CSV: 'text/csv'
+}
+
+# Rows per record batch (Parquet row group) read from the cursor
+EXPORT_BATCH = 65536
+
+
+class ExportError(ValueError):
+    """ Raised when an export of an unknown dataset or format is asked for """
+
+
+def export_format(requested=None):
+    """
+    Returns the format to export in: the requested one, or Parquet
+    if pyarrow is installed and CSV otherwise
+
+    Arguments
+        * requested - the format asked for, if any
+    """
+
+    if requested is None:
+        return PARQUET if pa is not None else CSV
+    if requested not in FORMATS:
+        raise ExportError(f"Unknown export format: {requested}")
+    if requested == PARQUET and pa is None:
+        raise ExportError("Parquet export needs pyarrow to be installed.")
+    return requested
+
+
+def dataset_statement(test_id, dataset):
+    """
+    Returns the statement selecting the rows of a test's dataset
+
+    Arguments
+        * test_id - the ID of the test
+        * dataset - REQUESTS or METRICS
+    """
+
+    if dataset == REQUESTS:
+        table = request_table(test_id)
+    elif dataset == METRICS:
+        table = SystemMetric.__table__
+    else:
+        raise ExportError(f"Unknown dataset: {dataset}")
+
+    return select([table]).where(
+        table.c.test_id == test_id
+    ).order_by(table.c.id)
+
+
+def file_name(test_id, dataset, output_format):
+    """ The name of the file a test's dataset is exported to """
+
+    return f'test_{test_id}_{dataset}.{output_format}'
+
+
+def _arrow_type(column):
+    """ The Arrow type of a table column """
+
+    if isinstance(column.type, TIMESTAMP):
+        return pa.timestamp('us')
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, (Integer, BigInteger)):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    return pa.string()
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    A write-only file handing on what has been written since it was
+    last drained, so a Parquet file can be streamed as it is written
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet_chunks(columns, batches):
+    """ Generator encoding batches of rows as a Parquet file """
+
+    schema = pa.schema([(column.name, _arrow_type(column))
+                        for column in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+
+    for rows in batches:
+        values = list(zip(*rows))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(values[i], type=field.type)
+             for i, field in enumerate(schema)],
+            schema=schema
+        ))
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+def _csv_chunks(columns, batches):
+    """ Generator encoding batches of rows as CSV, with a header line """
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([column.name for column in columns])
+
+    for rows in batches:
+        writer.writerows(rows)
+        yield output.getvalue().encode()
+        output.seek(0)
+        output.truncate()
+
+    yield output.getvalue().encode()
+
+
+def export_chunks(test_id, dataset, output_format):
+    """
+    Returns a generator of the bytes of a test's dataset exported in
+    a format, which reads the rows a batch at a time as it is consumed
+
+    Arguments
+        * test_id - the ID of the test
+        * dataset - REQUESTS or METRICS
+        * output_format - PARQUET or CSV, see export_format()
+    """
+
+    statement = dataset_statement(test_id, dataset)
+    batches = stream_rows(statement, chunk_size=EXPORT_BATCH)
+    if output_format == PARQUET:
+        return _parquet_chunks(statement.columns, batches)
+    return _csv_chunks(statement.columns, batches)
+
+
+def export_test(test_id, directory, output_format=None):
+    """
+    Exports every dataset of a test into files in a directory.
+    Returns the paths of the files written.
+
+    Arguments
+        * test_id - the ID of the test
+        * directory - the directory to write the files to
+        * output_format - the format to export in, see export_format()
+    """
+
+    output_format = export_format(output_format)
+    os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    for dataset in DATASETS:
+        path = os.path.join(
+            directory, file_name(test_id, dataset, output_format)
+        )
+        with open(path, 'wb') as f:
+            for data in export_chunks(test_id, dataset, output_format):
+                f.write(data)
+        paths.append(path)
+    return paths
@@ -0,0 +1,329 @@
+"""
+Request Ingestion
+
+Helpers used by the webservice to persist batches of request data.
+A batch is validated in full before anything is written, and is then
+inserted with SQLAlchemy Core in a single transaction rather than
+going through the ORM one object at a time.
+
+Ingested rows are append-only, so they never pass through the ORM:
+no model objects are built, added to the identity map or tracked for
+changes. Reads still use the models. See benchmarks/ingest_profile.py
+for the cost per row of both paths.
+"""
+
+from datetime import datetime
+from sqlalchemy import func, select
+
+from app import db
+from app.models import RequestWindow, SystemMetric
+from app.partitions import request_table
+from app.summaries import record_metrics, record_requests, record_windows
+from app.sketches import sketches, LatencySketch, RELATIVE_ACCURACY
+
+# Number of rows per multi-row INSERT ... RETURNING statement
+INSERT_CHUNK = 1000
+
+
+class BatchError(ValueError):
+    """ Raised when a posted batch contains an invalid record """
+
+
+def parse_timestamp(value):
+    """
+    Converts an ISO formatted string into a datetime
+
+    Arguments
+        * value - the string (or datetime) to convert
+    """
+
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def parse_bool(value):
+    """
+    Returns a boolean sent as true, false, 1 or 0, and raises a
+    ValueError for anything else, such as the string "false"
+
+    Arguments
+        * value - the value to convert
+    """
+
+    if value in (True, False) and not isinstance(value, float):
+        return bool(value)
+    raise ValueError(f"{value!r} is not a boolean")
+
+
+def _optional(convert, value):
+    """ Applies convert to value unless the value is None """
+
+    return None if value is None else convert(value)
+
+
+def _number(value, integer=False):
+    """
+    Returns value if it is a number, or an integer when integer is set,
+    and raises a ValueError otherwise
+    """
+
+    kinds = int if integer else (int, float)
+    if isinstance(value, bool) or not isinstance(value, kinds):
+        raise ValueError(f"{value!r} is not a number")
+    return value
+
+
+def _parse_sketch(data):
+    """
+    Converts a posted sketch into a LatencySketch, raising a ValueError
+    if it cannot be merged with the sketches of this server: its accuracy
+    must be RELATIVE_ACCURACY and its bins must map integer keys to counts
+
+    Arguments
+        * data - the decoded sketch, see LatencySketch.to_dict()
+    """
+
+    if data['relative_accuracy'] != RELATIVE_ACCURACY:
+        raise ValueError(
+            f"sketch accuracy must be {RELATIVE_ACCURACY}, "
+            f"not {data['relative_accuracy']}"
+        )
+
+    sketch = LatencySketch.from_dict(data)
+    for key, count in sketch.bins.items():
+        if _number(count, integer=True) < 0:
+            raise ValueError(f"sketch bin {key} has a negative count")
+    _number(sketch.zero_count, integer=True)
+    _number(sketch.count, integer=True)
+    _number(sketch.total)
+    _optional(_number, sketch.min)
+    _optional(_number, sketch.max)
+    return sketch
+
+
+def parse_requests(records):
+    """
+    Validates a posted batch of request records and converts them
+    into rows ready to be inserted. Raises BatchError describing the
+    first invalid record, in which case nothing should be saved.
+
+    Arguments
+        * records - the decoded JSON list of request records
+    """
+
+    if not isinstance(records, list):
+        raise BatchError("Expected a list of requests.")
+
+    rows = []
+    for index, record in enumerate(records):
+        try:
+            rows.append({
+                'name': record['name'],
+                'request_timestamp': parse_timestamp(
+                    record['request_timestamp']
+                ),
+                'request_method': record['request_method'],
+                'request_length': _optional(int, record['request_length']),
+                'response_length': _optional(
+                    int, record['response_length']
+                ),
+                'response_time': float(record['response_time']),
+                'status_code': _optional(str, record['status_code']),
+                'success': parse_bool(record['success']),
+                'exception': _optional(str, record['exception']),
+                'sampled': parse_bool(record.get('sampled') or False)
+            })
+        except KeyError as e:
+            raise BatchError(f"Request {index} is missing field {e}")
+        except (TypeError, ValueError) as e:
+            raise BatchError(f"Request {index} is invalid: {e}")
+
+    return rows
+
+
+def insert_requests(rows, test_id, finalized=False):
+    """
+    Inserts a validated batch of rows for a test in one transaction,
+    along with the matching update to the test's summary.
+    Returns the IDs of the first and last inserted requests.
+
+    Arguments
+        * rows - the rows returned by parse_requests()
+        * test_id - the ID of the test the requests belong to
+        * finalized - whether the test has already been finalized
+    """
+
+    table = request_table(test_id)
+    for row in rows:
+        row['test_id'] = test_id
+
+    try:
+        if db.engine.dialect.implicit_returning:
+            # Multi-row VALUES with RETURNING gives us the new IDs
+            # without a second round trip (PostgreSQL)
+            ids = []
+            for start in range(0, len(rows), INSERT_CHUNK):
+                chunk = rows[start:start + INSERT_CHUNK]
+                result = db.session.execute(
+                    table.insert().values(chunk).returning(table.c.id)
+                )
+                ids.extend(row[0] for row in result)
+        else:
+            # Writers are serialized for the length of the transaction
+            # (SQLite), so the batch occupies a contiguous range of IDs
+            db.session.execute(table.insert(), rows)
+            last_id = db.session.execute(
+                select([func.max(table.c.id)])
+            ).scalar()
+            ids = range(last_id - len(rows) + 1, last_id + 1)
+
+        # Sampled requests are already counted by their window summary
+        counted = [i for i, row in enumerate(rows) if not row['sampled']]
+        if counted:
+            record_requests(
+                test_id,
+                [rows[i] for i in counted],
+                [ids[i] for i in counted],
+                finalized
+            )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    sketches.record(test_id, [rows[i] for i in counted])
+
+    return min(ids), max(ids)
+
+
+def parse_windows(records):
+    """
+    Validates a posted batch of request window summaries and converts
+    them into rows ready to be inserted. Raises BatchError describing
+    the first invalid summary, in which case nothing should be saved.
+
+    Arguments
+        * records - the decoded JSON list of window summaries
+    """
+
+    if not isinstance(records, list):
+        raise BatchError("Expected a list of request windows.")
+
+    rows = []
+    for index, record in enumerate(records):
+        try:
+            count = int(record['count'])
+            if count <= 0:
+                raise ValueError("count must be positive")
+            sketch = _parse_sketch(record['sketch'])
+            rows.append({
+                'window_start': parse_timestamp(record['window_start']),
+                'window_seconds': float(record['window_seconds']),
+                'request_method': record['request_method'],
+                'name': record['name'],
+                'status_code': _optional(str, record['status_code']),
+                'success': parse_bool(record['success']),
+                'count': count,
+                'total': float(record['total']),
+                'min': float(record['min']),
+                'max': float(record['max']),
+                'sketch': sketch
+            })
+        except KeyError as e:
+            raise BatchError(f"Window {index} is missing field {e}")
+        except (TypeError, ValueError, AttributeError) as e:
+            raise BatchError(f"Window {index} is invalid: {e}")
+
+    return rows
+
+
+def insert_windows(rows, test_id, finalized=False):
+    """
+    Inserts a validated batch of window summaries for a test in one
+    transaction, along with the matching update to the test's summary.
+    Their sketches are merged into the test's live sketches.
+
+    Arguments
+        * rows - the rows returned by parse_windows()
+        * test_id - the ID of the test the windows belong to
+        * finalized - whether the test has already been finalized
+    """
+
+    table = RequestWindow.__table__
+    values = [dict(row, test_id=test_id, sketch=row['sketch'].dumps())
+              for row in rows]
+
+    try:
+        db.session.execute(table.insert(), values)
+        record_windows(test_id, rows, finalized)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for row in rows:
+        sketches.record_sketch(test_id, row['name'], row['sketch'])
+
+
+def parse_metrics(records):
+    """
+    Validates a posted batch of system metrics and converts them into
+    rows ready to be inserted. Raises BatchError describing the first
+    invalid metric, in which case nothing should be saved.
+
+    Arguments
+        * records - the decoded JSON list of metrics
+    """
+
+    if not isinstance(records, list):
+        raise BatchError("Expected a list of metrics.")
+
+    rows = []
+    for index, record in enumerate(records):
+        try:
+            rows.append({
+                'system_name': str(record['system_name']),
+                'metric_name': str(record['metric_name']),
+                'metric_timestamp': parse_timestamp(
+                    record['metric_timestamp']
+                ),
+                'metric_value': float(record['metric_value'])
+            })
+        except KeyError as e:
+            raise BatchError(f"Metric {index} is missing field {e}")
+        except (TypeError, ValueError) as e:
+            raise BatchError(f"Metric {index} is invalid: {e}")
+
+    return rows
+
+
+def insert_metrics(rows, test_id):
+    """
+    Inserts a validated batch of metrics for a test in one transaction,
+    along with the matching update to the test's summary. Returns a list
+    holding the ID of the metric when a single one is inserted, and None
+    otherwise.
+
+    Arguments
+        * rows - the rows returned by parse_metrics()
+        * test_id - the ID of the test the metrics belong to
+    """
+
+    table = SystemMetric.__table__
+    values = [dict(row, test_id=test_id) for row in rows]
+
+    try:
+        if len(values) == 1:
+            result = db.session.execute(table.insert(), values[0])
+            ids = list(result.inserted_primary_key)
+        else:
+            db.session.execute(table.insert(), values)
+            ids = None
+        record_metrics(test_id, len(rows))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return ids
@@ -0,0 +1,196 @@
+"""
+Background Jobs
+
+Long running maintenance work, such as deleting a test and its data,
+runs in a background thread of the server process so the request that
+starts it returns at once. Each job has a row in loadtest_jobs that the
+thread updates as it makes progress, which is served by
+/api/v1/jobs/<job_id>.
+
+Deleting a test drops its request partition, then deletes the rest of
+its data with set-based DELETE statements of at most DELETE_BATCH rows,
+committing after each one. No statement holds its locks for long, so
+a running test keeps ingesting while a large test is deleted. Every
+step can be repeated, so deleting a test again finishes a deletion
+that was interrupted.
+
+A job's thread dies with its server process, leaving the job pending
+or running. Jobs record when they last made progress, and once a job
+has made none for STALE_AFTER seconds, deleting its test again marks
+it failed and starts over.
+"""
+
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select
+
+from app import app, db
+from app.models import (Job, Request, RequestWindow, SystemMetric, Test,
+                        TestSummary)
+from app.partitions import drop_partition
+from app.sketches import sketches
+
+# Maximum number of rows removed by one DELETE statement
+DELETE_BATCH = 10000
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+DELETE_TEST = 'delete_test'
+
+# Seconds without progress after which a pending or running job is
+# taken to have died with the server process running it
+STALE_AFTER = 600
+
+# Tables deleted from in batches, after the request partition is dropped
+BATCHED_TABLES = (
+    # Requests of a test without a partition are in the default one
+    ('requests', Request.__table__),
+    ('request windows', RequestWindow.__table__),
+    ('metrics', SystemMetric.__table__)
+)
+
+
+def _update(job_id, **values):
+    """ Saves the progress of a job """
+
+    table = Job.__table__
+    db.session.execute(
+        table.update().where(table.c.id == job_id).values(
+            updated=datetime.now(), **values
+        )
+    )
+    db.session.commit()
+
+
+def delete_batches(table, test_id):
+    """
+    Generator deleting the rows of a test from a table, at most
+    DELETE_BATCH rows at a time, and committing after each batch.
+    Yields the number of rows deleted by each batch.
+
+    Arguments
+        * table - the table to delete from, which has an id column
+        * test_id - the ID of the test whose rows are deleted
+    """
+
+    by_test = table.c.test_id == test_id
+    while True:
+        batch = select([table.c.id]).where(by_test).limit(DELETE_BATCH)
+        deleted = db.session.execute(
+            table.delete().where(by_test & table.c.id.in_(batch))
+        ).rowcount
+        db.session.commit()
+        if not deleted:
+            return
+        yield deleted
+
+
+def delete_test_data(job_id, test_id):
+    """
+    Deletes a test and all of its data, reporting progress on a job
+
+    Arguments
+        * job_id - the ID of the job
+        * test_id - the ID of the test to delete
+    """
+
+    done, deleted = 0, 0
+    _update(job_id, steps_total=len(BATCHED_TABLES) + 2)
+
+    _update(job_id, step='request partition')
+    drop_partition(test_id)
+    db.session.commit()
+    done += 1
+    _update(job_id, steps_done=done)
+
+    for step, table in BATCHED_TABLES:
+        _update(job_id, step=step)
+        for count in delete_batches(table, test_id):
+            deleted += count
+            _update(job_id, rows_deleted=deleted)
+        done += 1
+        _update(job_id, steps_done=done)
+
+    _update(job_id, step='test')
+    sketches.delete(test_id)
+    TestSummary.query.filter(TestSummary.test_id == test_id).delete()
+    Test.query.filter(Test.id == test_id).delete()
+    db.session.commit()
+    _update(job_id, steps_done=done + 1)
+
+
+def _run(job_id, target, *args):
+    """ Runs a job in the calling thread, recording how it ended """
+
+    with app.app_context():
+        try:
+            _update(job_id, status=RUNNING)
+            target(job_id, *args)
+            _update(job_id, status=DONE, step=None,
+                    finished=datetime.now())
+        except Exception as e:
+            db.session.rollback()
+            _update(job_id, status=FAILED, error=str(e),
+                    finished=datetime.now())
+        finally:
+            db.session.remove()
+
+
+def start_job(kind, test_id, target, *args):
+    """
+    Saves a new job and runs it in a background thread.
+    Returns the ID of the job.
+
+    Arguments
+        * kind - the kind of job
+        * test_id - the ID of the test the job works on
+        * target - the function doing the work, called with
+            the ID of the job followed by args
+    """
+
+    now = datetime.now()
+    job = Job(kind=kind, test_id=test_id, status=PENDING,
+              created=now, updated=now)
+    db.session.add(job)
+    db.session.commit()
+    job_id = job.id
+
+    threading.Thread(
+        target=_run, args=(job_id, target) + args,
+        name=f'job-{job_id}', daemon=True
+    ).start()
+    return job_id
+
+
+def _is_stale(job):
+    """ Whether a job has made no progress for STALE_AFTER seconds """
+
+    updated = job.updated or job.created
+    return updated is None \
+        or datetime.now() - updated > timedelta(seconds=STALE_AFTER)
+
+
+def delete_test_job(test_id):
+    """
+    Starts deleting a test in the background, unless it is already
+    being deleted. Returns the ID of the job deleting it.
+    A stale job deleting the test is marked failed and replaced.
+
+    Arguments
+        * test_id - the ID of the test to delete
+    """
+
+    running = Job.query.filter(
+        (Job.kind == DELETE_TEST) & (Job.test_id == test_id)
+        & Job.status.in_((PENDING, RUNNING))
+    ).first()
+    if running is not None:
+        if not _is_stale(running):
+            return running.id
+        _update(running.id, status=FAILED, finished=datetime.now(),
+                error=f"Made no progress for {STALE_AFTER} seconds")
+
+    return start_job(DELETE_TEST, test_id, delete_test_data, test_id)
@@ -28,6 +28,14 @@ class Test(db.Model):
         }
 
 
+# At most one test is running (not finalized) at a time. Every server
+# process reads the running test from the database, so this is what
+# stops two processes from starting a test at the same time.
+db.Index('uq_loadtest_tests_running', Test.end.is_(None), unique=True,
+         postgresql_where=Test.end.is_(None),
+         sqlite_where=Test.end.is_(None))
+
+
 class TestSchema(ma.ModelSchema):
     class Meta:
         model = Test
@@ -35,9 +43,26 @@ class TestSchema(ma.ModelSchema):
 
 class Request(db.Model):
     __tablename__ = 'loadtest_requests'
+    __table_args__ = (
+        # Every read filters by test, then orders by time or response time
+        db.Index('ix_loadtest_requests_test_id_request_timestamp',
+                 'test_id', 'request_timestamp', 'id'),
+        db.Index('ix_loadtest_requests_test_id_response_time',
+                 'test_id', 'response_time'),
+        # Each test's requests get their own partition, see app.partitions
+        {'postgresql_partition_by': 'LIST (test_id)'}
+    )
 
-    id = db.Column(db.Integer, primary_key=True)
-    test_id = db.Column(db.Integer)
+    # The partition key must be part of the primary key, so
+    # PostgreSQL's ID sequence is set up after the table is created
+    id = db.Column(db.Integer, primary_key=True,
+                   server_default=db.FetchedValue())
+    test_id = db.Column(
+        db.Integer,
+        db.ForeignKey('loadtest_tests.id', ondelete='CASCADE'),
+        primary_key=True,
+        autoincrement=False
+    )
     name = db.Column(db.String())
     request_timestamp = db.Column(db.TIMESTAMP)
     request_method = db.Column(db.String())
@@ -47,6 +72,7 @@ class Request(db.Model):
     status_code = db.Column(db.String())
     success = db.Column(db.Boolean)
     exception = db.Column(db.String())
+    sampled = db.Column(db.Boolean)
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -65,20 +91,82 @@ class Request(db.Model):
             'response_time': self.response_time,
             'status_code': self.status_code,
             'success': self.success,
-            'exception': self.exception
+            'exception': self.exception,
+            'sampled': self.sampled
         }
         
 
+# Requests of tests without a partition of their own land in the
+# default partition
+db.event.listen(
+    Request.__table__,
+    'after_create',
+    db.DDL(
+        'CREATE SEQUENCE IF NOT EXISTS loadtest_requests_id_seq '
+        'OWNED BY loadtest_requests.id; '
+        'ALTER TABLE loadtest_requests ALTER COLUMN id '
+        "SET DEFAULT nextval('loadtest_requests_id_seq'); "
+        'CREATE TABLE IF NOT EXISTS loadtest_requests_default '
+        'PARTITION OF loadtest_requests DEFAULT'
+    ).execute_if(dialect='postgresql')
+)
+
+
 class RequestSchema(ma.ModelSchema):
     class Meta:
         model = Request
+        include_fk = True
+
+
+class RequestWindow(db.Model):
+    """
+    A summary of the requests made by one slave in a window of time,
+    for a single (request_method, name, status_code, success) group.
+    Uploaded instead of the individual requests when a slave's
+    DataBuffer aggregates them.
+    """
+    __tablename__ = 'loadtest_request_windows'
+    __table_args__ = (
+        db.Index('ix_loadtest_request_windows_test_id_window_start',
+                 'test_id', 'window_start'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    test_id = db.Column(
+        db.Integer,
+        db.ForeignKey('loadtest_tests.id', ondelete='CASCADE')
+    )
+    window_start = db.Column(db.TIMESTAMP)
+    window_seconds = db.Column(db.Float)
+    request_method = db.Column(db.String())
+    name = db.Column(db.String())
+    status_code = db.Column(db.String())
+    success = db.Column(db.Boolean)
+    count = db.Column(db.BigInteger)
+    total = db.Column(db.Float)
+    min = db.Column(db.Float)
+    max = db.Column(db.Float)
+    sketch = db.Column(db.Text)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    def __repr__(self):
+        return '<id {}>'.format(self.id)
 
 
 class SystemMetric(db.Model):
     __tablename__ = 'loadtest_metrics'
+    __table_args__ = (
+        db.Index('ix_loadtest_metrics_test_id_metric_timestamp',
+                 'test_id', 'metric_timestamp'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    test_id = db.Column(db.Integer)
+    test_id = db.Column(
+        db.Integer,
+        db.ForeignKey('loadtest_tests.id', ondelete='CASCADE')
+    )
     system_name = db.Column(db.String)
     metric_name = db.Column(db.String())
     metric_timestamp = db.Column(db.TIMESTAMP)
@@ -104,3 +192,109 @@ class SystemMetric(db.Model):
 class SystemMetricSchema(ma.ModelSchema):
     class Meta:
         model = SystemMetric
+        include_fk = True
+
+
+class TestSummary(db.Model):
+    """
+    Summary statistics of a test's requests and metrics. Counters are
+    maintained as data is ingested, and the whole summary is recomputed
+    when the test is finalized.
+    """
+    __tablename__ = 'loadtest_test_summaries'
+
+    test_id = db.Column(
+        db.Integer,
+        db.ForeignKey('loadtest_tests.id', ondelete='CASCADE'),
+        primary_key=True,
+        autoincrement=False
+    )
+    num_requests = db.Column(db.BigInteger, default=0, nullable=False)
+    num_success = db.Column(db.BigInteger, default=0, nullable=False)
+    num_metrics = db.Column(db.BigInteger, default=0, nullable=False)
+    response_time_total = db.Column(db.Float, default=0, nullable=False)
+    longest_request_id = db.Column(db.Integer)
+    longest_response_time = db.Column(db.Float)
+    median = db.Column(db.Float)
+    percentile_90 = db.Column(db.Float)
+    percentile_95 = db.Column(db.Float)
+    percentile_99 = db.Column(db.Float)
+    stale = db.Column(db.Boolean, default=False, nullable=False)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    def __repr__(self):
+        return '<test_id {}>'.format(self.test_id)
+
+    def mean(self):
+        if not self.num_requests:
+            return None
+        return self.response_time_total / self.num_requests
+
+
+class TestSummarySchema(ma.ModelSchema):
+    class Meta:
+        model = TestSummary
+        include_fk = True
+
+
+class RequestSketch(db.Model):
+    """
+    A checkpointed response time sketch of a test's requests, as
+    collected by one server process. Sketches of the same test and
+    endpoint name from every process are merged when read.
+    An empty name holds the sketch of all of the test's requests.
+    """
+    __tablename__ = 'loadtest_sketches'
+
+    test_id = db.Column(
+        db.Integer,
+        db.ForeignKey('loadtest_tests.id', ondelete='CASCADE'),
+        primary_key=True,
+        autoincrement=False
+    )
+    name = db.Column(db.String(), primary_key=True)
+    source = db.Column(db.String(), primary_key=True)
+    sketch = db.Column(db.Text)
+    updated = db.Column(db.TIMESTAMP)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    def __repr__(self):
+        return '<test_id {} name {}>'.format(self.test_id, self.name)
+
+
+class Job(db.Model):
+    """
+    A background job run by the server, such as deleting a test,
+    and its progress
+    """
+    __tablename__ = 'loadtest_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(), nullable=False)
+    # Not a foreign key, the job outlives the test it deletes
+    test_id = db.Column(db.Integer)
+    status = db.Column(db.String(), nullable=False)
+    step = db.Column(db.String())
+    steps_done = db.Column(db.Integer, default=0, nullable=False)
+    steps_total = db.Column(db.Integer, default=0, nullable=False)
+    rows_deleted = db.Column(db.BigInteger, default=0, nullable=False)
+    error = db.Column(db.String())
+    created = db.Column(db.TIMESTAMP)
+    # When the job last made progress
+    updated = db.Column(db.TIMESTAMP)
+    finished = db.Column(db.TIMESTAMP)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    def __repr__(self):
+        return '<id {} kind {}>'.format(self.id, self.kind)
+
+
+class JobSchema(ma.ModelSchema):
+    class Meta:
+        model = Job
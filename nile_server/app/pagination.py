@@ -0,0 +1,110 @@
+"""
+Keyset Pagination
+
+Helpers for serving large tables a page at a time. A page holds the
+rows whose ID follows the `after` ID of the previous page, in ID order,
+so every page is a short range scan of the primary key however deep
+into the table it is, unlike OFFSET. Rows are never repeated, and the
+pages of a finished test hold every one of its rows. While a test is
+running, a row committed after a page with higher IDs was read is
+skipped, as concurrent uploads may commit their IDs out of order.
+"""
+
+from sqlalchemy import and_, select
+
+from app import db
+from app.ingest import parse_timestamp
+
+# Rows per page when no limit is given, and the largest limit allowed
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+
+_booleans = {'true': True, '1': True, 'false': False, '0': False}
+
+
+class PageError(ValueError):
+    """ Raised when the paging or filter parameters are invalid """
+
+
+def page_params(args):
+    """
+    Returns the (limit, after) paging parameters of a request
+
+    Arguments
+        * args - the query parameters of the request
+    """
+
+    try:
+        limit = int(args.get('limit', DEFAULT_LIMIT))
+        after = int(args.get('after', 0))
+    except ValueError as e:
+        raise PageError(f"Invalid paging parameters: {e}")
+
+    if not 0 < limit <= MAX_LIMIT:
+        raise PageError(f"limit must be between 1 and {MAX_LIMIT}")
+    return limit, after
+
+
+def filter_conditions(table, args, timestamp, name, flags=()):
+    """
+    Builds the conditions filtering a table by the query parameters of
+    a request: test_id, a start and end time (start inclusive, end
+    exclusive, ISO formatted), name, and boolean flags
+
+    Arguments
+        * table - the table being paged through
+        * args - the query parameters of the request
+        * timestamp - the column filtered by start and end
+        * name - the column filtered by name
+        * flags - the boolean columns which can be filtered by
+    """
+
+    conditions = []
+    try:
+        if 'test_id' in args:
+            conditions.append(table.c.test_id == int(args['test_id']))
+        if 'start' in args:
+            conditions.append(
+                table.c[timestamp] >= parse_timestamp(args['start'])
+            )
+        if 'end' in args:
+            conditions.append(
+                table.c[timestamp] < parse_timestamp(args['end'])
+            )
+        if 'name' in args:
+            conditions.append(table.c[name] == args['name'])
+        for flag in flags:
+            if flag in args:
+                conditions.append(
+                    table.c[flag].is_(_booleans[args[flag].lower()])
+                )
+    except KeyError as e:
+        raise PageError(f"Invalid filter: expected true or false, got {e}")
+    except ValueError as e:
+        raise PageError(f"Invalid filter: {e}")
+
+    return conditions
+
+
+def keyset_page(tables, conditions, after, limit):
+    """
+    Returns up to limit rows with an ID greater than after, in ID order
+
+    Arguments
+        * tables - the tables to read, in order, each holding IDs
+            greater than those of the tables before it
+        * conditions - a function returning the filter conditions
+            for a table
+        * after - the ID of the last row of the previous page, or 0
+        * limit - the maximum number of rows
+    """
+
+    rows = []
+    for table in tables:
+        statement = select([table]).where(
+            and_(table.c.id > after, *conditions(table))
+        ).order_by(table.c.id).limit(limit - len(rows))
+        rows.extend(db.session.execute(statement).fetchall())
+        if len(rows) >= limit:
+            break
+    return rows
@@ -0,0 +1,198 @@
+"""
+Request Partitions
+
+The requests of each test are stored apart from those of other tests,
+so queries for one test only ever read that test's rows, and deleting
+a test drops its requests rather than deleting them row by row.
+
+On PostgreSQL loadtest_requests is partitioned by LIST (test_id), with
+a partition named loadtest_requests_<test_id> created when the test
+starts. Rows of tests without a partition go to the default partition.
+Queries against loadtest_requests that filter by test are pruned to
+that test's partition by the planner.
+
+SQLite, used for local testing, has no partitioning, so each test's
+requests are kept in a shard table of the same name instead and the
+loadtest_requests table itself stays empty. Shard IDs start at
+test_id << ID_BITS, so the test a request belongs to can be found
+from its ID alone.
+"""
+
+from sqlalchemy import (Boolean, Column, Float, Index, Integer, MetaData,
+                        String, TIMESTAMP, Table, select, text)
+from sqlalchemy import inspect as inspect_db
+
+from app import db
+from app.models import Request, Test
+
+# Shard IDs of a test start at test_id << ID_BITS
+ID_BITS = 32
+
+# Shard tables are kept out of the models' metadata, so create_all()
+# and migrations never see them
+shards = MetaData()
+
+# Shards known to exist in this process
+_created = set()
+
+
+def partitioned():
+    """ Whether the database partitions loadtest_requests natively """
+
+    return db.engine.dialect.name == 'postgresql'
+
+
+def partition_name(test_id):
+    """ The name of the partition or shard holding a test's requests """
+
+    return f'{Request.__tablename__}_{int(test_id)}'
+
+
+def shard_table(test_id):
+    """ The Table of a test's shard, which is not necessarily created """
+
+    name = partition_name(test_id)
+    table = shards.tables.get(name)
+    if table is None:
+        table = Table(
+            name, shards,
+            Column('id', Integer, primary_key=True),
+            Column('test_id', Integer),
+            Column('name', String()),
+            Column('request_timestamp', TIMESTAMP),
+            Column('request_method', String()),
+            Column('request_length', Integer),
+            Column('response_length', Integer),
+            Column('response_time', Float),
+            Column('status_code', String()),
+            Column('success', Boolean),
+            Column('exception', String()),
+            Column('sampled', Boolean),
+            Index(f'ix_{name}_request_timestamp',
+                  'test_id', 'request_timestamp', 'id'),
+            Index(f'ix_{name}_response_time', 'test_id', 'response_time'),
+            sqlite_autoincrement=True
+        )
+    return table
+
+
+def create_partition(test_id):
+    """
+    Creates the partition or shard for a test's requests if it does not
+    exist yet, as part of the current transaction.
+
+    Arguments
+        * test_id - the ID of the test
+    """
+
+    if partitioned():
+        db.session.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {partition_name(test_id)} '
+            f'PARTITION OF {Request.__tablename__} '
+            f'FOR VALUES IN ({int(test_id)})'
+        ))
+        return
+
+    table = shard_table(test_id)
+    connection = db.session.connection()
+    if not table.exists(bind=connection):
+        table.create(bind=connection)
+        if db.engine.dialect.name == 'sqlite':
+            # The next AUTOINCREMENT ID is one more than the sequence
+            connection.execute(
+                text('INSERT INTO sqlite_sequence (name, seq) '
+                     'VALUES (:name, :seq)'),
+                name=table.name, seq=int(test_id) << ID_BITS
+            )
+    _created.add(table.name)
+
+
+def drop_partition(test_id):
+    """
+    Drops the partition or shard of a test along with its requests,
+    as part of the current transaction.
+
+    Arguments
+        * test_id - the ID of the test
+    """
+
+    name = partition_name(test_id)
+    db.session.execute(text(f'DROP TABLE IF EXISTS {name}'))
+    _created.discard(name)
+    if name in shards.tables:
+        shards.remove(shards.tables[name])
+
+
+def request_table(test_id):
+    """
+    Returns the table to read and write a test's requests with. Queries
+    must still filter by test_id, as on PostgreSQL this is the
+    partitioned loadtest_requests table.
+
+    Arguments
+        * test_id - the ID of the test
+    """
+
+    if partitioned():
+        return Request.__table__
+
+    table = shard_table(test_id)
+    if table.name not in _created:
+        create_partition(test_id)
+    return table
+
+
+def request_tables(test_id=None):
+    """
+    Returns the tables holding the requests of every test, or of one
+    test, in order of their IDs. Unlike request_table() this never
+    creates a shard.
+
+    Arguments
+        * test_id - the ID of the test, if only its requests are wanted
+    """
+
+    if partitioned():
+        return [Request.__table__]
+
+    existing = set(inspect_db(db.session.connection()).get_table_names())
+    if test_id is not None:
+        test_ids = [int(test_id)]
+    else:
+        test_ids = [row[0] for row in db.session.execute(
+            select([Test.__table__.c.id]).order_by(Test.__table__.c.id)
+        )]
+    return [shard_table(test_id) for test_id in test_ids
+            if partition_name(test_id) in existing]
+
+
+def load_request(request_id, test_id=None):
+    """
+    Loads a request by ID as a detached Request, or returns None
+    if there is no such request
+
+    Arguments
+        * request_id - the ID of the request
+        * test_id - the ID of its test, if known
+    """
+
+    request_id = int(request_id)
+    if partitioned():
+        table = Request.__table__
+        condition = table.c.id == request_id
+        if test_id is not None:
+            condition &= table.c.test_id == test_id
+    else:
+        if test_id is None:
+            test_id = request_id >> ID_BITS
+        if partition_name(test_id) not in _created and \
+                not shard_table(test_id).exists(
+                    bind=db.session.connection()):
+            return None
+        table = request_table(test_id)
+        condition = table.c.id == request_id
+
+    row = db.session.execute(select([table]).where(condition)).fetchone()
+    if row is None:
+        return None
+    return Request(**dict(row))
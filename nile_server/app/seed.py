@@ -0,0 +1,73 @@
+"""
+Seed Data
+
+Fills a database with generated tests, used by manage.py seed and
+the benchmarks.
+"""
+
+import datetime
+import random
+
+from app import db
+from app.models import Test, Request
+from app.partitions import create_partition, request_table
+from app.summaries import create_summary, refresh_summary
+
+# Rows per INSERT when seeding
+SEED_CHUNK = 10000
+
+
+def seed_test(num_requests, partition=True):
+    """
+    Adds a finalized test with num_requests requests spaced a millisecond
+    apart, and returns its ID
+
+    Arguments
+        * num_requests - number of requests to insert
+        * partition - if False, the requests are inserted straight into
+            loadtest_requests, as in databases not yet migrated to
+            partitioned requests, and the summary is not refreshed
+    """
+
+    start = datetime.datetime.now()
+    new_test = Test(
+        config=f"Seed {Test.query.count()}",
+        locustfile="locustfile.py",
+        start=start,
+        end=start + datetime.timedelta(milliseconds=num_requests),
+        workers=5000
+    )
+    db.session.add(new_test)
+    db.session.flush()
+    create_summary(new_test.id)
+    if partition:
+        create_partition(new_test.id)
+    db.session.commit()
+    test_id = new_test.id
+
+    reqs = [{
+        'test_id': test_id,
+        'name': f"Seed {req_count % 100}",
+        'request_timestamp': start + datetime.timedelta(
+            milliseconds=req_count
+        ),
+        'request_method': "Request Method",
+        'request_length': 250,
+        'response_length': 250,
+        'response_time': random.normalvariate(240, 1),
+        'status_code': '200',
+        'success': True,
+        'exception': None,
+        'sampled': False
+    } for req_count in range(num_requests)]
+
+    table = request_table(test_id) if partition else Request.__table__
+    for chunk in range(0, len(reqs), SEED_CHUNK):
+        db.session.execute(
+            table.insert(), reqs[chunk:chunk + SEED_CHUNK]
+        )
+    db.session.commit()
+    if partition:
+        refresh_summary(test_id)
+
+    return test_id
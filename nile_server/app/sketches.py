@@ -0,0 +1,353 @@
+"""
+Response Time Sketches
+
+Mergeable quantile sketches of request response times, used to read
+live percentiles of a running test without scanning its requests.
+
+Each server process keeps the sketches of the requests it ingested since
+its last checkpoint in memory, per test and per endpoint name. These are
+periodically merged into the process' checkpoint row in the database.
+Reading a sketch merges the checkpoints of every process with the local
+sketch, and sketches of several tests can be merged the same way.
+"""
+
+import json
+import math
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+from app import app, db
+from app.models import RequestSketch, Test
+
+# Sketch name holding all of a test's requests
+ALL = ''
+
+# Seconds between checkpoints of the in-memory sketches
+CHECKPOINT_INTERVAL = 5
+
+# Default relative accuracy of quantile estimates
+RELATIVE_ACCURACY = 0.01
+
+# Values at or below this are counted in the zero bucket
+MIN_VALUE = 1e-9
+
+
+class LatencySketch:
+    """
+    A DDSketch: values are counted in logarithmically sized buckets, so
+    every quantile estimate is within a fixed relative error of the true
+    value, and two sketches with the same accuracy merge exactly by
+    adding their bucket counts.
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        """
+        Creates an empty LatencySketch
+
+        Arguments
+            * relative_accuracy - the maximum relative error of
+                quantile estimates
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value, count=1):
+        """ Adds a value to the sketch count times """
+
+        if value <= MIN_VALUE:
+            self.zero_count += count
+        else:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + count
+
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """ Adds the counts of another sketch with the same accuracy """
+
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can only merge sketches with the same accuracy")
+
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None
+                                      or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None
+                                      or other.max > self.max):
+            self.max = other.max
+
+        return self
+
+    def quantile(self, fraction):
+        """
+        Estimates the value at a quantile of the sketch, or None if the
+        sketch is empty
+
+        Arguments
+            * fraction - the quantile as a fraction between 0 and 1
+        """
+
+        if self.count == 0:
+            return None
+
+        rank = fraction * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return self.min
+
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+
+        return self.max
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'bins': {str(key): count for key, count in self.bins.items()},
+            'zero_count': self.zero_count,
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative_accuracy'])
+        sketch.bins = {int(key): count for key, count in data['bins'].items()}
+        sketch.zero_count = data['zero_count']
+        sketch.count = data['count']
+        sketch.total = data['total']
+        sketch.min = data['min']
+        sketch.max = data['max']
+        return sketch
+
+    def dumps(self):
+        return json.dumps(self.to_dict(), separators=(',', ':'))
+
+    @classmethod
+    def loads(cls, text):
+        return cls.from_dict(json.loads(text))
+
+
+class SketchStore:
+    """
+    Holds the sketches of requests ingested by this process since
+    its last checkpoint, keyed by (test_id, name)
+    """
+
+    def __init__(self):
+        self.source = f'{socket.gethostname()}:{os.getpid()}'
+        self.pending = {}
+        self.lock = threading.Lock()
+        # Held across a checkpoint's read, merge and write of the saved
+        # rows, so concurrent checkpoints do not overwrite each other
+        self.checkpoint_lock = threading.Lock()
+        self.last_checkpoint = time.monotonic()
+
+    def record(self, test_id, rows):
+        """
+        Adds ingested request rows to the in-memory sketches and
+        checkpoints them if the checkpoint interval has passed
+
+        Arguments
+            * test_id - the ID of the test the requests belong to
+            * rows - the ingested rows
+        """
+
+        with self.lock:
+            total = self._pending(test_id, ALL)
+            for row in rows:
+                total.add(row['response_time'])
+                self._pending(test_id, row['name']).add(row['response_time'])
+
+        if time.monotonic() - self.last_checkpoint >= CHECKPOINT_INTERVAL:
+            try:
+                self.checkpoint()
+            except Exception:
+                app.logger.exception("Failed to checkpoint sketches")
+
+    def record_sketch(self, test_id, name, sketch):
+        """
+        Merges a sketch built elsewhere, such as by a slave aggregating
+        its requests, into the in-memory sketches of a test
+
+        Arguments
+            * test_id - the ID of the test the requests belong to
+            * name - the endpoint name of the requests
+            * sketch - the LatencySketch of the requests
+        """
+
+        with self.lock:
+            self._pending(test_id, ALL).merge(sketch)
+            self._pending(test_id, name).merge(sketch)
+
+    def _pending(self, test_id, name):
+        key = (test_id, name)
+        if key not in self.pending:
+            self.pending[key] = LatencySketch()
+        return self.pending[key]
+
+    def checkpoint(self, test_id=None):
+        """
+        Merges the in-memory sketches into this process' checkpoint
+        rows and clears them.
+
+        Arguments
+            * test_id - only checkpoint the sketches of this test
+        """
+
+        with self.checkpoint_lock:
+            self._checkpoint(test_id)
+
+    def _checkpoint(self, test_id):
+        with self.lock:
+            keys = [key for key in self.pending
+                    if test_id is None or key[0] == test_id]
+            pending = {key: self.pending.pop(key) for key in keys}
+            self.last_checkpoint = time.monotonic()
+
+        if not pending:
+            return
+
+        try:
+            # Tests deleted by another process since their requests were
+            # ingested here are dropped, their rows would fail the commit
+            test_ids = {sketch_test for sketch_test, name in pending}
+            existing = {row[0] for row in db.session.query(Test.id).filter(
+                Test.id.in_(test_ids)
+            )}
+            pending = {key: sketch for key, sketch in pending.items()
+                       if key[0] in existing}
+
+            for (sketch_test, name), sketch in pending.items():
+                row = RequestSketch.query.get(
+                    (sketch_test, name, self.source)
+                )
+                saved = LatencySketch().merge(sketch)
+                if row is None:
+                    row = RequestSketch(
+                        test_id=sketch_test,
+                        name=name,
+                        source=self.source
+                    )
+                    db.session.add(row)
+                else:
+                    saved.merge(LatencySketch.loads(row.sketch))
+                row.sketch = saved.dumps()
+                row.updated = datetime.now()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Keep the sketches so they are saved by the next checkpoint
+            with self.lock:
+                for (sketch_test, name), sketch in pending.items():
+                    self._pending(sketch_test, name).merge(sketch)
+            raise
+
+    def start_checkpoints(self, app, interval=CHECKPOINT_INTERVAL):
+        """
+        Checkpoints the in-memory sketches every interval from a
+        background thread, so other server processes read them even
+        when this process ingests nothing more
+
+        Arguments
+            * app - the Flask app, whose context the thread runs in
+            * interval - the seconds between checkpoints
+        """
+
+        def run():
+            while True:
+                time.sleep(interval)
+                with app.app_context():
+                    try:
+                        self.checkpoint()
+                    except Exception:
+                        app.logger.exception("Failed to checkpoint sketches")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def read(self, test_ids, name=ALL):
+        """
+        Returns the merged sketch of the requests with the given name
+        across one or more tests and every server process
+
+        Arguments
+            * test_ids - the IDs of the tests to merge
+            * name - the endpoint name, or ALL for every request
+        """
+
+        merged = LatencySketch()
+        rows = RequestSketch.query.filter(
+            RequestSketch.test_id.in_(test_ids),
+            RequestSketch.name == name
+        ).all()
+        for row in rows:
+            merged.merge(LatencySketch.loads(row.sketch))
+
+        with self.lock:
+            for test_id in test_ids:
+                local = self.pending.get((test_id, name))
+                if local is not None:
+                    merged.merge(local)
+
+        return merged
+
+    def names(self, test_id):
+        """ Returns the endpoint names with sketches for a test """
+
+        rows = db.session.query(RequestSketch.name).filter(
+            RequestSketch.test_id == test_id
+        ).distinct().all()
+        names = {row[0] for row in rows}
+
+        with self.lock:
+            names.update(
+                name for key_test, name in self.pending if key_test == test_id
+            )
+
+        names.discard(ALL)
+        return sorted(names)
+
+    def delete(self, test_id):
+        """ Drops the in-memory sketches of a test, not committing """
+
+        with self.lock:
+            for key in [key for key in self.pending if key[0] == test_id]:
+                del self.pending[key]
+
+        RequestSketch.query.filter(RequestSketch.test_id == test_id).delete()
+
+
+# The sketches of this server process
+sketches = SketchStore()
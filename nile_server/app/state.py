@@ -0,0 +1,93 @@
+"""
+Test State
+
+Finds the running test, and the test that late data belongs to, from
+the database rather than from variables of the server process, so that
+every process of a multi-process server agrees on them.
+
+The running test is the one without an end time, of which there is at
+most one (see uq_loadtest_tests_running). The previous test is the most
+recently finalized test that is not being deleted.
+
+Ingestion only needs their IDs and times, so assign_test() reads them
+with Core queries and no Test objects are loaded for each batch.
+"""
+
+from sqlalchemy import and_, exists, select
+
+from app import db
+from app.jobs import DELETE_TEST, PENDING, RUNNING
+from app.models import Job, Test
+
+
+def running_test():
+    """ Returns the running test, or None if no test is running """
+
+    return Test.query.filter(Test.end.is_(None)).first()
+
+
+def running_test_id():
+    """ Returns the ID of the running test, or None if no test is running """
+
+    table = Test.__table__
+    return db.session.execute(
+        select([table.c.id]).where(table.c.end.is_(None))
+    ).scalar()
+
+
+def _previous_test_times():
+    """ Returns the (id, start, end) of the previous test, or None """
+
+    table = Test.__table__
+    row = db.session.execute(
+        select([table.c.id, table.c.start, table.c.end]).where(
+            table.c.end.isnot(None)
+        ).order_by(table.c.id.desc()).limit(1)
+    ).fetchone()
+
+    if row is None or is_deleting(row.id):
+        return None
+    return row
+
+
+def previous_test():
+    """
+    Returns the most recently finalized test, or None if there is none
+    or it is being deleted
+    """
+
+    row = _previous_test_times()
+    return None if row is None else Test.query.get(row.id)
+
+
+def is_deleting(test_id):
+    """ Whether a job deleting a test is waiting or running """
+
+    return db.session.query(exists().where(and_(
+        Job.kind == DELETE_TEST,
+        Job.test_id == test_id,
+        Job.status.in_((PENDING, RUNNING))
+    ))).scalar()
+
+
+def assign_test(time_sent):
+    """
+    Finds the test that data sent at a given time belongs to: the
+    running test, or the previous test if the data was made before
+    it finished. Returns the test ID (None if there is no such test)
+    and whether that test has already been finalized.
+
+    Arguments
+        * time_sent - the timestamp of the first record in the batch
+    """
+
+    previous = _previous_test_times()
+    if (previous and time_sent <= previous.end
+            and time_sent >= previous.start):
+        return previous.id, True
+
+    running = running_test_id()
+    if running is not None:
+        return running, False
+
+    return None, False
@@ -0,0 +1,102 @@
+"""
+Response Streaming
+
+Helpers for reading large result sets in fixed-size chunks through a
+server-side cursor, and for encoding those chunks as they are sent to
+the client, so memory use stays flat regardless of the size of a test.
+"""
+
+import calendar
+import json
+import struct
+import sys
+from array import array
+
+from app import db
+
+# Number of rows fetched from the cursor at a time
+CHUNK_SIZE = 10000
+
+
+def stream_rows(statement, params=None, chunk_size=CHUNK_SIZE):
+    """
+    Executes a statement on its own connection with a server-side
+    cursor and returns a generator of lists of at most chunk_size rows.
+    The connection is released once the generator is exhausted or closed.
+
+    Arguments
+        * statement - the SQL statement to execute
+        * params - a dictionary of bound parameters for the statement
+        * chunk_size - the maximum number of rows per chunk
+    """
+
+    # Resolve the engine now, the generator may run outside the app context
+    engine = db.engine
+
+    def generate():
+        connection = engine.connect()
+        try:
+            result = connection.execution_options(
+                stream_results=True
+            ).execute(statement, params or {})
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            connection.close()
+
+    return generate()
+
+
+def epoch_millis(timestamp):
+    """
+    Converts a naive datetime into integer milliseconds since the epoch.
+    Timestamps are stored without a timezone, so they are treated as UTC
+    to keep the same wall clock time on the client.
+    """
+
+    return (calendar.timegm(timestamp.timetuple()) * 1000
+            + timestamp.microsecond // 1000)
+
+
+def json_array(key, chunks, default=None, first=False):
+    """
+    Generator encoding a single JSON object member whose value is an
+    array, one chunk of values at a time.
+
+    Arguments
+        * key - the member name
+        * chunks - an iterable of lists of values
+        * default - passed to json.dumps for unserializable values
+        * first - whether this is the first member of the object
+    """
+
+    yield ('' if first else ',') + json.dumps(key) + ':['
+    separator = ''
+    for values in chunks:
+        if values:
+            encoded = json.dumps(values, separators=(',', ':'),
+                                 default=default)
+            yield separator + encoded[1:-1]
+            separator = ','
+    yield ']'
+
+
+def binary_chunk(timestamps, response_times):
+    """
+    Packs one chunk of the compact binary encoding, which is little-endian:
+        * uint32 - the number of rows, n
+        * n x int64 - request timestamps in epoch milliseconds
+        * n x float32 - response times
+    """
+
+    millis = array('q', (epoch_millis(t) for t in timestamps))
+    times = array('f', response_times)
+    if sys.byteorder == 'big':
+        millis.byteswap()
+        times.byteswap()
+
+    return struct.pack('<I', len(millis)) + millis.tobytes() \
+        + times.tobytes()
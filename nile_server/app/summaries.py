@@ -0,0 +1,288 @@
+"""
+Test Summaries
+
+Maintains the TestSummary row of each test. While a test is running its
+counters are updated incrementally in the same transaction as the data
+being ingested. When a test is finalized, or data arrives for a test that
+already has been, the summary is recomputed from the stored requests.
+Until then, percentiles are estimated from the test's sketches.
+Rendering a summary is then a primary key lookup.
+"""
+
+import math
+from sqlalchemy import func, select
+
+from app import db
+from app.models import RequestWindow, SystemMetric, TestSummary
+from app.partitions import request_table
+from app.sketches import sketches
+
+# Percentile columns and their fraction of the response time distribution
+PERCENTILES = {
+    'median': 0.50,
+    'percentile_90': 0.90,
+    'percentile_95': 0.95,
+    'percentile_99': 0.99
+}
+
+
+def create_summary(test_id):
+    """
+    Adds an empty summary for a newly started test to the session
+
+    Arguments
+        * test_id - the ID of the new test
+    """
+
+    db.session.add(TestSummary(
+        test_id=test_id,
+        num_requests=0,
+        num_success=0,
+        num_metrics=0,
+        response_time_total=0,
+        stale=False
+    ))
+
+
+def record_requests(test_id, rows, ids, finalized=False):
+    """
+    Adds a batch of inserted requests to the summary counters. This does
+    not commit, so it is part of the transaction inserting the batch.
+
+    Arguments
+        * test_id - the ID of the test the requests belong to
+        * rows - the inserted rows
+        * ids - the IDs of the inserted rows, in the same order
+        * finalized - whether the test has already been finalized, in
+            which case its percentiles must be recomputed
+    """
+
+    table = TestSummary.__table__
+    longest = max(range(len(rows)), key=lambda i: rows[i]['response_time'])
+    longest_time = rows[longest]['response_time']
+
+    values = {
+        'num_requests': table.c.num_requests + len(rows),
+        'num_success': table.c.num_success + sum(
+            1 for row in rows if row['success']
+        ),
+        'response_time_total': table.c.response_time_total + sum(
+            row['response_time'] for row in rows
+        )
+    }
+    if finalized:
+        values['stale'] = True
+
+    db.session.execute(
+        table.update().where(table.c.test_id == test_id).values(values)
+    )
+    db.session.execute(
+        table.update().where(
+            (table.c.test_id == test_id)
+            & ((table.c.longest_response_time.is_(None))
+               | (table.c.longest_response_time < longest_time))
+        ).values(
+            longest_request_id=ids[longest],
+            longest_response_time=longest_time
+        )
+    )
+
+
+def record_windows(test_id, rows, finalized=False):
+    """
+    Adds a batch of inserted request windows to the summary counters
+    without committing. The longest request of a window is not stored
+    individually, so it has no request ID.
+
+    Arguments
+        * test_id - the ID of the test the windows belong to
+        * rows - the inserted rows
+        * finalized - whether the test has already been finalized
+    """
+
+    table = TestSummary.__table__
+    longest_time = max(row['max'] for row in rows)
+
+    values = {
+        'num_requests': table.c.num_requests + sum(
+            row['count'] for row in rows
+        ),
+        'num_success': table.c.num_success + sum(
+            row['count'] for row in rows if row['success']
+        ),
+        'response_time_total': table.c.response_time_total + sum(
+            row['total'] for row in rows
+        )
+    }
+    if finalized:
+        values['stale'] = True
+
+    db.session.execute(
+        table.update().where(table.c.test_id == test_id).values(values)
+    )
+    db.session.execute(
+        table.update().where(
+            (table.c.test_id == test_id)
+            & ((table.c.longest_response_time.is_(None))
+               | (table.c.longest_response_time < longest_time))
+        ).values(
+            longest_request_id=None,
+            longest_response_time=longest_time
+        )
+    )
+
+
+def record_metrics(test_id, count=1):
+    """
+    Adds inserted metrics to the summary counters without committing
+
+    Arguments
+        * test_id - the ID of the test the metrics belong to
+        * count - the number of metrics inserted
+    """
+
+    table = TestSummary.__table__
+    db.session.execute(
+        table.update().where(table.c.test_id == test_id).values(
+            num_metrics=table.c.num_metrics + count
+        )
+    )
+
+
+def percentile(test_id, fraction, count):
+    """
+    Finds a response time percentile of a test, using the same
+    definition as percentile_disc: the smallest response time
+    whose cumulative distribution is at least the given fraction
+
+    Arguments
+        * test_id - the ID of the test
+        * fraction - the percentile as a fraction between 0 and 1
+        * count - the number of requests in the test
+    """
+
+    table = request_table(test_id)
+    rank = max(math.ceil(fraction * count) - 1, 0)
+    return db.session.execute(
+        select([table.c.response_time]).where(
+            (table.c.test_id == test_id) & table.c.sampled.isnot(True)
+        ).order_by(table.c.response_time).offset(rank).limit(1)
+    ).scalar()
+
+
+def refresh_summary(test_id):
+    """
+    Recomputes and saves the whole summary of a test from its stored
+    requests and metrics. Returns the saved summary.
+
+    Arguments
+        * test_id - the ID of the test
+    """
+
+    requests = request_table(test_id)
+    windows = RequestWindow.__table__
+    metrics = SystemMetric.__table__
+
+    # Sampled requests are already counted by their window summary
+    counted = (requests.c.test_id == test_id) & requests.c.sampled.isnot(True)
+
+    num_requests, num_success, total = db.session.execute(
+        select([
+            func.count(),
+            func.count().filter(requests.c.success.is_(True)),
+            func.coalesce(func.sum(requests.c.response_time), 0)
+        ]).where(counted)
+    ).fetchone()
+
+    window_requests, window_success, window_total, window_max = \
+        db.session.execute(
+            select([
+                func.coalesce(func.sum(windows.c.count), 0),
+                func.coalesce(
+                    func.sum(windows.c.count).filter(
+                        windows.c.success.is_(True)
+                    ), 0
+                ),
+                func.coalesce(func.sum(windows.c.total), 0),
+                func.max(windows.c.max)
+            ]).where(windows.c.test_id == test_id)
+        ).fetchone()
+
+    num_metrics = db.session.execute(
+        select([func.count()]).where(metrics.c.test_id == test_id)
+    ).scalar()
+
+    summary = TestSummary(
+        test_id=test_id,
+        num_requests=num_requests + window_requests,
+        num_success=num_success + window_success,
+        num_metrics=num_metrics,
+        response_time_total=total + window_total,
+        longest_request_id=None,
+        longest_response_time=window_max,
+        stale=False
+    )
+
+    if num_requests > 0:
+        longest = db.session.execute(
+            select([requests.c.id, requests.c.response_time]).where(
+                counted
+            ).order_by(requests.c.response_time.desc()).limit(1)
+        ).fetchone()
+        if window_max is None or longest[1] >= window_max:
+            summary.longest_request_id = longest[0]
+            summary.longest_response_time = longest[1]
+
+    # Percentiles are exact unless some requests were only uploaded
+    # as window summaries, in which case the sketches are used
+    sketch = None
+    if window_requests > 0:
+        sketch = sketches.read([test_id])
+
+    for column, fraction in PERCENTILES.items():
+        value = None
+        if sketch is not None:
+            value = sketch.quantile(fraction)
+        elif num_requests > 0:
+            value = percentile(test_id, fraction, num_requests)
+        setattr(summary, column, value)
+
+    summary = db.session.merge(summary)
+    db.session.commit()
+    return summary
+
+
+def summary_percentiles(summary):
+    """
+    Returns the percentiles of a summary by column name. Percentiles are
+    only computed exactly once a test is finalized, until then they are
+    estimated from the test's live response time sketches.
+
+    Arguments
+        * summary - the TestSummary of the test
+    """
+
+    values = {column: getattr(summary, column) for column in PERCENTILES}
+
+    if summary.num_requests and None in values.values():
+        sketch = sketches.read([summary.test_id])
+        for column, fraction in PERCENTILES.items():
+            if values[column] is None:
+                values[column] = sketch.quantile(fraction)
+
+    return values
+
+
+def get_summary(test_id):
+    """
+    Returns the summary of a test, recomputing it first if it is missing
+    (tests created before summaries were kept) or stale
+
+    Arguments
+        * test_id - the ID of the test
+    """
+
+    summary = TestSummary.query.get(test_id)
+    if summary is None or summary.stale:
+        summary = refresh_summary(test_id)
+    return summary
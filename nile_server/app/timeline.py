@@ -0,0 +1,218 @@
+"""
+Test Timelines
+
+Builds the time series charted for a test on one grid of fixed-width
+buckets: latency statistics, throughput and error rate of its requests,
+and the mean of each selected system metric. Every series has a value
+(or None) for every bucket, so they can be overlaid without aligning
+them on the client.
+
+Rows are read in chunks and assigned to buckets with NumPy, counts and
+sums are accumulated with bincount, so no per-bucket queries are made.
+Latency statistics come from the requests, or from the window summaries
+for tests whose slaves aggregated their requests, see app.downsample.
+"""
+
+import numpy as np
+from sqlalchemy import and_, select
+
+from app.downsample import (aggregate, aggregate_windows, bucket_chunks,
+                            bucket_width, has_windows, time_range, to_millis,
+                            PERCENTILES)
+from app.models import RequestWindow, SystemMetric
+from app.partitions import request_table
+from app.streaming import stream_rows
+
+# The largest number of buckets a timeline may have
+MAX_BUCKETS = 10000
+
+LATENCY_STATS = ('count', 'min', 'max', 'mean') + tuple(PERCENTILES)
+
+
+class TimelineError(ValueError):
+    """ Raised when a timeline would have too many buckets """
+
+
+def timeline_range(test_id, windows=False):
+    """
+    Returns the (first, last) timestamps of a test's requests and
+    metrics in epoch milliseconds, or None if it has neither
+
+    Arguments
+        * test_id - the ID of the test
+        * windows - whether the requests were uploaded as windows
+    """
+
+    ranges = [
+        time_range(test_id, RequestWindow.window_start if windows else None),
+        time_range(test_id, SystemMetric.metric_timestamp)
+    ]
+    ranges = [bounds for bounds in ranges if bounds is not None]
+    if not ranges:
+        return None
+    return (int(min(bounds[0] for bounds in ranges)),
+            int(max(bounds[1] for bounds in ranges)))
+
+
+def _nullable(values, counts):
+    """ Converts an array to a list holding None for empty buckets """
+
+    return [value if count else None
+            for value, count in zip(values.tolist(), counts.tolist())]
+
+
+def _latency(test_id, start, width, length, windows):
+    """
+    Returns the latency statistics and request counts of every bucket,
+    placing the buckets aggregate() returns onto the grid
+    """
+
+    if windows:
+        series = aggregate_windows(test_id, start, width)
+    else:
+        series = aggregate(bucket_chunks(test_id, start, width),
+                           start, width)
+
+    index = (np.array(series['timestamps'], dtype=np.int64) - start) // width
+    counts = np.zeros(length, dtype=np.int64)
+    counts[index] = series['count']
+
+    output = {'count': counts.tolist()}
+    for stat in LATENCY_STATS[1:]:
+        values = np.zeros(length, dtype=np.float64)
+        values[index] = series[stat]
+        output[stat] = _nullable(values, counts)
+    return output, counts
+
+
+def _failures(test_id, start, width, length, windows):
+    """ Returns the number of failed requests in every bucket """
+
+    if windows:
+        table = RequestWindow.__table__
+        columns = [table.c.window_start, table.c.count]
+    else:
+        table = request_table(test_id)
+        columns = [table.c.request_timestamp]
+
+    statement = select(columns).where(
+        and_(table.c.test_id == test_id, table.c.success.is_(False))
+    )
+
+    failures = np.zeros(length, dtype=np.int64)
+    for rows in stream_rows(statement):
+        buckets = (to_millis([row[0] for row in rows]) - start) // width
+        weights = [row[1] for row in rows] if windows else None
+        failures += np.bincount(
+            buckets, weights=weights, minlength=length
+        ).astype(np.int64)
+    return failures
+
+
+def metric_series(test_id, start, width, length, metric_names=None,
+                  system_names=None):
+    """
+    Returns the mean of each system metric of a test in every bucket,
+    as {metric_name: {system_name: values}}
+
+    Arguments
+        * test_id - the ID of the test
+        * start - the start of the first bucket in epoch milliseconds
+        * width - the bucket width in milliseconds
+        * length - the number of buckets
+        * metric_names - the metrics to include, by default all
+        * system_names - the systems to include, by default all
+    """
+
+    table = SystemMetric.__table__
+    conditions = [table.c.test_id == test_id]
+    if metric_names:
+        conditions.append(table.c.metric_name.in_(metric_names))
+    if system_names:
+        conditions.append(table.c.system_name.in_(system_names))
+
+    statement = select([
+        table.c.metric_timestamp, table.c.metric_name,
+        table.c.system_name, table.c.metric_value
+    ]).where(and_(*conditions))
+
+    sums, counts = {}, {}
+    for rows in stream_rows(statement):
+        buckets = (to_millis([row[0] for row in rows]) - start) // width
+        values = np.array([row[3] for row in rows], dtype=np.float64)
+        keys, series = np.unique(
+            [f'{row[1]}\n{row[2] or ""}' for row in rows],
+            return_inverse=True
+        )
+
+        # One bincount over (series, bucket) pairs covers every series
+        flat = series * length + buckets
+        size = len(keys) * length
+        chunk_sums = np.bincount(flat, weights=values, minlength=size)
+        chunk_counts = np.bincount(flat, minlength=size)
+        for i, key in enumerate(keys.tolist()):
+            if key not in sums:
+                sums[key] = np.zeros(length, dtype=np.float64)
+                counts[key] = np.zeros(length, dtype=np.int64)
+            sums[key] += chunk_sums[i * length:(i + 1) * length]
+            counts[key] += chunk_counts[i * length:(i + 1) * length]
+
+    output = {}
+    for key in sorted(sums):
+        metric_name, system_name = key.split('\n', 1)
+        means = sums[key] / np.maximum(counts[key], 1)
+        output.setdefault(metric_name, {})[system_name] = \
+            _nullable(means, counts[key])
+    return output
+
+
+def timeline(test_id, width=None, points=1000, metric_names=None,
+             system_names=None):
+    """
+    Returns the aligned time series of a test: the bucket start times,
+    latency statistics, throughput in requests per second, error rate,
+    and system metric means of every bucket
+
+    Arguments
+        * test_id - the ID of the test
+        * width - the bucket width in milliseconds, if not given
+            it is chosen so there are at most points buckets
+        * points - the target number of buckets
+        * metric_names - the metrics to include, by default all
+        * system_names - the systems to include, by default all
+    """
+
+    windows = has_windows(test_id)
+    source = 'windows' if windows else 'requests'
+
+    bounds = timeline_range(test_id, windows)
+    if bounds is None:
+        return {'start': None, 'width': width, 'source': source,
+                'timestamps': [],
+                'latency': {stat: [] for stat in LATENCY_STATS},
+                'throughput': [], 'error_rate': [], 'metrics': {}}
+
+    start, end = bounds
+    if width is None:
+        width = bucket_width(start, end, points)
+    length = (end - start) // width + 1
+    if length > MAX_BUCKETS:
+        raise TimelineError(
+            f"width {width} gives {length} buckets, "
+            f"at most {MAX_BUCKETS} are allowed"
+        )
+
+    latency, counts = _latency(test_id, start, width, length, windows)
+    failures = _failures(test_id, start, width, length, windows)
+
+    return {
+        'start': start,
+        'width': width,
+        'source': source,
+        'timestamps': (start + np.arange(length) * width).tolist(),
+        'latency': latency,
+        'throughput': (counts * 1000.0 / width).tolist(),
+        'error_rate': _nullable(failures / np.maximum(counts, 1), counts),
+        'metrics': metric_series(test_id, start, width, length,
+                                 metric_names, system_names)
+    }
@@ -0,0 +1,197 @@
+"""
+Request Batch Wire Format
+
+Decodes the compact msgpack encoding of request batches that DataBuffer
+uploads when the server supports it, as an alternative to a JSON list
+of request records. Batches of system metrics uploaded by MetricBuffer
+use the same encoding with their own columns.
+
+A batch is a map of columns. Timestamps are integer microseconds since
+1970-01-01, naive like the stored timestamps. The name, request_method,
+status_code and exception columns are dictionary-encoded, holding the
+distinct values of the batch and the index of each request's value,
+with -1 for None. The body may be gzip compressed.
+"""
+
+import gzip
+import zlib
+from datetime import datetime, timedelta
+
+import msgpack
+
+from app.ingest import BatchError, parse_bool
+
+CONTENT_TYPE = 'application/x-msgpack'
+VERSION = 1
+
+EPOCH = datetime(1970, 1, 1)
+
+# Columns holding indexes into a list of distinct values
+DICTIONARY_COLUMNS = ('name', 'request_method', 'status_code', 'exception')
+
+# Columns holding one value per request, how they are converted,
+# and whether they may hold None
+VALUE_COLUMNS = {
+    'request_length': (int, True),
+    'response_length': (int, True),
+    'response_time': (float, False),
+    'success': (parse_bool, False)
+}
+
+# Optional boolean columns and their value when missing
+OPTIONAL_COLUMNS = {'sampled': False}
+
+# Dictionary-encoded columns of a batch of system metrics
+METRIC_DICTIONARY_COLUMNS = ('system_name', 'metric_name')
+
+
+def _dictionary_decode(column, count):
+    """ Expands a dictionary-encoded column into its values """
+
+    values, indexes = column['values'], column['indexes']
+    if len(indexes) != count:
+        raise ValueError("column length does not match count")
+
+    if min(indexes, default=0) < -1:
+        raise ValueError("invalid dictionary index")
+
+    values = [str(value) for value in values]
+    return [None if index == -1 else values[index] for index in indexes]
+
+
+def _value_decode(convert, column, count, nullable):
+    """ Converts a column of values, keeping None if nullable """
+
+    if len(column) != count:
+        raise ValueError("column length does not match count")
+
+    if nullable:
+        return [None if value is None else convert(value) for value in column]
+    return [convert(value) for value in column]
+
+
+def _timestamp_decode(column, count):
+    """ Converts a column of epoch microseconds into datetimes """
+
+    if len(column) != count:
+        raise ValueError("column length does not match count")
+
+    return [EPOCH + timedelta(microseconds=micros) for micros in column]
+
+
+def _unpack(data, content_encoding, kind):
+    """ Decodes an encoded batch into its map of columns """
+
+    try:
+        if content_encoding == 'gzip':
+            data = gzip.decompress(data)
+        elif content_encoding not in (None, '', 'identity'):
+            raise BatchError(f"Unsupported encoding {content_encoding}")
+        batch = msgpack.unpackb(data, raw=False)
+    except (OSError, EOFError, zlib.error, ValueError,
+            msgpack.UnpackException) as e:
+        raise BatchError(f"Could not decode batch: {e}")
+
+    if not isinstance(batch, dict) or batch.get('version') != VERSION:
+        raise BatchError(f"Expected a version {VERSION} batch of {kind}.")
+    return batch
+
+
+def _rows(columns):
+    """ Transposes a map of columns into a list of rows """
+
+    names = list(columns)
+    return [
+        dict(zip(names, values)) for values in zip(*columns.values())
+    ]
+
+
+def parse_batch(data, content_encoding=None):
+    """
+    Decodes and validates an encoded batch of requests into rows ready
+    to be inserted, in the same form as parse_requests(). Raises
+    BatchError if the batch is invalid, in which case nothing should
+    be saved.
+
+    Arguments
+        * data - the request body
+        * content_encoding - the Content-Encoding of the body, if any
+    """
+
+    batch = _unpack(data, content_encoding, 'requests')
+
+    try:
+        count = int(batch['count'])
+        columns = {
+            column: _dictionary_decode(batch[column], count)
+            for column in DICTIONARY_COLUMNS
+        }
+        for column, (convert, nullable) in VALUE_COLUMNS.items():
+            columns[column] = _value_decode(
+                convert, batch[column], count, nullable
+            )
+        for column, default in OPTIONAL_COLUMNS.items():
+            # Clients send None for requests without the value
+            values = batch.get(column) or [default] * count
+            columns[column] = _value_decode(
+                parse_bool,
+                [default if value is None else value for value in values],
+                count, False
+            )
+
+        columns['request_timestamp'] = _timestamp_decode(
+            batch['request_timestamp'], count
+        )
+    except KeyError as e:
+        raise BatchError(f"Batch is missing column {e}")
+    except (TypeError, ValueError, IndexError, OverflowError) as e:
+        raise BatchError(f"Batch is invalid: {e}")
+
+    for index in range(count):
+        if columns['name'][index] is None \
+                or columns['request_method'][index] is None:
+            raise BatchError(f"Request {index} is missing its name or method")
+
+    return _rows(columns)
+
+
+def parse_metric_batch(data, content_encoding=None):
+    """
+    Decodes and validates an encoded batch of system metrics into rows
+    ready to be inserted, in the same form as parse_metrics(). The
+    system_name and metric_name columns are dictionary-encoded, and
+    metric_timestamp holds epoch microseconds. Raises BatchError if
+    the batch is invalid, in which case nothing should be saved.
+
+    Arguments
+        * data - the request body
+        * content_encoding - the Content-Encoding of the body, if any
+    """
+
+    batch = _unpack(data, content_encoding, 'metrics')
+
+    try:
+        count = int(batch['count'])
+        columns = {
+            column: _dictionary_decode(batch[column], count)
+            for column in METRIC_DICTIONARY_COLUMNS
+        }
+        columns['metric_timestamp'] = _timestamp_decode(
+            batch['metric_timestamp'], count
+        )
+        columns['metric_value'] = _value_decode(
+            float, batch['metric_value'], count, False
+        )
+    except KeyError as e:
+        raise BatchError(f"Batch is missing column {e}")
+    except (TypeError, ValueError, IndexError, OverflowError) as e:
+        raise BatchError(f"Batch is invalid: {e}")
+
+    for index in range(count):
+        if columns['system_name'][index] is None \
+                or columns['metric_name'][index] is None:
+            raise BatchError(
+                f"Metric {index} is missing its system or metric name"
+            )
+
+    return _rows(columns)
@@ -0,0 +1,193 @@
+"""
+Ingestion CPU Profile
+
+Measures the CPU time spent per ingested row by the server process when
+requests and system metrics are saved through the ORM unit of work, with
+and without Flask-SQLAlchemy's modification tracking, and through the
+Core ingestion path (app/ingest.py) used by the endpoints. Only the time
+of this process is counted, not the database's. With --profile the
+functions taking the most time on each path are printed as well.
+
+The results are written up in benchmarks/ingest_profile.md. By default
+this runs against a local SQLite database (config.BenchmarkConfig).
+Set NILE_BENCHMARK_URI to point it at a Postgres database instead.
+
+    python benchmarks/ingest_profile.py --rows 20000
+"""
+
+import argparse
+import cProfile
+import datetime
+import os
+import pstats
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('APP_CONFIG_ENV', 'config.BenchmarkConfig')
+
+from app import app, db  # noqa: E402
+from app.ingest import (insert_metrics, insert_requests, parse_metrics,  # noqa: E402
+                        parse_requests)
+from app.models import Request, SystemMetric, Test  # noqa: E402
+from app.partitions import drop_partition, create_partition  # noqa: E402
+from app.summaries import create_summary  # noqa: E402
+
+db.create_all()
+
+BATCH = 1000
+
+
+def request_records(count):
+    """ Creates request records shaped like DataBuffer uploads """
+
+    now = datetime.datetime.now()
+    return [{
+        'name': f'/endpoint/{i % 10}',
+        'request_timestamp': (
+            now + datetime.timedelta(microseconds=i)
+        ).isoformat(),
+        'request_method': 'GET',
+        'request_length': 250,
+        'response_length': 250,
+        'response_time': random.normalvariate(240, 10),
+        'status_code': '200',
+        'success': True,
+        'exception': None
+    } for i in range(count)]
+
+
+def metric_records(count):
+    """ Creates system metric records shaped like MetricBuffer uploads """
+
+    now = datetime.datetime.now()
+    return [{
+        'system_name': 'slave-1',
+        'metric_name': ('cpu_percent', 'memory_used_percent')[i % 2],
+        'metric_timestamp': (
+            now + datetime.timedelta(microseconds=i)
+        ).isoformat(),
+        'metric_value': random.uniform(0, 100)
+    } for i in range(count)]
+
+
+def batches(rows):
+    for start in range(0, len(rows), BATCH):
+        yield rows[start:start + BATCH]
+
+
+def orm_requests(rows, test_id):
+    """ Saves requests as Request objects, one flush per batch """
+
+    # The ORM cannot read back IDs of the composite key, give them
+    next_id = (test_id << 32) + 1
+    for batch in batches(rows):
+        objects = []
+        for row in batch:
+            objects.append(Request(id=next_id, test_id=test_id, **row))
+            next_id += 1
+        db.session.add_all(objects)
+        db.session.commit()
+
+
+def core_requests(rows, test_id):
+    """ Saves requests through the Core ingestion path """
+
+    for batch in batches(rows):
+        insert_requests([dict(row) for row in batch], test_id)
+
+
+def orm_metrics(rows, test_id):
+    """ Saves metrics as SystemMetric objects, one flush per batch """
+
+    for batch in batches(rows):
+        db.session.add_all(
+            SystemMetric(test_id=test_id, **row) for row in batch
+        )
+        db.session.commit()
+
+
+def core_metrics(rows, test_id):
+    """ Saves metrics through the Core ingestion path """
+
+    for batch in batches(rows):
+        insert_metrics(batch, test_id)
+
+
+def start_test():
+    test = Test(config='Ingest profile', locustfile='ingest_profile.py',
+                start=datetime.datetime.now(), workers=0)
+    db.session.add(test)
+    db.session.flush()
+    create_summary(test.id)
+    create_partition(test.id)
+    db.session.commit()
+    return test.id
+
+
+def end_test(test_id):
+    db.session.execute(Request.__table__.delete().where(
+        Request.__table__.c.test_id == test_id
+    ))
+    drop_partition(test_id)
+    Test.query.filter(Test.id == test_id).delete()
+    db.session.commit()
+
+
+def measure(name, save, rows, track, profile):
+    """
+    Returns the CPU microseconds per row taken by save, running in a
+    fresh session with modification tracking on or off
+    """
+
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = track
+    db.session.remove()
+    test_id = start_test()
+    profiler = cProfile.Profile() if profile else None
+    try:
+        began = time.process_time()
+        if profiler:
+            profiler.enable()
+        save(rows, test_id)
+        if profiler:
+            profiler.disable()
+        elapsed = time.process_time() - began
+    finally:
+        db.session.remove()
+        end_test(test_id)
+
+    if profiler:
+        print(f'\n{name}')
+        pstats.Stats(profiler).sort_stats('tottime').print_stats(10)
+    return elapsed / len(rows) * 1e6
+
+
+def run(count, profile):
+    requests = parse_requests(request_records(count))
+    metrics = parse_metrics(metric_records(count))
+
+    paths = [
+        ('Requests, ORM, tracked', orm_requests, requests, True),
+        ('Requests, ORM, untracked', orm_requests, requests, False),
+        ('Requests, Core', core_requests, requests, False),
+        ('Metrics, ORM, tracked', orm_metrics, metrics, True),
+        ('Metrics, ORM, untracked', orm_metrics, metrics, False),
+        ('Metrics, Core', core_metrics, metrics, False)
+    ]
+    results = [(name, measure(name, save, rows, track, profile))
+               for name, save, rows, track in paths]
+
+    print(f'Database: {app.config["SQLALCHEMY_DATABASE_URI"]}')
+    print(f'{count} rows in batches of {BATCH}, CPU time of this process')
+    for name, per_row in results:
+        print(f'{name:26s} {per_row:8.1f} us/row')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--profile', action='store_true',
+                        help='print the top functions of each path')
+    args = parser.parse_args()
+    run(args.rows, args.profile)
@@ -0,0 +1,96 @@
+"""
+Wire Format Benchmark
+
+Compares the JSON request batches with the msgpack batches of app/wire.py
+at several batch sizes. Reports the CPU time DataBuffer spends encoding a
+batch, the time the server spends decoding and validating it into rows,
+and the bytes sent over the wire.
+
+    python benchmarks/wire_benchmark.py --sizes 1000 10000 100000
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, '..', 'nile_lib'))
+os.environ.setdefault('APP_CONFIG_ENV', 'config.BenchmarkConfig')
+
+from app.ingest import parse_requests  # noqa: E402
+from app.wire import parse_batch  # noqa: E402
+from nile_test.integration.wire import encode_batch  # noqa: E402
+
+
+def make_records(size):
+    """ Creates records shaped like those buffered by DataBuffer """
+
+    now = datetime.datetime.now()
+    return [{
+        'request_method': 'GET' if i % 4 else 'POST',
+        'name': f'/endpoint/{i % 20}',
+        'response_time': 12.5 + i % 100,
+        'response_length': 512,
+        'success': i % 50 != 0,
+        'exception': None if i % 50 else 'ConnectionError(timed out)',
+        'request_timestamp': (
+            now + datetime.timedelta(microseconds=i)
+        ).isoformat(),
+        'request_length': 128,
+        'status_code': 200 if i % 50 else 500
+    } for i in range(size)]
+
+
+def timed(function, repeat):
+    """ Returns the result of function and its best time in milliseconds """
+
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        result = function()
+        elapsed = (time.process_time() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    formats = {
+        'json': (
+            lambda records: json.dumps(records).encode(),
+            lambda data: parse_requests(json.loads(data))
+        ),
+        'msgpack': (
+            lambda records: encode_batch(records)[0],
+            lambda data: parse_batch(data)
+        ),
+        'msgpack+gzip': (
+            lambda records: encode_batch(records, compress=True)[0],
+            lambda data: parse_batch(data, 'gzip')
+        )
+    }
+
+    print(f'{"records":>8} {"format":<13} {"encode ms":>10} '
+          f'{"decode ms":>10} {"bytes":>12} {"bytes/rec":>10}')
+    for size in args.sizes:
+        records = make_records(size)
+        for name, (encode, decode) in formats.items():
+            data, encode_ms = timed(lambda: encode(records), args.repeat)
+            rows, decode_ms = timed(lambda: decode(data), args.repeat)
+            assert len(rows) == size
+            print(f'{size:>8} {name:<13} {encode_ms:>10.1f} '
+                  f'{decode_ms:>10.1f} {len(data):>12,} '
+                  f'{len(data) / size:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Gunicorn configuration for serving the Nile server in production
+
+    APP_CONFIG_ENV=config.ProductionConfig gunicorn -c gunicorn.conf.py webservice:app
+
+Requests are served by pre-forked worker processes using gevent, so each
+process handles many slaves' uploads at once. The running test is kept
+in the database (see app/state.py), so every process agrees on it.
+Settings can be overridden with environment variables:
+
+    * NILE_BIND - the address to listen on (default 0.0.0.0:5000)
+    * NILE_WORKERS - the number of worker processes
+        (default twice the number of CPUs plus one)
+    * NILE_WORKER_CLASS - the gunicorn worker class (default gevent)
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('NILE_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get(
+    'NILE_WORKERS', multiprocessing.cpu_count() * 2 + 1
+))
+worker_class = os.environ.get('NILE_WORKER_CLASS', 'gevent')
+worker_connections = 1000
+
+# Slaves upload over keep-alive sessions
+keepalive = 30
+
+# Every worker imports the app itself, so no database connections
+# are shared between processes
+preload_app = False
+
+
+def post_fork(server, worker):
+    """ Lets psycopg2 yield to other greenlets while waiting on Postgres """
+    if worker_class != 'gevent':
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        server.log.warning('psycogreen is not installed, database '
+                           'queries will block gevent workers')
+        return
+    patch_psycopg()
+
+
+def post_worker_init(worker):
+    """ Saves this worker's response time sketches periodically """
+    from app import app
+    from app.sketches import sketches
+    sketches.start_checkpoints(app)
+
+
+def worker_exit(server, worker):
+    """ Saves the sketches this worker has not checkpointed yet """
+    from app import app
+    from app.sketches import sketches
+    with app.app_context():
+        try:
+            sketches.checkpoint()
+        except Exception as e:
+            server.log.warning(f'Failed to checkpoint sketches: {e}')
@@ -1,9 +1,11 @@
 from flask import Flask
 from flask_script import Manager
-from flask_migrate import Migrate, MigrateCommand
+from flask_migrate import MigrateCommand
 from config import Config
 from app import app, db
 from app.models import Test, Request, SystemMetric
+from app.seed import seed_test
+from app.export import ExportError, export_test
 
 import os
 import datetime
@@ -13,8 +15,10 @@ import random
 # App config setup
 app.config.from_object(os.environ['APP_CONFIG_ENV'])
 
-# Flask migration setup
-migrate = Migrate(app, db)
+# Configs whose database may be filled with seed data
+SEEDABLE_CONFIGS = ('config.TestConfig', 'config.BenchmarkConfig')
+
+# Flask migration setup, Migrate is set up along with the app
 manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
@@ -81,63 +85,45 @@ def seed(num_tests=10, reqs_per_test=100):
         * reqs_per_test - number of requests to insert per test
     """
 
-    if os.environ['APP_CONFIG_ENV'] != 'config.TestConfig':
+    if os.environ['APP_CONFIG_ENV'] not in SEEDABLE_CONFIGS:
         print(
-            'You can only seed the test database.',
+            'You can only seed the test or benchmark database.',
             'Set APP_CONFIG_ENV environment variable to config.TestConfig',
             'and try again.'
         )
         return
 
-    test_count = 0
-    req_count = 0
-
-    while test_count < int(num_tests):
+    for test_count in range(int(num_tests)):
         print(f'Adding test {test_count + 1} with {reqs_per_test} requests')
-        new_test = Test(
-            config=f"Seed {Test.query.count()}",
-            locustfile="locustfile.py",
-            start=now(),
-            end=now(),
-            workers=5000
-        )
-        db.session.add(new_test)
-        db.session.commit()
-        test_id = new_test.id
-
-        reqs = []
-        while req_count < int(reqs_per_test):
-
-            new_request = Request(
-                test_id=test_id,
-                name=f"Seed {req_count}",
-                request_timestamp=now(),
-                request_method="Request Method",
-                request_length=250,
-                response_length=250,
-                response_time=random.normalvariate(240, 1),
-                status_code=200,
-                success=True,
-                exception=None
-            )
-            reqs.append(new_request)
-            req_count += 1
-            time.sleep(.001)
-
-        db.session.bulk_save_objects(reqs)
-        db.session.commit()
-
-        req_count = 0
-        test_count += 1
+        seed_test(int(reqs_per_test))
 
     print('Finished seeding database')
 
 
-def now():
+@manager.command
+def export(test_id, directory='.', output_format=None):
+    """
+    Export the requests and system metrics of a test to Parquet
+    files, or CSV files if pyarrow is not installed
 
-    """ Shorthand method for getting formatted date """
+    Arguments
+        * test_id - the ID of the test to export
+        * directory - the directory to write the files to
+        * output_format - parquet or csv
+    """
+
+    if Test.query.get(int(test_id)) is None:
+        print(f'No test with ID: {test_id}')
+        return
+
+    try:
+        paths = export_test(int(test_id), directory, output_format)
+    except ExportError as e:
+        print(e)
+        return
 
-    return datetime.datetime.now().isoformat()
+    for path in paths:
+        print(f'Exported {path} ({os.path.getsize(path)} bytes)')
 
 
 if __name__ == '__main__':
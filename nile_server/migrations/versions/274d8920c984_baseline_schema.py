@@ -0,0 +1,133 @@
+"""baseline schema
+
+Revision ID: 274d8920c984
+Revises: 
+Create Date: 2026-10-18 19:15:58.113379
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '274d8920c984'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _tables():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade():
+    # Databases set up before migrations were kept in the repository
+    # already have some of these tables, so only missing ones are made
+    tables = _tables()
+
+    if 'loadtest_tests' not in tables:
+        op.create_table(
+            'loadtest_tests',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('config', sa.String(), nullable=True),
+            sa.Column('locustfile', sa.String(), nullable=True),
+            sa.Column('start', sa.TIMESTAMP(), nullable=True),
+            sa.Column('end', sa.TIMESTAMP(), nullable=True),
+            sa.Column('workers', sa.Integer(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if 'loadtest_requests' not in tables:
+        op.create_table(
+            'loadtest_requests',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('test_id', sa.Integer(), nullable=True),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.Column('request_timestamp', sa.TIMESTAMP(), nullable=True),
+            sa.Column('request_method', sa.String(), nullable=True),
+            sa.Column('request_length', sa.Integer(), nullable=True),
+            sa.Column('response_length', sa.Integer(), nullable=True),
+            sa.Column('response_time', sa.Float(), nullable=True),
+            sa.Column('status_code', sa.String(), nullable=True),
+            sa.Column('success', sa.Boolean(), nullable=True),
+            sa.Column('exception', sa.String(), nullable=True),
+            sa.Column('sampled', sa.Boolean(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    else:
+        columns = {column['name'] for column in
+                   sa.inspect(op.get_bind()).get_columns('loadtest_requests')}
+        if 'sampled' not in columns:
+            op.add_column('loadtest_requests',
+                          sa.Column('sampled', sa.Boolean(), nullable=True))
+
+    if 'loadtest_metrics' not in tables:
+        op.create_table(
+            'loadtest_metrics',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('test_id', sa.Integer(), nullable=True),
+            sa.Column('system_name', sa.String(), nullable=True),
+            sa.Column('metric_name', sa.String(), nullable=True),
+            sa.Column('metric_timestamp', sa.TIMESTAMP(), nullable=True),
+            sa.Column('metric_value', sa.Float(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if 'loadtest_request_windows' not in tables:
+        op.create_table(
+            'loadtest_request_windows',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('test_id', sa.Integer(), nullable=True),
+            sa.Column('window_start', sa.TIMESTAMP(), nullable=True),
+            sa.Column('window_seconds', sa.Float(), nullable=True),
+            sa.Column('request_method', sa.String(), nullable=True),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.Column('status_code', sa.String(), nullable=True),
+            sa.Column('success', sa.Boolean(), nullable=True),
+            sa.Column('count', sa.BigInteger(), nullable=True),
+            sa.Column('total', sa.Float(), nullable=True),
+            sa.Column('min', sa.Float(), nullable=True),
+            sa.Column('max', sa.Float(), nullable=True),
+            sa.Column('sketch', sa.Text(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if 'loadtest_test_summaries' not in tables:
+        op.create_table(
+            'loadtest_test_summaries',
+            sa.Column('test_id', sa.Integer(), autoincrement=False,
+                      nullable=False),
+            sa.Column('num_requests', sa.BigInteger(), nullable=False),
+            sa.Column('num_success', sa.BigInteger(), nullable=False),
+            sa.Column('num_metrics', sa.BigInteger(), nullable=False),
+            sa.Column('response_time_total', sa.Float(), nullable=False),
+            sa.Column('longest_request_id', sa.Integer(), nullable=True),
+            sa.Column('longest_response_time', sa.Float(), nullable=True),
+            sa.Column('median', sa.Float(), nullable=True),
+            sa.Column('percentile_90', sa.Float(), nullable=True),
+            sa.Column('percentile_95', sa.Float(), nullable=True),
+            sa.Column('percentile_99', sa.Float(), nullable=True),
+            sa.Column('stale', sa.Boolean(), nullable=False),
+            sa.PrimaryKeyConstraint('test_id')
+        )
+
+    if 'loadtest_sketches' not in tables:
+        op.create_table(
+            'loadtest_sketches',
+            sa.Column('test_id', sa.Integer(), autoincrement=False,
+                      nullable=False),
+            sa.Column('name', sa.String(), nullable=False),
+            sa.Column('source', sa.String(), nullable=False),
+            sa.Column('sketch', sa.Text(), nullable=True),
+            sa.Column('updated', sa.TIMESTAMP(), nullable=True),
+            sa.PrimaryKeyConstraint('test_id', 'name', 'source')
+        )
+
+
+def downgrade():
+    op.drop_table('loadtest_sketches')
+    op.drop_table('loadtest_test_summaries')
+    op.drop_table('loadtest_request_windows')
+    op.drop_table('loadtest_metrics')
+    op.drop_table('loadtest_requests')
+    op.drop_table('loadtest_tests')
@@ -0,0 +1,77 @@
+"""index and cascade test data
+
+Adds composite indexes for the per-test queries, and foreign keys from
+every table holding test data to its test, so deleting a test deletes
+its data. Rows of tests that no longer exist are removed first.
+
+Revision ID: 2b254890aafb
+Revises: 274d8920c984
+Create Date: 2026-10-18 19:15:58.126822
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b254890aafb'
+down_revision = '274d8920c984'
+branch_labels = None
+depends_on = None
+
+
+# Tables whose test_id references loadtest_tests
+CHILD_TABLES = (
+    'loadtest_requests',
+    'loadtest_metrics',
+    'loadtest_request_windows',
+    'loadtest_test_summaries',
+    'loadtest_sketches'
+)
+
+# Composite indexes by table
+INDEXES = {
+    'loadtest_requests': [
+        ('ix_loadtest_requests_test_id_request_timestamp',
+         ['test_id', 'request_timestamp', 'id']),
+        ('ix_loadtest_requests_test_id_response_time',
+         ['test_id', 'response_time'])
+    ],
+    'loadtest_metrics': [
+        ('ix_loadtest_metrics_test_id_metric_timestamp',
+         ['test_id', 'metric_timestamp'])
+    ],
+    'loadtest_request_windows': [
+        ('ix_loadtest_request_windows_test_id_window_start',
+         ['test_id', 'window_start'])
+    ]
+}
+
+
+def _foreign_key(table):
+    return f'fk_{table}_test_id_loadtest_tests'
+
+
+def upgrade():
+    for table in CHILD_TABLES:
+        op.execute(
+            f'DELETE FROM {table} WHERE test_id IS NOT NULL AND test_id '
+            f'NOT IN (SELECT id FROM loadtest_tests)'
+        )
+
+    for table in CHILD_TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.create_foreign_key(
+                _foreign_key(table), 'loadtest_tests',
+                ['test_id'], ['id'], ondelete='CASCADE'
+            )
+            for name, columns in INDEXES.get(table, []):
+                batch_op.create_index(name, columns)
+
+
+def downgrade():
+    for table in reversed(CHILD_TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            for name, columns in INDEXES.get(table, []):
+                batch_op.drop_index(name)
+            batch_op.drop_constraint(_foreign_key(table), type_='foreignkey')
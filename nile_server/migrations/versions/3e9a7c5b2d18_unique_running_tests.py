@@ -0,0 +1,40 @@
+"""unique running test
+
+Allows at most one test without an end time, so server processes
+sharing the database agree on the running test. Tests left running by
+an earlier server, other than the most recent one, could never be
+finalized and are ended at their start time.
+
+Revision ID: 3e9a7c5b2d18
+Revises: 8d3e6b1f0c24
+Create Date: 2026-10-18 23:02:41.530117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e9a7c5b2d18'
+down_revision = '8d3e6b1f0c24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        'UPDATE loadtest_tests SET "end" = start '
+        'WHERE "end" IS NULL '
+        'AND id < (SELECT max(id) FROM loadtest_tests)'
+    )
+
+    running = sa.text('"end" IS NULL')
+    op.create_index(
+        'uq_loadtest_tests_running', 'loadtest_tests',
+        [sa.text('("end" IS NULL)')], unique=True,
+        postgresql_where=running, sqlite_where=running
+    )
+
+
+def downgrade():
+    op.drop_index('uq_loadtest_tests_running', table_name='loadtest_tests')
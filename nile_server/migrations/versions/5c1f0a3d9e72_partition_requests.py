@@ -0,0 +1,160 @@
+"""partition requests by test
+
+On PostgreSQL, converts loadtest_requests into a table partitioned by
+LIST (test_id), with a partition per existing test and a default
+partition, and copies the existing requests into it. The ID sequence
+is kept, so request IDs do not change.
+
+On SQLite, moves the requests of each test into its shard table (see
+app.partitions). Requests are given new IDs in their shard, so the
+summaries of the moved tests are marked stale to be recomputed.
+
+Revision ID: 5c1f0a3d9e72
+Revises: 2b254890aafb
+Create Date: 2026-10-18 21:02:41.530118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.partitions import ID_BITS, partition_name, shard_table
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1f0a3d9e72'
+down_revision = '2b254890aafb'
+branch_labels = None
+depends_on = None
+
+
+TABLE = 'loadtest_requests'
+OLD_TABLE = 'loadtest_requests_unpartitioned'
+SEQUENCE = 'loadtest_requests_id_seq'
+FOREIGN_KEY = 'fk_loadtest_requests_test_id_loadtest_tests'
+INDEXES = [
+    ('ix_loadtest_requests_test_id_request_timestamp',
+     ['test_id', 'request_timestamp', 'id']),
+    ('ix_loadtest_requests_test_id_response_time',
+     ['test_id', 'response_time'])
+]
+
+# Columns copied between the table and the shards, except the ID
+COLUMNS = ('test_id, name, request_timestamp, request_method, '
+           'request_length, response_length, response_time, '
+           'status_code, success, exception, sampled')
+
+
+def _test_ids(bind, table):
+    return [row[0] for row in bind.execute(sa.text(
+        f'SELECT DISTINCT test_id FROM {table} WHERE test_id IS NOT NULL'
+    ))]
+
+
+def _mark_stale(bind, test_ids):
+    for test_id in test_ids:
+        bind.execute(sa.text(
+            'UPDATE loadtest_test_summaries SET stale = :stale '
+            'WHERE test_id = :test_id'
+        ), stale=True, test_id=test_id)
+
+
+def _rename_old(table):
+    """ Frees the names of the table's constraints and indexes """
+
+    op.execute(f'ALTER TABLE {table} RENAME TO {OLD_TABLE}')
+    op.execute(f'ALTER TABLE {OLD_TABLE} RENAME CONSTRAINT '
+               f'{table}_pkey TO {OLD_TABLE}_pkey')
+    op.execute(f'ALTER TABLE {OLD_TABLE} DROP CONSTRAINT {FOREIGN_KEY}')
+    for name, columns in INDEXES:
+        op.drop_index(name, table_name=OLD_TABLE)
+    op.execute(f'ALTER SEQUENCE {SEQUENCE} OWNED BY NONE')
+
+
+def _finish(table):
+    """ Indexes the new table, and moves the old table's data into it """
+
+    for name, columns in INDEXES:
+        op.create_index(name, TABLE, columns)
+    op.execute(f'INSERT INTO {TABLE} SELECT * FROM {table} '
+               f'WHERE test_id IS NOT NULL')
+    op.execute(f'DROP TABLE {table}')
+    op.execute(f'ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id')
+
+
+def upgrade():
+    bind = op.get_bind()
+
+    if bind.dialect.name != 'postgresql':
+        test_ids = _test_ids(bind, TABLE)
+        for test_id in test_ids:
+            shard = shard_table(test_id)
+            shard.create(bind=bind, checkfirst=True)
+            if bind.dialect.name == 'sqlite':
+                bind.execute(sa.text(
+                    'INSERT INTO sqlite_sequence (name, seq) '
+                    'SELECT :name, :seq WHERE NOT EXISTS ('
+                    'SELECT 1 FROM sqlite_sequence WHERE name = :name)'
+                ), name=shard.name, seq=test_id << ID_BITS)
+            bind.execute(sa.text(
+                f'INSERT INTO {shard.name} ({COLUMNS}) '
+                f'SELECT {COLUMNS} FROM {TABLE} '
+                f'WHERE test_id = :test_id ORDER BY id'
+            ), test_id=test_id)
+        op.execute(f'DELETE FROM {TABLE}')
+        _mark_stale(bind, test_ids)
+        return
+
+    _rename_old(TABLE)
+    op.execute(
+        f'CREATE TABLE {TABLE} ('
+        f'LIKE {OLD_TABLE} INCLUDING DEFAULTS, '
+        f'PRIMARY KEY (id, test_id), '
+        f'CONSTRAINT {FOREIGN_KEY} FOREIGN KEY (test_id) '
+        f'REFERENCES loadtest_tests (id) ON DELETE CASCADE'
+        f') PARTITION BY LIST (test_id)'
+    )
+    op.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+    for row in bind.execute(sa.text('SELECT id FROM loadtest_tests')):
+        op.execute(f'CREATE TABLE {partition_name(row[0])} '
+                   f'PARTITION OF {TABLE} FOR VALUES IN ({row[0]})')
+    _finish(OLD_TABLE)
+
+
+def downgrade():
+    bind = op.get_bind()
+
+    if bind.dialect.name != 'postgresql':
+        tables = set(sa.inspect(bind).get_table_names())
+        test_ids = [row[0] for row in bind.execute(
+            sa.text('SELECT id FROM loadtest_tests')
+        ) if partition_name(row[0]) in tables]
+        for test_id in test_ids:
+            name = partition_name(test_id)
+            bind.execute(sa.text(
+                f'INSERT INTO {TABLE} ({COLUMNS}) '
+                f'SELECT {COLUMNS} FROM {name} ORDER BY id'
+            ))
+            op.execute(f'DROP TABLE {name}')
+        _mark_stale(bind, test_ids)
+        return
+
+    partitioned = f'{TABLE}_partitioned'
+    op.execute(f'ALTER TABLE {TABLE} RENAME TO {partitioned}')
+    op.execute(f'ALTER TABLE {partitioned} RENAME CONSTRAINT '
+               f'{TABLE}_pkey TO {partitioned}_pkey')
+    op.execute(f'ALTER TABLE {partitioned} DROP CONSTRAINT {FOREIGN_KEY}')
+    for name, columns in INDEXES:
+        op.drop_index(name, table_name=partitioned)
+    op.execute(f'ALTER SEQUENCE {SEQUENCE} OWNED BY NONE')
+
+    op.execute(
+        f'CREATE TABLE {TABLE} ('
+        f'LIKE {partitioned} INCLUDING DEFAULTS, '
+        f'PRIMARY KEY (id), '
+        f'CONSTRAINT {FOREIGN_KEY} FOREIGN KEY (test_id) '
+        f'REFERENCES loadtest_tests (id) ON DELETE CASCADE)'
+    )
+    op.execute(f'ALTER TABLE {TABLE} ALTER COLUMN test_id DROP NOT NULL')
+
+    # Dropping the partitioned table drops its partitions
+    _finish(partitioned)
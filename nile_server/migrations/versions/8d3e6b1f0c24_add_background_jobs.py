@@ -0,0 +1,41 @@
+"""add background jobs
+
+Adds loadtest_jobs, holding the status and progress of background jobs
+such as deleting a test.
+
+Revision ID: 8d3e6b1f0c24
+Revises: 5c1f0a3d9e72
+Create Date: 2026-10-18 22:10:07.214583
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3e6b1f0c24'
+down_revision = '5c1f0a3d9e72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'loadtest_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('test_id', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('step', sa.String(), nullable=True),
+        sa.Column('steps_done', sa.Integer(), nullable=False),
+        sa.Column('steps_total', sa.Integer(), nullable=False),
+        sa.Column('rows_deleted', sa.BigInteger(), nullable=False),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('created', sa.TIMESTAMP(), nullable=True),
+        sa.Column('finished', sa.TIMESTAMP(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('loadtest_jobs')
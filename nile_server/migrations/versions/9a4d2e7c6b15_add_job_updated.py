@@ -0,0 +1,29 @@
+"""add job updated
+
+Adds loadtest_jobs.updated, the time a job last made progress, so a
+job left pending or running by a server process that died can be
+told apart from one still in progress.
+
+Revision ID: 9a4d2e7c6b15
+Revises: 3e9a7c5b2d18
+Create Date: 2026-10-18 23:41:52.608314
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4d2e7c6b15'
+down_revision = '3e9a7c5b2d18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('loadtest_jobs',
+                  sa.Column('updated', sa.TIMESTAMP(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('loadtest_jobs', 'updated')
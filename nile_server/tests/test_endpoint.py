@@ -1,14 +1,18 @@
 import unittest
 
 from app import app, db
-from app.models import Test, Request, SystemMetric
+from app.models import Test, RequestWindow, SystemMetric, Job
+from app.partitions import drop_partition, partition_name, request_tables
 from flask import jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, select
 
 import datetime
 import time
 import requests
 import json
+import struct
+import msgpack
 
 #########################
 # Fields Setup #
@@ -72,7 +76,7 @@ class TestEndpoint(unittest.TestCase):
         reset_db()
 
         self.assertEqual(Test.query.count(), 0)
-        self.assertEqual(Request.query.count(), 0)
+        self.assertEqual(count_requests(), 0)
         self.assertEqual(SystemMetric.query.count(), 0)
 
         print("Testing empty database")
@@ -82,14 +86,14 @@ class TestEndpoint(unittest.TestCase):
             request.text,
             "Can't submit request while no tests running."
             )
-        self.assertEqual(request.status_code, 400)
+        self.assertEqual(request.status_code, 409)
 
         request = add_metric()
         self.assertEqual(
             request.text,
             "Can't submit metric while no tests running."
             )
-        self.assertEqual(request.status_code, 400)
+        self.assertEqual(request.status_code, 409)
 
         request = finalize_test()
         self.assertEqual(
@@ -119,15 +123,72 @@ class TestEndpoint(unittest.TestCase):
 
         print("Testing post requests")
 
-        count = Request.query.count()
+        count = count_requests()
 
         request = add_request(5)
         time.sleep(4)
-        self.assertEqual(Request.query.count(), count + 5)
-        self.assertIn(
-            'Added request with ID: ',
-            request.text
-            )
+        self.assertEqual(count_requests(), count + 5)
+
+        summary = json.loads(request.content)
+        self.assertEqual(summary['count'], 5)
+        self.assertEqual(summary['last_id'] - summary['first_id'], 4)
+
+        # Batches can also be posted in the compact msgpack format
+        count = count_requests()
+        epoch = datetime.datetime(1970, 1, 1)
+        micros = (datetime.datetime.now() - epoch) \
+            // datetime.timedelta(microseconds=1)
+        batch = {
+            'version': 1,
+            'count': 2,
+            'request_timestamp': [micros, micros + 1],
+            'name': {'values': [req_name], 'indexes': [0, 0]},
+            'request_method': {'values': [req_method], 'indexes': [0, 0]},
+            'status_code': {'values': [status], 'indexes': [0, 0]},
+            'exception': {'values': [], 'indexes': [-1, -1]},
+            'request_length': [req_length, req_length],
+            'response_length': [res_length, res_length],
+            'response_time': [res_time, res_time],
+            'success': [success, success],
+            # DataBuffer sends None for requests that were not sampled
+            'sampled': [None, None]
+        }
+        request = requests.post(
+            req_endpoint, data=msgpack.packb(batch),
+            headers={'Content-Type': 'application/x-msgpack'}
+        )
+        self.assertEqual(json.loads(request.content)['count'], 2)
+        self.assertEqual(count_requests(), count + 2)
+
+        request = requests.post(req_endpoint, data='name,time',
+                                headers={'Content-Type': 'text/csv'})
+        self.assertEqual(request.status_code, 415)
+
+        # Slaves aggregating their requests post window summaries
+        count = RequestWindow.query.count()
+
+        request = requests.post(f'{req_endpoint}/windows',
+                                json=[window_data(3)])
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(json.loads(request.content)['count'], 1)
+        self.assertEqual(RequestWindow.query.count(), count + 1)
+
+        # Sketches that cannot be merged with the test's are rejected
+        for sketch in ({'relative_accuracy': 0.02},
+                       {'bins': {'311': '3'}},
+                       {'bins': {'x': 3}}):
+            window = window_data(3)
+            window['sketch'].update(sketch)
+            request = requests.post(f'{req_endpoint}/windows',
+                                    json=[window])
+            self.assertEqual(request.status_code, 400)
+        self.assertEqual(RequestWindow.query.count(), count + 1)
+
+        request = requests.get(
+            f'{req_endpoint}/test/{latest_request().test_id}/buckets',
+            params={'source': 'windows'}
+        )
+        self.assertEqual(sum(json.loads(request.content)['count']), 3)
 
     def test_03_post_metric(self):
 
@@ -144,6 +205,41 @@ class TestEndpoint(unittest.TestCase):
             request.text
             )
         self.assertEqual(SystemMetric.query.count(), count + 1)
+        # Looked up again by test_09
+        TestEndpoint.metric_id = int(request.text.split(':')[1])
+
+        print("Testing post metric batch")
+
+        batch = [{
+            'system_name': sys_name,
+            'metric_name': met_name,
+            'metric_timestamp': now(),
+            'metric_value': met_val + i
+        } for i in range(3)]
+        request = requests.post(met_endpoint, json=batch)
+        self.assertEqual(request.json(), {'count': 3})
+        self.assertEqual(SystemMetric.query.count(), count + 4)
+
+        data = msgpack.packb({
+            'version': 1,
+            'count': 2,
+            'system_name': {'values': [sys_name], 'indexes': [0, 0]},
+            'metric_name': {'values': [met_name], 'indexes': [0, 0]},
+            'metric_timestamp': [1583065815000000, 1583065816000000],
+            'metric_value': [float(met_val), float(met_val)]
+        }, use_bin_type=True)
+        request = requests.post(
+            met_endpoint, data=data,
+            headers={'Content-Type': 'application/x-msgpack'}
+        )
+        self.assertEqual(request.json(), {'count': 2})
+        self.assertEqual(SystemMetric.query.count(), count + 6)
+
+        # An invalid metric fails the whole batch
+        batch[1]['metric_value'] = 'high'
+        request = requests.post(met_endpoint, json=batch)
+        self.assertEqual(request.status_code, 400)
+        self.assertEqual(SystemMetric.query.count(), count + 6)
 
     def test_04_post_finalize(self):
 
@@ -168,10 +264,37 @@ class TestEndpoint(unittest.TestCase):
             )
 
         request = add_request(1, req_time)
-        self.assertIn(
-            'Added request with ID: ',
-            request.text
-            )
+        self.assertEqual(json.loads(request.content)['count'], 1)
+
+        # The summary includes requests saved after finalizing
+        test_id = db.session.query(Test).order_by(Test.id.desc()).first().id
+        summary = json.loads(
+            requests.get(f'{test_endpoint}/{test_id}/summary').content
+        )
+        windows = RequestWindow.query.filter(
+            RequestWindow.test_id == test_id
+        ).all()
+        self.assertEqual(
+            summary['num_requests'],
+            count_requests(test_id)
+            + sum(window.count for window in windows)
+        )
+        self.assertEqual(summary['median'], res_time)
+        self.assertEqual(summary['longest_response_time'], res_time)
+
+        # Live percentiles are estimated from the test's sketches
+        percentiles = json.loads(
+            requests.get(f'{test_endpoint}/{test_id}/percentiles').content
+        )
+        self.assertEqual(percentiles['all']['count'], summary['num_requests'])
+        self.assertAlmostEqual(percentiles['all']['p50'], res_time,
+                               delta=res_time * 0.01)
+        self.assertIn(req_name, percentiles['names'])
+
+        percentiles = json.loads(requests.get(
+            f'{api}/percentiles', params={'test_id': test_id, 'name': req_name}
+        ).content)
+        self.assertEqual(percentiles['count'], summary['num_requests'])
 
         # If request doesn't fall within the Test time period,
         # it cannot be added
@@ -180,7 +303,7 @@ class TestEndpoint(unittest.TestCase):
             request.text,
             "Can't submit request while no tests running."
             )
-        self.assertEqual(request.status_code, 400)
+        self.assertEqual(request.status_code, 409)
 
     def test_05_post_invalid(self):
 
@@ -204,7 +327,22 @@ class TestEndpoint(unittest.TestCase):
         self.assertEqual(request.status_code, 400)
 
         request = add_request(1, 'Tea time')
-        self.assertEqual(request.status_code, 500)
+        self.assertEqual(request.status_code, 400)
+
+        # A single invalid request rejects the whole batch
+        count = count_requests()
+        request = requests.post(req_endpoint, json=[
+            request_data(), dict(request_data(), response_time='slow')
+        ])
+        self.assertEqual(request.status_code, 400)
+        self.assertEqual(count_requests(), count)
+
+        # Success must be a boolean, "false" is not taken as true
+        request = requests.post(req_endpoint, json=[
+            dict(request_data(), success='false')
+        ])
+        self.assertEqual(request.status_code, 400)
+        self.assertEqual(count_requests(), count)
 
         # Fail to finalize test
         request = finalize_test('Late at night')
@@ -246,7 +384,7 @@ class TestEndpoint(unittest.TestCase):
         self.assertEqual(request.status_code, 200)
 
         test_count = Test.query.count()
-        req_count = Request.query.count()
+        req_count = count_requests()
         met_count = SystemMetric .query.count()
 
         id = db.session.query(
@@ -254,19 +392,50 @@ class TestEndpoint(unittest.TestCase):
             ).order_by(
                 Test.id.desc()
             ).first().id
+        self.assertIn(
+            partition_name(id), db.inspect(db.engine).get_table_names()
+        )
+
+        # A job left running by a server process that died is replaced
+        stale = datetime.datetime.now() - datetime.timedelta(hours=1)
+        stale_job = Job(kind='delete_test', test_id=id, status='running',
+                        created=stale, updated=stale)
+        db.session.add(stale_job)
+        db.session.commit()
+        stale_id = stale_job.id
 
         endpoint = f'{api}/delete/{id}'
         request = requests.post(endpoint)
 
+        self.assertEqual(request.status_code, 202)
+        job = Job.query.filter(Job.test_id == id).order_by(
+            Job.id.desc()
+        ).first()
+        self.assertNotEqual(job.id, stale_id)
+        self.assertEqual(
+            requests.get(f'{api}/jobs/{stale_id}').json()['status'], 'failed'
+        )
         self.assertEqual(
             request.text,
-            f"Deleted test and data with ID: {id}\n"
+            f"Deleting test and data with ID: {id} (job ID: {job.id})\n"
             )
-        self.assertEqual(request.status_code, 200)
+
+        # The test is deleted in the background
+        for _ in range(100):
+            status = requests.get(f'{api}/jobs/{job.id}').json()
+            if status['status'] in ('done', 'failed'):
+                break
+            time.sleep(0.1)
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['steps_done'], status['steps_total'])
+        db.session.expire_all()
 
         self.assertEqual(Test.query.count(), test_count - 1)
-        self.assertEqual(Request.query.count(), req_count - 5)
+        self.assertEqual(count_requests(), req_count - 5)
         self.assertEqual(SystemMetric.query.count(), met_count - 1)
+        self.assertNotIn(
+            partition_name(id), db.inspect(db.engine).get_table_names()
+        )
 
     #########################
     # Test GET section #
@@ -285,18 +454,44 @@ class TestEndpoint(unittest.TestCase):
 
         print("Testing get all requests")
 
-        endpoint = req_endpoint
-        loc_requests = json.loads(requests.get(endpoint).content)
+        endpoint = f'{req_endpoint}?limit=2'
+        loc_requests = get_pages(endpoint)
 
-        self.assertEqual(len(loc_requests), Request.query.count())
+        self.assertEqual(len(loc_requests), count_requests())
+        ids = [req['id'] for req in loc_requests]
+        self.assertEqual(ids, sorted(set(ids)))
 
         print("Testing get all metrics")
 
-        endpoint = met_endpoint
-        metrics = json.loads(requests.get(endpoint).content)
+        endpoint = f'{met_endpoint}?limit=2'
+        metrics = get_pages(endpoint)
 
         self.assertEqual(len(metrics), SystemMetric.query.count())
 
+        print("Testing filtered requests")
+
+        test_id = latest_request().test_id
+        endpoint = f'{req_endpoint}?test_id={test_id}&success=true'
+        self.assertEqual(
+            len(get_pages(endpoint)),
+            count_requests(test_id, lambda table: table.c.success.is_(True))
+        )
+
+        request = requests.get(f'{req_endpoint}?limit=0')
+        self.assertEqual(request.status_code, 400)
+
+        print("Testing internal database stats")
+
+        stats = json.loads(requests.get(
+            'http://localhost:5000/api/v1/internal/stats'
+        ).content)
+        self.assertGreater(stats['queries']['count'], 0)
+        self.assertGreater(stats['pool']['checkouts'], 0)
+        if 'size' in stats['pool']:
+            # Only QueuePools, used by every database but SQLite, have a size
+            self.assertEqual(stats['pool']['size'], 2)
+        self.assertGreater(stats['endpoints']['get_requests']['requests'], 0)
+
     def test_08_get_request_id(self):
 
         """ Test receiving requests by id """
@@ -305,11 +500,7 @@ class TestEndpoint(unittest.TestCase):
 
         add_request()
 
-        request_id = db.session.query(
-            Request
-            ).order_by(
-                Request.id.desc()
-            ).first().id
+        request_id = latest_request().id
 
         endpoint = f'{req_endpoint}/{request_id}'
         request = json.loads(requests.get(endpoint).content)
@@ -332,11 +523,63 @@ class TestEndpoint(unittest.TestCase):
         request = json.loads(requests.get(endpoint).content)
 
         # Check fields match what is expected
-        num_requests = Request.query.filter(
-            Request.test_id == test_id
-        ).count()
+        num_requests = count_requests(test_id)
 
         self.assertTrue(len(request['timestamps']) == num_requests)
+        self.assertTrue(len(request['response_times']) == num_requests)
+
+        # The compact encoding holds the same rows in chunks of
+        # [count, int64 timestamps, float32 response times]
+        content = requests.get(endpoint, params={'format': 'binary'}).content
+        offset = 0
+        binary_count = 0
+        while offset < len(content):
+            count = struct.unpack_from('<I', content, offset)[0]
+            offset += 4 + count * 12
+            binary_count += count
+        self.assertEqual(binary_count, num_requests)
+
+        # Downsampled buckets still account for every request. The test
+        # also has window summaries (test_02), which are used by default
+        buckets = json.loads(requests.get(
+            f'{endpoint}/buckets', params={'points': 10, 'source': 'requests'}
+        ).content)
+        self.assertEqual(sum(buckets['count']), num_requests)
+        self.assertLessEqual(len(buckets['timestamps']), 10)
+        self.assertEqual(buckets['max'][0], res_time)
+
+        buckets = json.loads(requests.get(
+            f'{endpoint}/buckets', params={'points': 10, 'mode': 'lttb'}
+        ).content)
+        self.assertLessEqual(len(buckets['timestamps']), 11)
+
+        request = requests.get(f'{endpoint}/buckets', params={'width': 0})
+        self.assertEqual(request.status_code, 400)
+
+        # The timeline aligns every series on the same buckets
+        timeline = json.loads(requests.get(
+            f'http://localhost:5000/api/v1/tests/{test_id}/timeline',
+            params={'points': 10}
+        ).content)
+        length = len(timeline['timestamps'])
+        if timeline['source'] == 'windows':
+            expected = sum(window.count for window in RequestWindow.query
+                           .filter(RequestWindow.test_id == test_id))
+        else:
+            expected = num_requests
+        self.assertEqual(sum(timeline['latency']['count']), expected)
+        self.assertEqual(len(timeline['latency']['p95']), length)
+        self.assertEqual(len(timeline['throughput']), length)
+        self.assertEqual(len(timeline['error_rate']), length)
+        for systems in timeline['metrics'].values():
+            for values in systems.values():
+                self.assertEqual(len(values), length)
+
+        request = requests.get(
+            f'http://localhost:5000/api/v1/tests/{test_id}/timeline',
+            params={'width': 0}
+        )
+        self.assertEqual(request.status_code, 400)
 
         requests.get(f'http://localhost:5000/tests/{test_id}')
 
@@ -346,13 +589,7 @@ class TestEndpoint(unittest.TestCase):
 
         print('Testing get metric by id')
 
-        metric_id = db.session.query(
-            SystemMetric
-            ).order_by(
-                SystemMetric.id.desc()
-            ).first().id
-
-        endpoint = f'{met_endpoint}/{metric_id}'
+        endpoint = f'{met_endpoint}/{TestEndpoint.metric_id}'
         request = json.loads(requests.get(endpoint).content)
 
         self.assertEqual(request['system_name'], sys_name)
@@ -372,6 +609,21 @@ class TestEndpoint(unittest.TestCase):
 
         self.assertEqual(request['workers'], num_workers)
 
+        print('Testing export of test data')
+
+        endpoint = f'{test_endpoint}/{test_id}/export/requests?format=csv'
+        request = requests.get(endpoint)
+        self.assertEqual(request.status_code, 200)
+        lines = request.text.splitlines()
+        self.assertEqual(lines[0].split(',')[0], 'id')
+        self.assertEqual(
+            len(lines) - 1,
+            count_requests(test_id)
+        )
+
+        endpoint = f'{test_endpoint}/{test_id}/export/sessions'
+        self.assertEqual(requests.get(endpoint).status_code, 400)
+
     def test_11_end(self):
 
         """ Up the coverage report for rendering web
@@ -428,24 +680,68 @@ def add_request(count=1, time=None):
     endpoint = req_endpoint
 
     while count > 0:
-        data = {
-            'name': req_name,
-            'request_timestamp': time if time else now(),
-            'request_method': req_method,
-            'request_length': req_length,
-            'response_length': res_length,
-            'response_time': res_time,
-            'status_code': status,
-            'success': success,
-            'exception': None
-        }
-
-        request_list.append(data)
+        request_list.append(request_data(time))
         count -= 1
 
     return requests.post(endpoint, json=request_list)
 
 
+def request_data(time=None):
+
+    """
+    Helper for building a single request record
+
+    Arguments
+        * time - can specify a timestamp for the request
+    """
+
+    return {
+        'name': req_name,
+        'request_timestamp': time if time else now(),
+        'request_method': req_method,
+        'request_length': req_length,
+        'response_length': res_length,
+        'response_time': res_time,
+        'status_code': status,
+        'success': success,
+        'exception': None
+    }
+
+
+def window_data(count, time=None):
+
+    """
+    Helper for building the summary of a request window in which
+    every request took res_time
+
+    Arguments
+        * count - the number of requests in the window
+        * time - can specify the start of the window
+    """
+
+    return {
+        'window_start': time if time else now(),
+        'window_seconds': 1.0,
+        'request_method': req_method,
+        'name': req_name,
+        'status_code': status,
+        'success': success,
+        'count': count,
+        'total': res_time * count,
+        'min': res_time,
+        'max': res_time,
+        'sketch': {
+            'relative_accuracy': 0.01,
+            'bins': {'311': count},
+            'zero_count': 0,
+            'count': count,
+            'total': res_time * count,
+            'min': res_time,
+            'max': res_time
+        }
+    }
+
+
 def add_metric(time=None):
 
     """
@@ -491,15 +787,65 @@ def now():
     return datetime.datetime.now().isoformat()
 
 
+def get_pages(endpoint):
+    """ Follows the next links from endpoint, returning every row """
+
+    rows = []
+    while endpoint is not None:
+        response = requests.get(endpoint)
+        rows.extend(json.loads(response.content))
+        endpoint = response.links.get('next', {}).get('url')
+    return rows
+
+
+def count_requests(test_id=None, condition=None):
+    """
+    Counts the requests of every test, or of one test, across the tables
+    holding them. On SQLite these are per test shard tables, and
+    loadtest_requests itself stays empty, see app/partitions.py.
+
+    Arguments
+        * test_id - the ID of the test, if only its requests are counted
+        * condition - a function returning a filter for a request table
+    """
+
+    count = 0
+    for table in request_tables(test_id):
+        query = select([func.count()]).select_from(table)
+        if test_id is not None:
+            query = query.where(table.c.test_id == test_id)
+        if condition is not None:
+            query = query.where(condition(table))
+        count += db.session.execute(query).scalar()
+    return count
+
+
+def latest_request():
+    """ Returns the row of the request with the highest ID, or None """
+
+    latest = None
+    for table in request_tables():
+        row = db.session.execute(
+            select([table]).order_by(table.c.id.desc()).limit(1)
+        ).fetchone()
+        if row is not None and (latest is None or row.id > latest.id):
+            latest = row
+    return latest
+
+
 def reset_db():
 
     """ Clears the database for the next test"""
 
     print('Resetting database...')
     print(f'Tests: {Test.query.count()}')
-    print(f'Requests: {Request.query.count()}')
+    print(f'Requests: {count_requests()}')
     print(f'Metrics: {SystemMetric.query.count()}')
 
+    # Shard tables (SQLite) or partitions are dropped with their tests
+    for (test_id,) in db.session.query(Test.id):
+        drop_partition(test_id)
+
     meta = db.metadata
     for table in reversed(meta.sorted_tables):
         print(f'Clearing table {table}')
@@ -509,7 +855,7 @@ def reset_db():
     db.session.commit()
 
     print(f'Tests: {Test.query.count()}')
-    print(f'Requests: {Request.query.count()}')
+    print(f'Requests: {count_requests()}')
     print(f'Metrics: {SystemMetric.query.count()}')
 
 
@@ -8,34 +8,26 @@ as displaying database information in a web interface.
 
 from datetime import datetime
 from app import app, db
-from app.models import Test, Request, SystemMetric, TestSchema, RequestSchema, SystemMetricSchema
+from app.models import Test, Request, RequestWindow, SystemMetric, Job, TestSchema, RequestSchema, SystemMetricSchema, TestSummarySchema, JobSchema
+from app.ingest import BatchError, parse_requests, insert_requests, parse_windows, insert_windows, parse_metrics, insert_metrics
+from app.wire import CONTENT_TYPE as BATCH_CONTENT_TYPE, parse_batch, parse_metric_batch
+from app.streaming import stream_rows, json_array, binary_chunk
+from app.dbstats import stats as db_stats
+from app.downsample import downsample, downsample_windows, has_windows, AGGREGATE, MODES
+from app.export import CONTENT_TYPES as EXPORT_CONTENT_TYPES, DATASETS as EXPORT_DATASETS, ExportError, export_chunks, export_format, file_name as export_file_name
+from app.jobs import delete_test_job
+from app.pagination import PageError, page_params, filter_conditions, keyset_page
+from app.partitions import create_partition, request_table, request_tables, load_request
+from app.summaries import create_summary, refresh_summary, get_summary, summary_percentiles
+from app.sketches import sketches, ALL
+from app.state import assign_test, running_test, running_test_id
+from app.timeline import TimelineError, timeline
 from flask import Flask, jsonify, render_template, url_for, request, redirect, Response
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
 
-import json
 import os
 
-#########################
-# Initialize Current Test #
-#########################
-"""
-The server keeps track of the currently running test. When started,
-it will initialize the current test if the most recent test has been
-finalized. Otherwise, it will set the previously run test.
-"""
-CURRENT_TEST = None
-PREV_TEST = None
-if Test.query.count() > 0:
-    most_recent = db.session.query(Test).order_by(Test.id.desc()).first()
-    # If most recent test has not been finalized, set it to CURRENT_TEST
-    if most_recent.end is None:
-        CURRENT_TEST = most_recent
-        PREV_TEST = None
-    # Otherwise set the currently running test to PREV_TEST
-    else:
-        CURRENT_TEST = None
-        PREV_TEST = most_recent
-
-
 #########################
 # Template Populating Pages Section #
 #########################
@@ -72,8 +64,8 @@ def view_tests():
 @app.route("/tests/<test_id>/")
 def view_test_id(test_id):
     """
-    Gets the specified test by ID, along with all requests
-    and metrics associated with it and renders to summary.html.
+    Gets the specified test by ID, along with the summary
+    statistics of its requests and metrics and renders to summary.html.
 
     Arguments
         * test_id - the ID of the test being rendered
@@ -87,75 +79,31 @@ def view_test_id(test_id):
     test_json = test_schema.dump(test)
     test_json['start'] = test.start.strftime('%H:%M:%S %m/%d/%Y')
     if test.end:
-        test_json['end'] = test.start.strftime('%H:%M:%S %m/%d/%Y')
+        test_json['end'] = test.end.strftime('%H:%M:%S %m/%d/%Y')
+
+    # Summary statistics are kept up to date as data is ingested
+    summary = get_summary(test.id)
+    percentiles = summary_percentiles(summary)
 
-    # Gather summary statistics for requests
     longest = None
-    num_success = 0
-    num_exception = 0
-    mean_response = 0
-    median_response = 0
-    percentile_90 = 0
-    percentile_95 = 0
-    percentile_99 = 0
-    num_requests = Request.query.filter(Request.test_id == test_id).count()
-
-    if num_requests > 0:
-        num_success = Request.query.filter(
-            Request.test_id == test_id and Request.success is True
-            ).count()
-        num_exception = num_requests - num_success
-
-        # Get the average response time
-        avg = list(db.session.execute(
-            'select ' +
-            'avg(response_time) ' +
-            f'from loadtest_requests where test_id={test_id}'
-        ).fetchone())
-        mean_response = '{0:3.1f}'.format(avg[0])
-
-        # Get the request with the longest response time
-        longest = db.session.query(Request).order_by(
-            Request.response_time.desc()
-        ).first()
+    if summary.longest_request_id is not None:
+        # Loaded detached, so formatting it is never flushed
+        longest = load_request(summary.longest_request_id, test.id)
         longest.response_time = '{0:3.1f}'.format(longest.response_time)
 
-        # Get the response time percentiles
-        percentiles = list(db.session.execute(
-            'select ' +
-            'percentile_disc(0.50) within ' +
-            'group (order by response_time), ' +
-            'percentile_disc(0.90) within ' +
-            'group (order by response_time), ' +
-            'percentile_disc(0.95) within ' +
-            'group (order by response_time), ' +
-            'percentile_disc(0.99) within ' +
-            'group (order by response_time) ' +
-            f'from loadtest_requests where test_id={test_id}'
-        ).fetchone())
-
-        # Format response times
-        median_response = '{0:3.1f}'.format(percentiles[0])
-        percentile_90 = '{0:3.1f}'.format(percentiles[1])
-        percentile_95 = '{0:3.1f}'.format(percentiles[2])
-        percentile_99 = '{0:3.1f}'.format(percentiles[3])
-
-    # System metrics gathering not yet implemented
-    metrics = SystemMetric.query.filter(SystemMetric.test_id == test_id).all()
-
     return render_template(
         'summary.html',
         test=test_json,
-        num_req=num_requests,
-        num_met=len(metrics),
+        num_req=summary.num_requests,
+        num_met=summary.num_metrics,
         longest=longest,
-        num_success=num_success,
-        num_exception=num_exception,
-        mean=mean_response,
-        median=median_response,
-        percentile_90=percentile_90,
-        percentile_95=percentile_95,
-        percentile_99=percentile_99
+        num_success=summary.num_success,
+        num_exception=summary.num_requests - summary.num_success,
+        mean=format_time(summary.mean()),
+        median=format_time(percentiles['median']),
+        percentile_90=format_time(percentiles['percentile_90']),
+        percentile_95=format_time(percentiles['percentile_95']),
+        percentile_99=format_time(percentiles['percentile_99'])
     )
 
 
@@ -209,9 +157,7 @@ def tests():
     test data will be saved to the database.
     """
 
-    global CURRENT_TEST
-
-    if CURRENT_TEST is not None:
+    if running_test() is not None:
         return Response(
             "Can only run one test at a time.",
             status=400,
@@ -235,10 +181,21 @@ def tests():
 
     try:
         db.session.add(new_test)
+        db.session.flush()
+        create_summary(new_test.id)
+        create_partition(new_test.id)
         db.session.commit()
-        CURRENT_TEST = new_test
-        return "Added test with ID: " + str(CURRENT_TEST.id) + "\n"
+        return "Added test with ID: " + str(new_test.id) + "\n"
+    except IntegrityError:
+        # Another server process started a test first
+        db.session.rollback()
+        return Response(
+            "Can only run one test at a time.",
+            status=400,
+            mimetype='application/json'
+        )
     except Exception as e:
+        db.session.rollback()
         return Response(
             f"Failed to add test with exception: {e}",
             status=400,
@@ -253,139 +210,201 @@ def requests():
     only be added if a test is currently running, or if
     it was made before the last test finished. (Its timestamp
     is between the previous test start and end time)
+
+    The batch is either a JSON list of requests, or an encoded batch
+    (see app/wire.py) when the Content-Type is application/x-msgpack.
+    Other content types are refused with 415, so clients can fall back
+    to JSON. The whole batch is validated up front and saved in a single
+    transaction. Responds with the number of requests added and
+    the IDs of the first and last of them.
+
+    An invalid batch is refused with 400. While no test can take the
+    batch it is refused with 409, and if it cannot be saved with 503,
+    so clients know to send it again later.
     """
 
-    global CURRENT_TEST
-    global PREV_TEST
+    if request.mimetype not in ('application/json', BATCH_CONTENT_TYPE):
+        return Response(
+            f"Unsupported Content-Type {request.mimetype}.",
+            status=415,
+            mimetype='application/json'
+        )
 
-    requests = request.get_json()
+    # Validate the whole batch before anything is saved
+    try:
+        if request.mimetype == BATCH_CONTENT_TYPE:
+            rows = parse_batch(
+                request.get_data(),
+                request.headers.get('Content-Encoding')
+            )
+        else:
+            rows = parse_requests(request.get_json())
+    except BatchError as e:
+        return Response(
+            f"Failed to add requests with exception: {e}",
+            status=400,
+            mimetype='application/json'
+        )
 
-    if requests == []:
+    if rows == []:
         return Response(
             "Buffer of requests empty. Nothing to save.",
             status=200,
             mimetype='application/json'
             )
 
-    time_sent = datetime.strptime(
-            requests[0]['request_timestamp'],
-            "%Y-%m-%dT%H:%M:%S.%f"
-    )
+    test_id, finalized = assign_test(rows[0]['request_timestamp'])
+    if test_id is None:
+        return Response(
+            "Can't submit request while no tests running.",
+            status=409,
+            mimetype='application/json'
+        )
+
+    try:
+        first_id, last_id = insert_requests(rows, test_id, finalized)
+    except Exception as e:
+        return Response(
+            f"Failed to add requests with exception: {e}",
+            status=503,
+            mimetype='application/json'
+        )
 
-    # Assign this request to the correct test, if exists.
-    # Otherwise, it cannot be added.
-    test_id = None
-    if CURRENT_TEST:
+    return jsonify({
+        'count': len(rows),
+        'first_id': first_id,
+        'last_id': last_id
+    })
 
-        test_id = CURRENT_TEST.id
 
-    if (PREV_TEST and time_sent <= PREV_TEST.end
-            and time_sent >= PREV_TEST.start):
+@app.route('/api/v1/requests/windows', methods=['POST'])
+def request_windows():
+    """
+    Route to add summaries of request windows, posted by slaves which
+    aggregate their requests rather than uploading each one. Windows
+    are assigned to a test the same way as requests, and the whole
+    batch is saved in a single transaction. Refused batches get the
+    same status codes as requests.
+    """
 
-        test_id = PREV_TEST.id
+    windows = request.get_json()
 
-    if test_id is None:
+    if windows == []:
         return Response(
-            "Can't submit request while no tests running.",
+            "Buffer of windows empty. Nothing to save.",
+            status=200,
+            mimetype='application/json'
+            )
+
+    try:
+        rows = parse_windows(windows)
+    except BatchError as e:
+        return Response(
+            f"Failed to add windows with exception: {e}",
             status=400,
             mimetype='application/json'
         )
 
-    response = ''
-
-    for req in requests:
-        name = req['name']
-        request_timestamp = req['request_timestamp']
-        request_method = req['request_method']
-        request_length = req['request_length']
-        response_length = req['response_length']
-        response_time = req['response_time']
-        status_code = req['status_code']
-        success = req['success']
-        exception = req['exception']
-
-        new_request = Request(
-            test_id=test_id,
-            name=name,
-            request_timestamp=request_timestamp,
-            request_method=request_method,
-            request_length=request_length,
-            response_length=response_length,
-            response_time=response_time,
-            status_code=status_code,
-            success=success,
-            exception=exception
-        )
-
-        try:
-            db.session.add(new_request)
-            db.session.commit()
-            req_id = str(new_request.id)
-            response += f"Added request with ID: {req_id}\n"
-        except Exception as e:
-            return Response(
-                f"Failed to add request {req_id} with exception: {e}",
-                status=400,
-                mimetype='application/json'
-            )
+    test_id, finalized = assign_test(rows[0]['window_start'])
+    if test_id is None:
+        return Response(
+            "Can't submit windows while no tests running.",
+            status=409,
+            mimetype='application/json'
+        )
 
-    return response
+    try:
+        insert_windows(rows, test_id, finalized)
+    except Exception as e:
+        return Response(
+            f"Failed to add windows with exception: {e}",
+            status=503,
+            mimetype='application/json'
+        )
+
+    return jsonify({'count': len(rows)})
 
 
 @app.route('/api/v1/metrics', methods=['POST'])
 def metrics():
     """
-    Route to add new metric. A metric can only be added
+    Route to add new metrics. Metrics can only be added
     if a test is currently running.
+
+    The body is either a single JSON metric, a JSON list of metrics,
+    or an encoded batch (see app/wire.py) when the Content-Type is
+    application/x-msgpack. Other content types are refused with 415.
+    A batch is validated up front and saved in a single transaction,
+    and the response holds the number of metrics added. Refused batches
+    get the same status codes as requests.
     """
 
-    global CURRENT_TEST
-    if CURRENT_TEST is None:
+    if request.mimetype not in ('application/json', BATCH_CONTENT_TYPE):
+        return Response(
+            f"Unsupported Content-Type {request.mimetype}.",
+            status=415,
+            mimetype='application/json'
+        )
+
+    test_id = running_test_id()
+    if test_id is None:
         return Response(
             "Can't submit metric while no tests running.",
+            status=409,
+            mimetype='application/json'
+        )
+
+    # Validate the whole batch before anything is saved
+    try:
+        if request.mimetype == BATCH_CONTENT_TYPE:
+            single = False
+            rows = parse_metric_batch(
+                request.get_data(),
+                request.headers.get('Content-Encoding')
+            )
+        else:
+            data = request.get_json()
+            single = isinstance(data, dict)
+            rows = parse_metrics([data] if single else data)
+    except BatchError as e:
+        return Response(
+            f"Failed to add metric with exception: {e}",
             status=400,
             mimetype='application/json'
         )
 
-    data = request.get_json()
-    system_name = data['system_name']
-    metric_name = data['metric_name']
-    metric_timestamp = data['metric_timestamp']
-    metric_value = data['metric_value']
-
-    new_metric = SystemMetric(
-        test_id=CURRENT_TEST.id,
-        system_name=system_name,
-        metric_name=metric_name,
-        metric_timestamp=metric_timestamp,
-        metric_value=metric_value
-    )
+    if rows == []:
+        return Response(
+            "Buffer of metrics empty. Nothing to save.",
+            status=200,
+            mimetype='application/json'
+            )
 
     try:
-        db.session.add(new_metric)
-        db.session.commit()
-        return f"Added metric with ID: {str(new_metric.id)}\n"
+        ids = insert_metrics(rows, test_id)
+        if single:
+            return f"Added metric with ID: {str(ids[0])}\n"
     except Exception as e:
+        db.session.rollback()
         return Response(
             f"Failed to add metric with exception: {e}",
-            status=400,
+            status=503,
             mimetype='application/json'
         )
 
+    return jsonify({'count': len(rows)})
+
 
 @app.route('/api/v1/tests/finalize', methods=['POST'])
 def finalize_test():
     """
-    Route to add an end time to the currently running test
-    and set the current test as none and previous test as this
-    one. Must also make sure to use the database session the 
-    test was started with.
+    Route to add an end time to the currently running test,
+    after which late data made before the end time is saved to it
+    as the previous test.
     """
 
-    global CURRENT_TEST
-    global PREV_TEST
-
-    if CURRENT_TEST is None:
+    test = running_test()
+    if test is None:
         return Response(
             "No test running.",
             status=400,
@@ -393,22 +412,18 @@ def finalize_test():
         )
 
     data = request.get_json()
-    CURRENT_TEST.end = datetime.strptime(
+    test.end = datetime.strptime(
             data['end'],
             "%Y-%m-%dT%H:%M:%S.%f"
     )
 
-    PREV_TEST = CURRENT_TEST
-    CURRENT_TEST = None
-
     try:
-        test_session = db.object_session(PREV_TEST)
-        if test_session is None:
-            test_session = db.session
-        test_session.add(PREV_TEST)
-        test_session.commit()
-        return f"Finalized test with ID: {PREV_TEST.id}\n"
+        db.session.commit()
+        sketches.checkpoint(test.id)
+        refresh_summary(test.id)
+        return f"Finalized test with ID: {test.id}\n"
     except Exception as e:
+        db.session.rollback()
         return Response(
             f"Failed to finalize with exception: {e}",
             status=400,
@@ -416,26 +431,39 @@ def finalize_test():
         )
 
 
-@app.route('/api/v1/delete/<test_id>', methods=['POST'])
+@app.route('/api/v1/delete/<int:test_id>', methods=['POST'])
 def delete_test(test_id):
     """
-    Delete a test with the given ID. Also searches for
-    all relevant requests and metrics to delete as well.
-    """
+    Starts deleting a test with the given ID, along with all of its
+    requests and metrics, in the background. Responds at once with
+    the ID of the job, whose progress is reported by /api/v1/jobs.
 
-    try:
-        Test.query.filter(Test.id == test_id).delete()
-        reqs = Request.query.filter(Request.test_id == test_id).all()
-        mets = SystemMetric.query.filter(SystemMetric.test_id == test_id).all()
+    Arguments
+        * test_id - the ID of the test to delete
+    """
 
-        for req in reqs:
-            Request.query.filter(Request.id == req.id).delete()
+    test = Test.query.get(test_id)
+    if test is None:
+        return Response(
+            f"No test with ID: {test_id}",
+            status=404,
+            mimetype='application/json'
+        )
 
-        for met in mets:
-            SystemMetric.query.filter(SystemMetric.id == met.id).delete()
+    if test.end is None:
+        return Response(
+            "Cannot delete a running test.",
+            status=400,
+            mimetype='application/json'
+        )
 
-        db.session.commit()
-        return f"Deleted test and data with ID: {test_id}\n"
+    try:
+        # Late requests are not saved to a test while it is deleted
+        job_id = delete_test_job(test_id)
+        return (
+            f"Deleting test and data with ID: {test_id} (job ID: {job_id})\n",
+            202
+        )
     except Exception as e:
         return Response(
             f"Failed to delete test with exception: {e}",
@@ -444,6 +472,63 @@ def delete_test(test_id):
         )
 
 
+@app.route('/api/v1/tests/<int:test_id>/export/<dataset>', methods=['GET'])
+def export_test_data(test_id, dataset):
+    """
+    Streams the raw requests or system metrics of a test as a file
+    download, in Parquet format if pyarrow is installed and CSV
+    otherwise, or in the format given by ?format=parquet|csv
+
+    Arguments
+        * test_id - the ID of the test to export
+        * dataset - requests or metrics
+    """
+
+    if Test.query.get(test_id) is None:
+        return Response(
+            f"No test with ID: {test_id}",
+            status=404,
+            mimetype='application/json'
+        )
+
+    try:
+        if dataset not in EXPORT_DATASETS:
+            raise ExportError(f"Unknown dataset: {dataset}")
+        output_format = export_format(request.args.get('format'))
+        body = export_chunks(test_id, dataset, output_format)
+    except ExportError as e:
+        return Response(str(e), status=400, mimetype='application/json')
+
+    filename = export_file_name(test_id, dataset, output_format)
+    return Response(
+        body,
+        mimetype=EXPORT_CONTENT_TYPES[output_format],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+@app.route('/api/v1/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Route to get the status and progress of a background job,
+    such as deleting a test, in JSON format
+
+    Arguments
+        * job_id - the ID of the job
+    """
+
+    job = Job.query.get(job_id)
+    if job is None:
+        return Response(
+            f"No job with ID: {job_id}",
+            status=404,
+            mimetype='application/json'
+        )
+
+    job_schema = JobSchema()
+    return jsonify(job_schema.dump(job))
+
+
 #########################
 # GET Request Endpoints ID Section #
 
@@ -465,6 +550,76 @@ def get_test(test_id):
     return jsonify(output)
 
 
+@app.route('/api/v1/tests/<test_id>/summary', methods=['GET'])
+def get_test_summary(test_id):
+    """
+    Route to get the summary statistics of a test in JSON format.
+
+    Arguments
+        * test_id - the ID of test to summarize
+    """
+
+    if Test.query.get(test_id) is None:
+        return Response(
+            f"No test with ID: {test_id}",
+            status=404,
+            mimetype='application/json'
+        )
+
+    summary = get_summary(test_id)
+    summary_schema = TestSummarySchema()
+    output = summary_schema.dump(summary)
+    output['mean'] = summary.mean()
+    output.update(summary_percentiles(summary))
+    return jsonify(output)
+
+
+@app.route('/api/v1/tests/<int:test_id>/percentiles', methods=['GET'])
+def get_test_percentiles(test_id):
+    """
+    Route to get live response time percentiles of a test, for all
+    of its requests and for each endpoint name, estimated from the
+    test's sketches.
+
+    Arguments
+        * test_id - the ID of test to get percentiles for
+    """
+
+    output = {'all': sketch_json(sketches.read([test_id]))}
+    output['names'] = {
+        name: sketch_json(sketches.read([test_id], name))
+        for name in sketches.names(test_id)
+    }
+    return jsonify(output)
+
+
+@app.route('/api/v1/percentiles', methods=['GET'])
+def get_percentiles():
+    """
+    Route to compare response time percentiles, estimated by merging
+    the sketches of one or more tests.
+
+    Query parameters
+        * test_id - the ID of a test to include, may be repeated
+        * name - only include requests with this endpoint name
+    """
+
+    try:
+        test_ids = [int(test_id) for test_id in request.args.getlist('test_id')]
+    except ValueError as e:
+        return Response(
+            f"Invalid test ID: {e}",
+            status=400,
+            mimetype='application/json'
+        )
+
+    name = request.args.get('name', ALL)
+    output = sketch_json(sketches.read(test_ids, name))
+    output['test_ids'] = test_ids
+    output['name'] = name
+    return jsonify(output)
+
+
 @app.route('/api/v1/metrics/<metric_id>', methods=['GET'])
 def get_metric(metric_id):
     """
@@ -489,7 +644,7 @@ def get_request(request_id):
         * request_id - the ID of request to return
     """
 
-    request = Request.query.get(request_id)
+    request = load_request(request_id)
     request_schema = RequestSchema()
     output = request_schema.dump(request)
     return jsonify(output)
@@ -515,35 +670,92 @@ def get_tests():
     return jsonify(output)
 
 
+def page_response(output, rows, limit):
+    """
+    Returns a page of rows in JSON format. If the page is full, a
+    Link header gives the URL of the next page.
+
+    Arguments
+        * output - the serialized rows
+        * rows - the rows of the page
+        * limit - the maximum number of rows per page
+    """
+
+    response = jsonify(output)
+    if len(rows) == limit:
+        args = request.args.to_dict()
+        args.update(after=rows[-1].id, limit=limit)
+        next_url = url_for(request.endpoint, _external=True, **args)
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+
 @app.route('/api/v1/requests', methods=['GET'])
 def get_requests():
     """
-    Route to get all requests in JSON format
+    Route to get requests in JSON format, a page at a time in order
+    of ID. The Link header of a full page holds the URL of the next.
+
+    Query parameters
+        * limit - the maximum number of requests per page
+        * after - the ID of the last request of the previous page
+        * test_id - only return requests of this test
+        * start, end - only return requests made from start and
+            before end (ISO formatted)
+        * name - only return requests with this name
+        * success - only return successful (true) or failed (false)
+            requests
     """
 
-    requests = Request.query.all()
-    output = []
-    for req in requests:
-        request_schema = RequestSchema()
-        output.append(request_schema.dump(req))
-    return jsonify(output)
+    try:
+        limit, after = page_params(request.args)
+        rows = keyset_page(
+            request_tables(request.args.get('test_id', type=int)),
+            lambda table: filter_conditions(
+                table, request.args, 'request_timestamp', 'name',
+                ('success',)
+            ),
+            after, limit
+        )
+    except PageError as e:
+        return Response(str(e), status=400, mimetype='application/json')
+
+    return page_response(RequestSchema(many=True).dump(rows), rows, limit)
 
 
 @app.route('/api/v1/metrics', methods=['GET'])
 def get_metrics():
     """
-    Route to get all metrics in JSON format
+    Route to get metrics in JSON format, a page at a time in order
+    of ID. The Link header of a full page holds the URL of the next.
+
+    Query parameters
+        * limit - the maximum number of metrics per page
+        * after - the ID of the last metric of the previous page
+        * test_id - only return metrics of this test
+        * start, end - only return metrics taken from start and
+            before end (ISO formatted)
+        * name - only return metrics with this metric name
     """
 
-    metrics = SystemMetric.query.all()
-    output = []
-    for metric in metrics:
-        metric_schema = SystemMetricSchema()
-        output.append(metric_schema.dump(metric))
-    return jsonify(output)
+    try:
+        limit, after = page_params(request.args)
+        rows = keyset_page(
+            [SystemMetric.__table__],
+            lambda table: filter_conditions(
+                table, request.args, 'metric_timestamp', 'metric_name'
+            ),
+            after, limit
+        )
+    except PageError as e:
+        return Response(str(e), status=400, mimetype='application/json')
+
+    return page_response(
+        SystemMetricSchema(many=True).dump(rows), rows, limit
+    )
 
 
-@app.route('/api/v1/requests/test/<test_id>', methods=['GET'])
+@app.route('/api/v1/requests/test/<int:test_id>', methods=['GET'])
 def get_requests_test(test_id):
     """
     Retrieves all of the timestamps and response times of the
@@ -551,31 +763,188 @@ def get_requests_test(test_id):
     asynchronously from the graphs page to improve chart load
     times.
 
+    Rows are read through a server-side cursor and streamed to the
+    client in chunks. By default the body is a JSON object holding
+    'timestamps' and 'response_times' arrays. With ?format=binary the
+    body is a sequence of compact little-endian chunks instead, see
+    app.streaming.binary_chunk for the layout.
+
     Arguments
         * test_id - the ID of test to fetch requests for
     """
 
-    requests = list(db.session.execute(
-        'select response_time, request_timestamp ' +
-        f'from loadtest_requests where test_id={test_id} ' +
-        'order by request_timestamp'
-    ).fetchall())
+    table = request_table(test_id)
+    output_format = request.args.get('format', 'json')
 
-    reqs_dict = {}
-    reqs_dict['timestamps'] = []
-    reqs_dict['response_times'] = []
+    def query(*columns):
+        return select(columns).where(
+            table.c.test_id == test_id
+        ).order_by(table.c.request_timestamp, table.c.id)
 
-    for row in requests:
-        reqs_dict['timestamps'].append(row['request_timestamp'])
-        reqs_dict['response_times'].append(row['response_time'])
+    if output_format == 'binary':
+        chunks = stream_rows(
+            query(table.c.request_timestamp, table.c.response_time)
+        )
+        body = (
+            binary_chunk([row[0] for row in rows], [row[1] for row in rows])
+            for rows in chunks
+        )
+        return Response(body, mimetype='application/octet-stream')
+
+    if output_format != 'json':
+        return Response(
+            f"Unknown format: {output_format}",
+            status=400,
+            mimetype='application/json'
+        )
+
+    # Both arrays are streamed by their own pass over the cursor, so
+    # neither is held in memory. Rows with IDs above the highest one when
+    # the request arrived are left out of both, so the arrays hold the same requests even
+    # while the test is still running
+    max_id = db.session.execute(
+        select([func.max(table.c.id)]).where(table.c.test_id == test_id)
+    ).scalar()
+
+    def values(column):
+        if max_id is None:
+            return iter(())
+        return (
+            [row[0] for row in rows]
+            for rows in stream_rows(query(column).where(table.c.id <= max_id))
+        )
+
+    def generate():
+        yield '{'
+        yield from json_array('timestamps',
+                              values(table.c.request_timestamp),
+                              default=dateconvert, first=True)
+        yield from json_array('response_times',
+                              values(table.c.response_time))
+        yield '}'
+
+    return Response(generate(), mimetype='application/json')
 
-    reqs_json = json.dumps(
-        reqs_dict,
-        separators=(',', ':'),
-        default=dateconvert
-    )
 
-    return reqs_json
+@app.route('/api/v1/requests/test/<int:test_id>/buckets', methods=['GET'])
+def get_requests_test_buckets(test_id):
+    """
+    Retrieves the requests of a test downsampled into time buckets,
+    so the size of the response is bounded by the number of buckets
+    rather than the number of requests. Used by the graphs page.
+
+    Query parameters
+        * mode - 'aggregate' (default) for the count, min, max, mean,
+            p50, p95 and p99 of each bucket, or 'lttb' for one
+            shape-preserving request per bucket
+        * width - the bucket width in milliseconds
+        * points - the number of buckets to aim for when no width
+            is given (default 1000)
+        * source - 'requests' to use the stored requests, 'windows'
+            to use the window summaries uploaded by aggregating slaves,
+            or 'auto' (default) to use windows if the test has any.
+            Windows only support the aggregate mode.
+
+    Arguments
+        * test_id - the ID of test to fetch requests for
+    """
+
+    mode = request.args.get('mode', AGGREGATE)
+    source = request.args.get('source', 'auto')
+    try:
+        width = request.args.get('width')
+        width = positive_int(width) if width is not None else None
+        points = positive_int(request.args.get('points', 1000))
+        if mode not in MODES:
+            raise ValueError(f'mode must be one of {", ".join(MODES)}')
+        if source not in ('auto', 'requests', 'windows'):
+            raise ValueError('source must be auto, requests or windows')
+        if source == 'windows' and mode != AGGREGATE:
+            raise ValueError(f'windows only support the {AGGREGATE} mode')
+    except ValueError as e:
+        return Response(
+            f"Invalid downsampling parameters: {e}",
+            status=400,
+            mimetype='application/json'
+        )
+
+    if source == 'auto' and mode == AGGREGATE:
+        source = 'windows' if has_windows(test_id) else 'requests'
+
+    if source == 'windows':
+        return jsonify(downsample_windows(test_id, width, points))
+    return jsonify(downsample(test_id, mode, width, points))
+
+
+@app.route('/api/v1/tests/<int:test_id>/timeline', methods=['GET'])
+def get_test_timeline(test_id):
+    """
+    Retrieves the latency percentiles, throughput, error rate and
+    system metrics of a test as time series aligned on the same
+    buckets, so they can be charted together from one request.
+    Buckets without data hold None.
+
+    Query parameters
+        * width - the bucket width in milliseconds
+        * points - the number of buckets to aim for when no width
+            is given (default 1000)
+        * metric - the name of a system metric to include, may be
+            repeated. By default every metric is included.
+        * system - only include metrics of this system, may be repeated
+
+    Arguments
+        * test_id - the ID of test to fetch the timeline of
+    """
+
+    if Test.query.get(test_id) is None:
+        return Response(
+            f"No test with ID: {test_id}",
+            status=404,
+            mimetype='application/json'
+        )
+
+    try:
+        width = request.args.get('width')
+        width = positive_int(width) if width is not None else None
+        points = positive_int(request.args.get('points', 1000))
+    except ValueError as e:
+        return Response(
+            f"Invalid timeline parameters: {e}",
+            status=400,
+            mimetype='application/json'
+        )
+
+    try:
+        output = timeline(test_id, width, points,
+                          metric_names=request.args.getlist('metric'),
+                          system_names=request.args.getlist('system'))
+    except TimelineError as e:
+        return Response(
+            f"Invalid timeline parameters: {e}",
+            status=400,
+            mimetype='application/json'
+        )
+
+    return jsonify(output)
+
+
+@app.route('/api/v1/internal/stats', methods=['GET'])
+def get_internal_stats():
+    """
+    Route to get the database connection pool and query statistics of
+    the server process handling the request: connections opened and
+    checked out, time spent waiting for a connection, and the number
+    and time of queries in total and for each endpoint.
+    Under gunicorn each worker process keeps its own statistics.
+
+    Query parameters
+        * reset - if true, the counters are reset after being read
+    """
+
+    output = db_stats.snapshot(db.engine.pool)
+    if request.args.get('reset', 'false').lower() in ('true', '1'):
+        db_stats.reset()
+    return jsonify(output)
 
 
 #########################
@@ -601,6 +970,44 @@ def shutdown():
         print('Can only shut down test server!')
 
 
+def sketch_json(sketch):
+    """
+    Helper function to convert a sketch into
+    its count and percentile estimates
+    """
+    return {
+        'count': sketch.count,
+        'min': sketch.min,
+        'max': sketch.max,
+        'mean': sketch.mean(),
+        'p50': sketch.quantile(0.50),
+        'p90': sketch.quantile(0.90),
+        'p95': sketch.quantile(0.95),
+        'p99': sketch.quantile(0.99)
+    }
+
+
+def format_time(value):
+    """
+    Helper function to format a response time
+    for display, or 0 if there is none
+    """
+    if value is None:
+        return 0
+    return '{0:3.1f}'.format(value)
+
+
+def positive_int(value):
+    """
+    Helper function to parse a positive integer
+    query parameter
+    """
+    value = int(value)
+    if value <= 0:
+        raise ValueError(f'{value} is not positive')
+    return value
+
+
 def dateconvert(o):
     """
     Helper function to convert datetime
@@ -625,6 +1032,9 @@ if __name__ == "__main__":
         print("Starting dev server...")
         app.run(host='localhost', debug=True)
     elif os.environ['APP_CONFIG_ENV'] == 'config.ProductionConfig':
+        # Serve with gunicorn's pre-fork workers, see gunicorn.conf.py
         print("Starting production server...")
-        app.run(host='localhost', debug=False)
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        os.execvp('gunicorn', ['gunicorn', '-c', 'gunicorn.conf.py',
+                               'webservice:app'])
 